@@ -0,0 +1,30 @@
+"""Image Proxy Client 包"""
+from .client import (
+    ImageProxyClient,
+    RetryPolicy,
+    CircuitBreaker,
+    CircuitOpenError,
+    get_shared_client,
+    configure_shared_clients,
+    close_shared_clients,
+    quick_upload,
+    calculate_md5,
+    hash_files,
+    upload_or_get,
+    get_image_url,
+)
+
+__all__ = [
+    "ImageProxyClient",
+    "RetryPolicy",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "get_shared_client",
+    "configure_shared_clients",
+    "close_shared_clients",
+    "quick_upload",
+    "calculate_md5",
+    "hash_files",
+    "upload_or_get",
+    "get_image_url",
+]
@@ -0,0 +1,35 @@
+"""
+Image Proxy Client 命令行入口
+
+用法:
+    python -m client sync <dir> [选项]
+    python -m client mirror [本地镜像.db] [选项]
+"""
+import argparse
+import sys
+
+from .mirror import add_mirror_arguments, run_mirror
+from .sync import add_sync_arguments, run_sync
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m client", description="Image Proxy 客户端命令行工具")
+    subparsers = parser.add_subparsers(dest="command")
+
+    sync_parser = subparsers.add_parser("sync", help="增量同步目录中的图片")
+    add_sync_arguments(sync_parser)
+    sync_parser.set_defaults(func=run_sync)
+
+    mirror_parser = subparsers.add_parser("mirror", help="增量同步服务器图片元数据到本地数据库")
+    add_mirror_arguments(mirror_parser)
+    mirror_parser.set_defaults(func=run_mirror)
+
+    args = parser.parse_args(argv)
+    if not getattr(args, "func", None):
+        parser.print_help()
+        return 1
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,18 @@
 """Image Proxy Client - 统一客户端"""
+import atexit
 import hashlib
 import requests
 import os
+import random
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 import json
-from typing import Optional, Dict, Any, Union
-
-
-"""Image Proxy Client - 统一客户端"""
-import hashlib
-import requests
-import os
-import logging
-from pathlib import Path
-import json
-from typing import Optional, Dict, Any, Union
+from typing import Optional, Dict, Any, Union, List, Iterator
 
 # 禁用requests的警告
 try:
@@ -25,6 +22,260 @@ except (ImportError, AttributeError):
     pass
 
 
+class CircuitOpenError(requests.RequestException):
+    """熔断器打开时抛出，表示服务端不可用，请求被快速拒绝"""
+    pass
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    指数退避 + 全抖动（full jitter），优先遵循服务器返回的 Retry-After。
+    重试 /info 和上传都是幂等的：图片按MD5寻址，重复上传只会得到 existing。
+    """
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 30.0,
+                 retry_statuses: Optional[set] = None,
+                 max_retry_after: float = 120.0):
+        """
+        Args:
+            max_retries: 最大重试次数（不含首次请求），0 表示不重试
+            backoff_base: 退避基数（秒），第n次重试的等待上限为 base * 2^n
+            backoff_max: 单次退避等待上限（秒）
+            retry_statuses: 需要重试的HTTP状态码
+            max_retry_after: Retry-After 的最大遵循值（秒）
+        """
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = retry_statuses or {429, 500, 502, 503, 504}
+        self.max_retry_after = max_retry_after
+
+    def is_retryable_status(self, status_code: int) -> bool:
+        return status_code in self.retry_statuses
+
+    def get_wait(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """计算第 attempt 次重试前的等待时间（attempt 从0开始）"""
+        if response is not None:
+            retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.max_retry_after)
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        # 全抖动：把大量客户端的重试打散，避免服务重启后的惊群
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析 Retry-After（秒数或HTTP日期）"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到阈值后进入 open 状态，在 recovery_timeout 内直接拒绝请求；
+    超时后进入 half_open，放行一个探测请求，成功则恢复，失败则重新打开。
+    可在多个客户端之间共享。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        """是否允许发出请求"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # half_open：只放行一个探测请求
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """请求被调用方中断（如 Ctrl-C），既不算成功也不算失败：只清除半开状态的探测标记"""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+# -------------------------------
+# 文件哈希
+# -------------------------------
+
+# 哈希读缓冲区大小：大缓冲区减少 Python 层循环次数，hashlib 在 update 期间释放GIL
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# 批量查询 /info/batch 每批MD5数（服务器上限1000）
+INFO_BATCH_SIZE = 200
+
+# 批量上传 /upload/batch 每次最多文件数（服务器上限100）
+UPLOAD_BATCH_SIZE = 100
+
+# 不小于该大小的文件使用分片续传
+RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+
+
+def _md5_file(file_path: Union[str, Path]) -> str:
+    """计算文件MD5（Python 3.11+ 使用 hashlib.file_digest，否则使用 readinto 大缓冲区）"""
+    with open(file_path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "md5").hexdigest()
+        
+        md5_hash = hashlib.md5()
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            md5_hash.update(view[:n])
+        return md5_hash.hexdigest()
+
+
+class HashStats:
+    """哈希吞吐量统计（线程安全）"""
+    
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self._start: Optional[float] = None
+        self._end: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def record(self, size: int, start: float, end: float) -> None:
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            self._start = start if self._start is None else min(self._start, start)
+            self._end = end if self._end is None else max(self._end, end)
+    
+    @property
+    def seconds(self) -> float:
+        if self._start is None:
+            return 0.0
+        return self._end - self._start
+    
+    @property
+    def mb_per_s(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / 1024 / 1024 / self.seconds
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "mb_per_s": round(self.mb_per_s, 1),
+        }
+
+
+def _timed_md5(file_path: Union[str, Path], stats: HashStats) -> str:
+    """计算MD5并记录吞吐量"""
+    start = time.monotonic()
+    md5 = _md5_file(file_path)
+    stats.record(os.path.getsize(file_path), start, time.monotonic())
+    return md5
+
+
+def hash_files(paths: List[Union[str, Path]], workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    多线程并行计算一批文件的MD5
+    
+    Args:
+        paths: 文件路径列表
+        workers: 线程数，默认为CPU核数
+        
+    Returns:
+        {"md5": {路径: MD5}, "errors": {路径: 错误信息}, "stats": 吞吐量统计}
+    """
+    stats = HashStats()
+    md5s: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    workers = workers or os.cpu_count() or 4
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_timed_md5, p, stats): str(p) for p in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                md5s[path] = future.result()
+            except OSError as e:
+                errors[path] = str(e)
+    
+    logging.getLogger("image_proxy_client").info(
+        f"哈希完成: {stats.files} 个文件, {stats.bytes / 1024 / 1024:.1f} MB, {stats.mb_per_s:.1f} MB/s"
+    )
+    return {"md5": md5s, "errors": errors, "stats": stats.to_dict()}
+
+
+def _error_detail(response: requests.Response) -> str:
+    """取出错误响应中的 detail"""
+    try:
+        return response.json().get("detail", f"HTTP {response.status_code}")
+    except ValueError:
+        return f"HTTP {response.status_code}: {response.text}"
+
+
+def _missing_chunks(received: List[List[int]], size: int, chunk_size: int) -> List[tuple]:
+    """根据已收到的字节范围计算缺失的分片 [(offset, length), ...]"""
+    missing = []
+    for offset in range(0, size, chunk_size):
+        if not any(start <= offset < end for start, end in received):
+            missing.append((offset, min(chunk_size, size - offset)))
+    return missing
+
+
 class ImageProxyClient:
     """
     图片代理客户端
@@ -38,7 +289,10 @@ class ImageProxyClient:
                  password: Optional[str] = None,
                  config_file: Optional[str] = None,
                  timeout: int = 30,
-                 verify_ssl: bool = True):
+                 verify_ssl: bool = True,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 pool_size: int = 10):
         """
         初始化客户端
         
@@ -49,6 +303,9 @@ class ImageProxyClient:
             config_file: 配置文件路径，优先级低于直接参数
             timeout: 请求超时时间（秒）
             verify_ssl: 是否验证SSL证书
+            retry_policy: 重试策略，默认最多重试3次；传入 RetryPolicy(max_retries=0) 关闭重试
+            circuit_breaker: 熔断器，可在多个客户端之间共享
+            pool_size: 连接池大小（同一客户端被多线程共享时的最大保活连接数）
         """
         # 初始化配置
         if server_url and username and password:
@@ -65,16 +322,36 @@ class ImageProxyClient:
         
         self.timeout = timeout
         self.verify_ssl = verify_ssl
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        
+        # 最近一次请求的每次尝试记录，按线程隔离
+        self._local = threading.local()
+        self.last_batch_stats: Dict[str, Any] = {}
+        # 旧版服务器没有 /info/batch 时退回逐个查询
+        self._batch_info_supported = True
+        # 未完成的分片上传会话 (文件路径, MD5) -> upload_id，失败后再次上传同一文件时续传
+        self._upload_sessions: Dict[tuple, str] = {}
+        # 以上两项会被 upload_many 等的工作线程并发读写
+        self._state_lock = threading.Lock()
         
         # 创建session复用连接
         self.session = requests.Session()
         self.session.verify = verify_ssl
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         
         # 初始化日志
         self.logger = self._setup_logger()
         
         self.logger.info("图片代理客户端初始化完成")
     
+    @property
+    def last_attempts(self) -> List[Dict[str, Any]]:
+        """当前线程最近一次请求的每次尝试记录（attempt、status、elapsed、wait、error）"""
+        return getattr(self._local, "attempts", [])
+    
     def _load_config(self, config_file: Optional[str] = None) -> Dict[str, Any]:
         """加载配置文件"""
         if config_file is None:
@@ -111,24 +388,102 @@ class ImageProxyClient:
             logger.setLevel(logging.INFO)
         return logger
     
+    def _request(self, method: str, path: str, rewind=None, **kwargs) -> requests.Response:
+        """
+        带重试和熔断的请求
+        
+        Args:
+            method: HTTP方法
+            path: 接口路径（如 /upload）
+            rewind: 需要在每次尝试前回到开头的文件对象或其列表（上传重试时使用）
+            **kwargs: 传给 requests.Session.request 的参数
+            
+        Returns:
+            最后一次尝试的响应（可能仍是可重试的错误状态）
+            
+        Raises:
+            CircuitOpenError: 熔断器打开
+            requests.RequestException: 重试耗尽后的网络异常
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = f"{self.server_url}{path}"
+        policy = self.retry_policy
+        attempts: List[Dict[str, Any]] = []
+        self._local.attempts = attempts
+        
+        for attempt in range(policy.max_retries + 1):
+            if not self.circuit_breaker.allow_request():
+                raise CircuitOpenError(f"服务不可用（熔断中）: {self.server_url}")
+            
+            record: Dict[str, Any] = {"attempt": attempt + 1, "status": None, "error": None, "wait": 0.0}
+            attempts.append(record)
+            start = time.monotonic()
+            try:
+                if rewind is not None:
+                    for f in (rewind if isinstance(rewind, list) else [rewind]):
+                        f.seek(0)
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                record["elapsed"] = time.monotonic() - start
+                record["error"] = str(e)
+                self.circuit_breaker.record_failure()
+                if attempt >= policy.max_retries:
+                    raise
+                wait = policy.get_wait(attempt)
+            except Exception as e:
+                # 其他异常（如 ChunkedEncodingError、文件 seek 失败）不重试，但必须记录失败，
+                # 否则半开状态的探测标记不会被清除，熔断器将永远拒绝请求
+                record["elapsed"] = time.monotonic() - start
+                record["error"] = str(e)
+                self.circuit_breaker.record_failure()
+                raise
+            except BaseException:
+                # KeyboardInterrupt、SystemExit 不是服务端故障
+                self.circuit_breaker.release_probe()
+                raise
+            else:
+                record["elapsed"] = time.monotonic() - start
+                record["status"] = response.status_code
+                if response.status_code >= 500:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                if not policy.is_retryable_status(response.status_code) or attempt >= policy.max_retries:
+                    return response
+                wait = policy.get_wait(attempt, response)
+                response.close()
+            
+            record["wait"] = wait
+            self.logger.warning(
+                f"{method} {path} 第{attempt + 1}次尝试失败"
+                f"（{record['status'] or record['error']}），{wait:.2f}s 后重试"
+            )
+            time.sleep(wait)
+        
+        raise AssertionError("unreachable")
+    
     def get_file_md5(self, file_path: Union[str, Path]) -> str:
         """计算文件MD5"""
         file_path = Path(file_path)
         if not file_path.exists():
             raise FileNotFoundError(f"文件不存在: {file_path}")
         
-        md5_hash = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
+        return _md5_file(file_path)
     
-    def upload_image(self, image_path: Union[str, Path]) -> Dict[str, Any]:
+    def upload_image(self,
+                     image_path: Union[str, Path],
+                     md5: Optional[str] = None,
+                     near_duplicate: Optional[int] = None) -> Dict[str, Any]:
         """
         上传图片到服务器
         
+        请求头预先声明内容MD5和大小（秒传）：服务器已有相同内容时直接返回 existing，
+        否则边接收边校验，传输中损坏的内容会被拒绝。
+        
         Args:
             image_path: 图片文件路径
+            md5: 已计算好的MD5，为空时现场计算
+            near_duplicate: 近似重复的最大感知哈希距离；服务器已有近似图片时返回 status=similar 的已有图片
             
         Returns:
             包含url、md5等信息的字典
@@ -151,15 +506,24 @@ class ImageProxyClient:
             "password": self.password
         }
         
+        if near_duplicate is not None:
+            params["near_duplicate"] = near_duplicate
+        
+        headers = {
+            "X-Content-MD5": md5 or self.get_file_md5(image_path),
+            "X-Content-Size": str(image_path.stat().st_size)
+        }
+        
         try:
             with open(image_path, 'rb') as f:
                 files = {"file": (image_path.name, f, "application/octet-stream")}
                 
-                response = self.session.post(
-                    f"{self.server_url}/upload",
+                response = self._request(
+                    "POST", "/upload",
+                    rewind=f,
                     files=files,
                     params=params,
-                    timeout=self.timeout
+                    headers=headers
                 )
             
             # 检查响应状态
@@ -179,18 +543,201 @@ class ImageProxyClient:
                     error_msg = f'HTTP {response.status_code}: {response.text}'
                 raise ValueError(f"上传失败: {error_msg}")
                 
+        except CircuitOpenError:
+            raise
         except requests.RequestException as e:
             raise requests.RequestException(f"网络请求失败: {e}")
     
-    def upload_or_get(self, file_path: Union[str, Path]) -> Dict[str, Any]:
-        """上传图片或获取已存在信息"""
+    def upload_bytes(self, data: bytes, name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        上传内存中的图片（如程序生成的图片），通过 PUT /objects/{md5} 直接发送原始字节
+        
+        Args:
+            data: 图片内容
+            name: 原始文件名，为空时服务器以MD5命名
+            
+        Returns:
+            同 upload_image
+        """
+        md5 = hashlib.md5(data).hexdigest()
+        params = {
+            "username": self.username,
+            "password": self.password
+        }
+        if name:
+            params["name"] = name
+        
+        response = self._request(
+            "PUT", f"/objects/{md5}",
+            params=params,
+            data=data,
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        if response.status_code == 200:
+            return response.json()
+        elif response.status_code == 403:
+            raise ValueError("认证失败")
+        raise ValueError(f"上传失败: {_error_detail(response)}")
+    
+    def upload_resumable(self,
+                         image_path: Union[str, Path],
+                         md5: Optional[str] = None,
+                         workers: int = 4,
+                         max_rounds: int = 5) -> Dict[str, Any]:
+        """
+        分片续传上传（大文件、不稳定网络）
+        
+        创建会话后并行上传分片，服务器返回 409（分片不完整）或个别分片失败时查询已收到的范围，
+        只补传缺失的分片。同一客户端再次上传同一文件时续用未完成的会话。
+        服务器不支持分片上传时退回 upload_image。
+        
+        Args:
+            image_path: 图片文件路径
+            md5: 已计算好的MD5，为空时现场计算
+            workers: 并行上传的分片数
+            max_rounds: 最多补传轮数
+            
+        Returns:
+            同 upload_image
+        """
+        image_path = Path(image_path)
+        if not image_path.is_file():
+            raise FileNotFoundError(f"图片文件不存在: {image_path}")
+        md5 = md5 or self.get_file_md5(image_path)
+        size = image_path.stat().st_size
+        params = {
+            "username": self.username,
+            "password": self.password
+        }
+        key = (str(image_path.resolve()), md5)
+        
+        session = None
+        with self._state_lock:
+            upload_id = self._upload_sessions.get(key)
+        if upload_id:
+            response = self._request("GET", f"/uploads/{upload_id}", params=params)
+            if response.status_code == 200:
+                session = response.json()
+                self.logger.info(f"续传会话 {upload_id}: 已收到 {session['received_bytes']}/{size} 字节")
+        
+        if session is None:
+            response = self._request("POST", "/uploads", params={
+                **params, "filename": image_path.name, "size": size, "md5": md5
+            })
+            if response.status_code in (404, 405):
+                self.logger.info("服务器不支持分片上传，改为普通上传")
+                return self.upload_image(image_path, md5)
+            if response.status_code != 200:
+                raise ValueError(f"创建上传会话失败: {_error_detail(response)}")
+            session = response.json()
+            if session.get("status") == "existing":
+                return session
+            upload_id = session["upload_id"]
+            with self._state_lock:
+                self._upload_sessions[key] = upload_id
+        
+        last_error: Optional[Exception] = None
+        for _ in range(max_rounds):
+            missing = _missing_chunks(session["received"], size, session["chunk_size"])
+            if missing:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(self._put_chunk, image_path, upload_id, offset, length)
+                               for offset, length in missing]
+                    errors = [f.exception() for f in futures if f.exception()]
+                if errors:
+                    last_error = errors[0]
+                    if any(isinstance(e, CircuitOpenError) for e in errors):
+                        raise last_error
+                    self.logger.warning(f"{len(errors)}/{len(missing)} 个分片上传失败，查询进度后补传: {last_error}")
+                    response = self._request("GET", f"/uploads/{upload_id}", params=params)
+                    if response.status_code != 200:
+                        break
+                    session = response.json()
+                    continue
+            
+            response = self._request("POST", f"/uploads/{upload_id}/complete", params={**params, "md5": md5})
+            if response.status_code == 200:
+                with self._state_lock:
+                    self._upload_sessions.pop(key, None)
+                return response.json()
+            if response.status_code != 409:
+                with self._state_lock:
+                    self._upload_sessions.pop(key, None)
+                raise ValueError(f"完成分片上传失败: {_error_detail(response)}")
+            response = self._request("GET", f"/uploads/{upload_id}", params=params)
+            if response.status_code != 200:
+                break
+            session = response.json()
+        
+        raise ValueError(f"分片上传未完成（会话 {upload_id} 可稍后续传）: {last_error}")
+    
+    def _put_chunk(self, image_path: Path, upload_id: str, offset: int, length: int) -> None:
+        """上传一个分片"""
+        with open(image_path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        response = self._request(
+            "PUT", f"/uploads/{upload_id}",
+            params={"username": self.username, "password": self.password, "offset": offset},
+            data=data,
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        if response.status_code != 200:
+            raise ValueError(f"分片 {offset} 上传失败: {_error_detail(response)}")
+    
+    def upload_batch(self, image_paths: List[Union[str, Path]]) -> List[Dict[str, Any]]:
+        """
+        通过 /upload/batch 一次请求上传多张图片
+        
+        Args:
+            image_paths: 图片路径列表（不超过 UPLOAD_BATCH_SIZE 个）
+            
+        Returns:
+            与 image_paths 顺序一致的结果列表，失败项为 {"status": "error", "error": ...}
+            
+        Raises:
+            requests.RequestException: 网络请求异常
+            ValueError: 服务器响应异常
+        """
+        if len(image_paths) > UPLOAD_BATCH_SIZE:
+            raise ValueError(f"单次最多上传 {UPLOAD_BATCH_SIZE} 个文件")
+        
+        params = {
+            "username": self.username,
+            "password": self.password
+        }
+        
+        with ExitStack() as stack:
+            handles = [stack.enter_context(open(path, "rb")) for path in image_paths]
+            files = [("files", (Path(path).name, f, "application/octet-stream"))
+                     for path, f in zip(image_paths, handles)]
+            response = self._request("POST", "/upload/batch", rewind=handles, files=files, params=params)
+        
+        if response.status_code == 200:
+            return response.json()
+        elif response.status_code == 403:
+            raise ValueError("认证失败")
+        raise ValueError(f"批量上传失败: {_error_detail(response)}")
+    
+    def upload_or_get(self,
+                      file_path: Union[str, Path],
+                      md5: Optional[str] = None,
+                      check_existing: bool = True) -> Dict[str, Any]:
+        """
+        上传图片或获取已存在信息
+        
+        Args:
+            file_path: 图片文件路径
+            md5: 已计算好的MD5，为空时现场计算
+            check_existing: 是否先查询服务器是否已有（已通过 get_images_info 批量确认不存在时传 False）
+        """
         try:
             file_path = Path(file_path)
             if not file_path.exists():
                 return {"error": f"文件不存在: {file_path}"}
             
             # 计算MD5
-            md5 = self.get_file_md5(file_path)
+            md5 = md5 or self.get_file_md5(file_path)
             self.logger.info(f"处理文件: {file_path.name}, MD5: {md5}")
             
             # 准备请求参数
@@ -199,33 +746,38 @@ class ImageProxyClient:
                 "password": self.password
             }
             
-            # 先查询服务器是否已有
-            try:
-                self.logger.debug(f"查询服务器图片信息: {md5}")
-                response = self.session.get(
-                    f"{self.server_url}/info/{md5}",
-                    params=params,
-                    timeout=10
-                )
+            # 先查询服务器是否已有（批量查询已确认不存在时跳过）
+            if check_existing:
+                try:
+                    self.logger.debug(f"查询服务器图片信息: {md5}")
+                    response = self._request(
+                        "GET", f"/info/{md5}",
+                        params=params,
+                        timeout=10
+                    )
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    self.logger.info(f"服务器已有图片: {md5}")
-                    return result
+                    if response.status_code == 200:
+                        result = response.json()
+                        self.logger.info(f"服务器已有图片: {md5}")
+                        return result
                     
-                elif response.status_code == 403:
-                    return {"error": "该用户权限不足，请联系管理员"}
+                    elif response.status_code == 403:
+                        return {"error": "该用户权限不足，请联系管理员"}
                     
-                elif response.status_code != 404:
-                    return {"error": f"查询失败: {response.status_code} - {response.text}"}
+                    elif response.status_code != 404:
+                        return {"error": f"查询失败: {response.status_code} - {response.text}"}
                     
-            except requests.RequestException as e:
-                self.logger.warning(f"查询图片信息失败: {e}")
-                # 继续尝试上传
+                except CircuitOpenError:
+                    raise
+                except requests.RequestException as e:
+                    self.logger.warning(f"查询图片信息失败: {e}")
+                    # 继续尝试上传
             
-            # 图片不存在，开始上传
+            # 图片不存在，开始上传（大文件分片续传）
             self.logger.info(f"开始上传文件: {file_path.name}")
-            return self.upload_image(file_path)
+            if file_path.stat().st_size >= RESUMABLE_THRESHOLD:
+                return self.upload_resumable(file_path, md5)
+            return self.upload_image(file_path, md5)
                 
         except requests.RequestException as e:
             error_msg = f"网络请求失败: {e}"
@@ -237,6 +789,101 @@ class ImageProxyClient:
             self.logger.error(error_msg)
             return {"error": error_msg}
     
+    def upload_many(self,
+                    paths: List[Union[str, Path]],
+                    hash_workers: Optional[int] = None,
+                    upload_workers: int = 4) -> Dict[str, Dict[str, Any]]:
+        """
+        批量上传：哈希、批量查重与上传流水线并行
+        
+        哈希线程池算完的MD5每攒够 INFO_BATCH_SIZE 个就通过 /info/batch 查询一次，
+        服务器已有的直接返回，不存在的立即交给上传线程池；内容相同的文件只上传一次。
+        吞吐量统计保存在 self.last_batch_stats。
+        
+        Args:
+            paths: 图片路径列表
+            hash_workers: 哈希线程数，默认为CPU核数
+            upload_workers: 并发上传数
+            
+        Returns:
+            {路径: upload_or_get 的结果}
+        """
+        start = time.monotonic()
+        hash_stats = HashStats()
+        results: Dict[str, Dict[str, Any]] = {}
+        resolved: Dict[str, Dict[str, Any]] = {}   # md5 -> 结果
+        waiting: Dict[str, List[str]] = {}         # 查询或上传中的 md5 -> 路径列表
+        batch: List[str] = []
+        counters = {"lookups": 0, "existing": 0, "uploaded": 0}
+        
+        with ThreadPoolExecutor(max_workers=hash_workers or os.cpu_count() or 4) as hash_pool, \
+                ThreadPoolExecutor(max_workers=upload_workers) as upload_pool:
+            upload_futures = {}
+            
+            def flush():
+                if not batch:
+                    return
+                try:
+                    info = self.get_images_info(batch)
+                    counters["lookups"] += 1
+                except (requests.RequestException, ValueError) as e:
+                    # 批量查询失败时由 upload_or_get 逐个查询
+                    self.logger.warning(f"批量查询图片信息失败: {e}")
+                    info = None
+                
+                for md5 in batch:
+                    if info is not None and md5 in info["found"]:
+                        resolved[md5] = info["found"][md5]
+                        counters["existing"] += 1
+                        for path in waiting.pop(md5):
+                            results[path] = resolved[md5]
+                    else:
+                        future = upload_pool.submit(self.upload_or_get, waiting[md5][0], md5,
+                                                    check_existing=info is None)
+                        upload_futures[future] = md5
+                batch.clear()
+            
+            hash_futures = {hash_pool.submit(_timed_md5, p, hash_stats): str(p) for p in paths}
+            for future in as_completed(hash_futures):
+                path = hash_futures[future]
+                try:
+                    md5 = future.result()
+                except OSError as e:
+                    results[path] = {"error": f"文件读取失败: {e}"}
+                    continue
+                
+                if md5 in resolved:
+                    results[path] = resolved[md5]
+                elif md5 in waiting:
+                    waiting[md5].append(path)
+                else:
+                    waiting[md5] = [path]
+                    batch.append(md5)
+                    if len(batch) >= INFO_BATCH_SIZE:
+                        flush()
+            flush()
+            
+            for future in as_completed(upload_futures):
+                md5 = upload_futures[future]
+                resolved[md5] = future.result()
+                counters["uploaded"] += 1
+                for path in waiting.pop(md5):
+                    results[path] = resolved[md5]
+        
+        self.last_batch_stats = {
+            "files": len(results),
+            "failed": sum(1 for r in results.values() if "error" in r),
+            "elapsed": round(time.monotonic() - start, 3),
+            "hash": hash_stats.to_dict(),
+            **counters,
+        }
+        self.logger.info(
+            f"批量上传完成: {len(results)} 个文件, 已存在 {counters['existing']}, "
+            f"上传 {counters['uploaded']}, 哈希 {hash_stats.mb_per_s:.1f} MB/s, "
+            f"总耗时 {self.last_batch_stats['elapsed']}s"
+        )
+        return results
+    
     def get_image_url(self, image_path: Union[str, Path]) -> str:
         """
         上传图片并直接返回URL (简化接口)
@@ -269,11 +916,7 @@ class ImageProxyClient:
             "password": self.password
         }
         
-        response = self.session.get(
-            f"{self.server_url}/info/{md5}",
-            params=params,
-            timeout=self.timeout
-        )
+        response = self._request("GET", f"/info/{md5}", params=params)
         
         if response.status_code == 200:
             return response.json()
@@ -284,6 +927,224 @@ class ImageProxyClient:
         else:
             raise ValueError(f"获取信息失败: HTTP {response.status_code}")
     
+    def get_transform_url(self,
+                          md5: str,
+                          width: Optional[int] = None,
+                          height: Optional[int] = None,
+                          fit: Optional[str] = None,
+                          format: Optional[str] = None,
+                          quality: Optional[int] = None) -> str:
+        """
+        获取派生图片URL（缩放/转换格式，参数由服务器签名）
+        
+        Args:
+            md5: 图片MD5值
+            width/height: 输出尺寸
+            fit: contain（默认）/cover/fill
+            format: jpeg/png/webp，默认沿用原图格式
+            quality: 输出质量 1-100
+            
+        Returns:
+            图片访问URL
+        """
+        params = {
+            "username": self.username,
+            "password": self.password,
+            "w": width,
+            "h": height,
+            "fit": fit,
+            "fmt": format,
+            "q": quality
+        }
+        response = self._request("GET", f"/url/{md5}",
+                                 params={k: v for k, v in params.items() if v is not None})
+        if response.status_code == 200:
+            return response.json()["url"]
+        elif response.status_code == 404:
+            raise ValueError("图片不存在")
+        elif response.status_code == 403:
+            raise ValueError("认证失败")
+        else:
+            raise ValueError(f"获取图片URL失败: {_error_detail(response)}")
+    
+    def get_images_info(self, md5s: List[str]) -> Dict[str, Any]:
+        """
+        批量查询图片信息（每 INFO_BATCH_SIZE 个MD5一次请求）
+        
+        服务器不支持 /info/batch 时自动退回逐个 GET /info/{md5}。
+        
+        Args:
+            md5s: MD5列表
+            
+        Returns:
+            {"found": {md5: 图片信息}, "missing": [md5, ...]}
+        """
+        params = {
+            "username": self.username,
+            "password": self.password
+        }
+        found: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        unique = list(dict.fromkeys(md5s))
+        
+        for i in range(0, len(unique), INFO_BATCH_SIZE):
+            chunk = unique[i:i + INFO_BATCH_SIZE]
+            with self._state_lock:
+                batch_supported = self._batch_info_supported
+            if batch_supported:
+                response = self._request("POST", "/info/batch", params=params, json={"md5s": chunk})
+                if response.status_code == 200:
+                    data = response.json()
+                    found.update(data["found"])
+                    missing.extend(data["missing"])
+                    continue
+                if response.status_code in (404, 405):
+                    self.logger.info("服务器不支持批量查询，改为逐个查询")
+                    with self._state_lock:
+                        self._batch_info_supported = False
+                elif response.status_code == 403:
+                    raise ValueError("认证失败")
+                else:
+                    raise ValueError(f"批量查询失败: HTTP {response.status_code}")
+            
+            for md5 in chunk:
+                response = self._request("GET", f"/info/{md5}", params=params)
+                if response.status_code == 200:
+                    found[md5] = response.json()
+                elif response.status_code == 404:
+                    missing.append(md5)
+                elif response.status_code == 403:
+                    raise ValueError("认证失败")
+                else:
+                    raise ValueError(f"查询失败: HTTP {response.status_code}")
+        
+        return {"found": found, "missing": missing}
+    
+    def iter_images(self, page_size: int = 500, **filters) -> Iterator[Dict[str, Any]]:
+        """
+        逐条遍历服务器上的图片（按上传时间），按需跟随游标翻页
+        
+        Args:
+            page_size: 每页数量（最大1000）
+            **filters: min_size/max_size、min_width/max_width、min_height/max_height、
+                       min_access/max_access、name_prefix
+            
+        Yields:
+            图片信息字典（md5、created_at、original_name、width、height、access_count、file_size）
+        """
+        cursor = None
+        while True:
+            params = {
+                "username": self.username,
+                "password": self.password,
+                "limit": page_size,
+                **{k: v for k, v in filters.items() if v is not None}
+            }
+            if cursor:
+                params["cursor"] = cursor
+            
+            response = self._request("GET", "/images", params=params)
+            if response.status_code == 403:
+                raise ValueError("认证失败")
+            if response.status_code != 200:
+                raise ValueError(f"获取图片列表失败: HTTP {response.status_code}")
+            
+            page = response.json()
+            yield from page["items"]
+            cursor = page.get("next_cursor")
+            if not cursor:
+                return
+    
+    def search_images(self, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+        """
+        按原始文件名片段搜索图片
+        
+        Returns:
+            {"items": [...], "has_more": bool, "next_offset": 下一页偏移或 None}
+        """
+        params = {
+            "username": self.username,
+            "password": self.password,
+            "q": query,
+            "limit": limit,
+            "offset": offset
+        }
+        response = self._request("GET", "/search", params=params)
+        if response.status_code == 403:
+            raise ValueError("认证失败")
+        if response.status_code != 200:
+            raise ValueError(f"搜索图片失败: HTTP {response.status_code}")
+        return response.json()
+    
+    def find_similar(self, md5: str, max_distance: int = 6, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        查找近似重复的图片（重新编码、缩放、去除元数据后的同一张图）
+        
+        Args:
+            md5: 图片MD5值
+            max_distance: 感知哈希最大汉明距离（0-11）
+            limit: 最多返回数量
+            
+        Returns:
+            图片信息列表（带 md5 和 distance），按距离升序
+        """
+        params = {
+            "username": self.username,
+            "password": self.password,
+            "max_distance": max_distance,
+            "limit": limit
+        }
+        response = self._request("GET", f"/similar/{md5}", params=params)
+        if response.status_code == 200:
+            return response.json()["items"]
+        elif response.status_code == 404:
+            raise ValueError("图片不存在")
+        elif response.status_code == 403:
+            raise ValueError("认证失败")
+        else:
+            raise ValueError(f"近似图片查询失败: {_error_detail(response)}")
+    
+    def get_changes(self, since: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        """
+        获取游标之后的元数据变更（增量同步）
+        
+        Args:
+            since: 上次同步得到的游标，0 表示全量
+            limit: 单次最多返回的变更数
+            
+        Returns:
+            {"changes": [...], "cursor": 新游标, "has_more": bool, "reset": bool}
+        """
+        params = {
+            "username": self.username,
+            "password": self.password,
+            "since": since,
+            "limit": limit,
+            "format": "ndjson"
+        }
+        
+        response = self._request("GET", "/changes", params=params, stream=True)
+        if response.status_code == 403:
+            raise ValueError("认证失败")
+        if response.status_code != 200:
+            raise ValueError(f"获取变更失败: HTTP {response.status_code}")
+        
+        changes = []
+        trailer: Dict[str, Any] = {}
+        for line in response.iter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            if "seq" in item:
+                changes.append(item)
+            else:
+                trailer = item
+        
+        if "cursor" not in trailer:
+            raise ValueError("变更数据不完整")
+        trailer["changes"] = changes
+        return trailer
+    
     def is_healthy(self) -> bool:
         """
         检查服务健康状态
@@ -310,6 +1171,68 @@ class ImageProxyClient:
         self.close()
 
 
+# -------------------------------
+# 共享客户端
+# -------------------------------
+
+_shared_clients: Dict[tuple, ImageProxyClient] = {}
+_shared_lock = threading.Lock()
+_shared_pool_size = 10
+
+
+def configure_shared_clients(pool_size: int = 10) -> None:
+    """
+    设置共享客户端的连接池大小，对之后新建的共享客户端生效
+    
+    Args:
+        pool_size: 每个共享客户端的最大保活连接数
+    """
+    global _shared_pool_size
+    _shared_pool_size = pool_size
+
+
+def get_shared_client(server_url: Optional[str] = None,
+                      username: Optional[str] = None,
+                      password: Optional[str] = None,
+                      config_file: Optional[str] = None,
+                      timeout: int = 30) -> ImageProxyClient:
+    """
+    获取进程内共享的客户端（线程安全，按需创建）
+    
+    以 (服务器, 用户, 配置文件) 为键复用客户端，配置文件只解析一次，
+    循环调用时复用 keep-alive 连接。共享客户端由 close_shared_clients()
+    统一关闭（进程退出时自动调用），调用方不要单独 close。
+    """
+    if config_file is not None:
+        config_file = str(Path(config_file).resolve())
+    key = (server_url, username, password, config_file, timeout)
+    
+    client = _shared_clients.get(key)
+    if client is not None:
+        return client
+    
+    with _shared_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = ImageProxyClient(server_url, username, password,
+                                      config_file=config_file, timeout=timeout,
+                                      pool_size=_shared_pool_size)
+            _shared_clients[key] = client
+        return client
+
+
+def close_shared_clients() -> None:
+    """关闭并清空所有共享客户端"""
+    with _shared_lock:
+        clients = list(_shared_clients.values())
+        _shared_clients.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_shared_clients)
+
+
 # -------------------------------
 # 便捷函数
 # -------------------------------
@@ -333,11 +1256,8 @@ def quick_upload(server_url: str, username: str, password: str,
         >>> url = quick_upload("http://server.com", "user", "pass", "image.jpg")
         >>> print(f"图片URL: {url}")
     """
-    client = ImageProxyClient(server_url, username, password, timeout=timeout)
-    try:
-        return client.get_image_url(image_path)
-    finally:
-        client.close()
+    client = get_shared_client(server_url, username, password, timeout=timeout)
+    return client.get_image_url(image_path)
 
 
 def calculate_md5(file_path: Union[str, Path]) -> str:
@@ -350,11 +1270,7 @@ def calculate_md5(file_path: Union[str, Path]) -> str:
     Returns:
         MD5字符串
     """
-    md5_hash = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            md5_hash.update(chunk)
-    return md5_hash.hexdigest()
+    return _md5_file(file_path)
 
 
 # -------------------------------
@@ -367,11 +1283,8 @@ def upload_or_get(file_path: str, config_file: Optional[str] = None) -> Dict[str
     返回字典，包含 status、url、name、width、height、access_count、expire_at 等信息，
     或 error 键表示失败。
     """
-    client = ImageProxyClient(config_file=config_file)
-    try:
-        return client.upload_or_get(file_path)
-    finally:
-        client.close()
+    client = get_shared_client(config_file=config_file)
+    return client.upload_or_get(file_path)
 
 
 def get_image_url(file_path: str, config_file: Optional[str] = None) -> str:
@@ -379,11 +1292,8 @@ def get_image_url(file_path: str, config_file: Optional[str] = None) -> str:
     输入图片路径，返回完整可访问 URL。
     权限不足或出错时，返回提示字符串。
     """
-    client = ImageProxyClient(config_file=config_file)
-    try:
-        return client.get_image_url(file_path)
-    finally:
-        client.close()
+    client = get_shared_client(config_file=config_file)
+    return client.get_image_url(file_path)
 
 
 # -------------------------------
@@ -1,6 +1,9 @@
 import requests
 import os
 import json
+import time
+import hashlib
+import argparse
 
 # -------------------------------
 # 配置
@@ -25,36 +28,137 @@ if not USERNAME or not PASSWORD:
 # 本地保存文件名
 OUTPUT_FILE = "images_server.db"
 
+# 网络超时（连接, 读取）
+TIMEOUT = (10, 60)
+
+# 中断后自动续传的最大次数
+MAX_ATTEMPTS = 5
+
+# -------------------------------
+# 元数据（ETag、校验和）
+# -------------------------------
+def _meta_file(path):
+    return f"{path}.meta.json"
+
+
+def _load_meta(path):
+    try:
+        with open(_meta_file(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_meta(path, meta):
+    tmp_file = _meta_file(path) + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, _meta_file(path))
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _file_md5(path):
+    md5_hash = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5_hash.update(chunk)
+    return md5_hash.hexdigest()
+
 # -------------------------------
 # 下载数据库函数
 # -------------------------------
-def download_server_db(output_file=OUTPUT_FILE):
+def download_server_db(output_file=OUTPUT_FILE, force=False):
+    """
+    下载服务器数据库
+
+    - 本地文件与服务器一致时（ETag 未变）直接跳过
+    - 下载中断时保留 .part 文件，下次从断点续传（If-Range 保证续传的是同一版本）
+    - 完整下载时使用服务器支持的压缩传输
+    - 下载完成后校验MD5，再原子替换本地文件
+    """
     url = f"{SERVER}/download_db"
     params = {"username": USERNAME, "password": PASSWORD}
+    part_file = f"{output_file}.part"
 
-    try:
-        print(f"[INFO] 正在下载服务器数据库...")
-        r = requests.get(url, params=params, stream=True)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        meta = _load_meta(output_file)
+        part_meta = _load_meta(part_file)
+        headers = {}
+
+        if not force and os.path.exists(output_file) and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+
+        offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        if offset and part_meta.get("etag"):
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = part_meta["etag"]
+            # 续传只能基于未压缩的字节偏移
+            headers["Accept-Encoding"] = "identity"
+        else:
+            offset = 0
 
-        if r.status_code == 403:
-            print("[ERROR] 该用户权限不足，请联系管理员")
-            return False
-        r.raise_for_status()
+        try:
+            if offset:
+                print(f"[INFO] 从 {offset} 字节处续传服务器数据库（第{attempt}次尝试）...")
+            else:
+                print(f"[INFO] 正在下载服务器数据库...")
+            r = requests.get(url, params=params, headers=headers, stream=True, timeout=TIMEOUT)
 
-        with open(output_file, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+            if r.status_code == 403:
+                print("[ERROR] 该用户权限不足，请联系管理员")
+                return False
+            if r.status_code == 304:
+                print(f"[INFO] 服务器数据库未变化，跳过下载: {output_file}")
+                return True
+            if r.status_code == 416:
+                # 本地 .part 已失效，重新下载
+                _remove(part_file)
+                _remove(_meta_file(part_file))
+                continue
+            r.raise_for_status()
 
-        print(f"[INFO] 已成功下载服务器数据库到 {output_file}")
-        return True
+            etag = r.headers.get("ETag")
+            checksum = r.headers.get("X-Content-MD5")
+            mode = "ab" if r.status_code == 206 else "wb"
+            _save_meta(part_file, {"etag": etag, "md5": checksum})
 
-    except requests.RequestException as e:
-        print(f"[ERROR] 下载失败: {e}")
-        return False
+            with open(part_file, mode) as f:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    if chunk:
+                        f.write(chunk)
+
+            if checksum and _file_md5(part_file) != checksum:
+                print("[ERROR] 校验和不匹配，丢弃已下载内容")
+                _remove(part_file)
+                _remove(_meta_file(part_file))
+                continue
+
+            os.replace(part_file, output_file)
+            _save_meta(output_file, {"etag": etag, "md5": checksum})
+            _remove(_meta_file(part_file))
+
+            print(f"[INFO] 已成功下载服务器数据库到 {output_file}")
+            return True
+
+        except requests.RequestException as e:
+            print(f"[ERROR] 下载中断: {e}")
+            if attempt < MAX_ATTEMPTS:
+                time.sleep(min(30, 2 ** attempt))
+
+    print("[ERROR] 下载失败，已保留部分内容，下次运行将继续续传")
+    return False
 
 # -------------------------------
 # 主程序
 # -------------------------------
 if __name__ == "__main__":
-    download_server_db()
+    parser = argparse.ArgumentParser(description="下载服务器数据库")
+    parser.add_argument("--output", "-o", default=OUTPUT_FILE, help="本地保存文件名")
+    parser.add_argument("--force", "-f", action="store_true", help="忽略本地ETag，强制重新下载")
+    args = parser.parse_args()
+
+    download_server_db(args.output, force=args.force)
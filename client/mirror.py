@@ -0,0 +1,150 @@
+"""
+元数据增量镜像模块
+
+通过服务器的 /changes 接口把图片元数据同步到本地 SQLite 镜像，
+每次只拉取上次游标之后的新增、更新和删除，代替整库下载。
+"""
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+from client import ImageProxyClient
+
+
+logger = logging.getLogger("image_proxy_client.mirror")
+
+# 本地镜像默认文件名
+DEFAULT_MIRROR_FILE = "images_mirror.db"
+
+IMAGE_COLUMNS = ("md5", "path", "created_at", "original_name", "width", "height",
+                 "access_count", "file_size", "updated_at")
+
+
+class MetadataMirror:
+    """本地元数据镜像"""
+
+    def __init__(self, db_file: Union[str, Path] = DEFAULT_MIRROR_FILE):
+        self.db_file = Path(db_file)
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.row_factory = sqlite3.Row
+        self._init_db()
+
+    def _init_db(self) -> None:
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                md5 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                original_name TEXT,
+                width INTEGER,
+                height INTEGER,
+                access_count INTEGER DEFAULT 0,
+                file_size INTEGER DEFAULT 0,
+                updated_at INTEGER DEFAULT 0
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON images(created_at)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS mirror_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    @property
+    def cursor(self) -> int:
+        row = self.conn.execute("SELECT value FROM mirror_meta WHERE key = 'cursor'").fetchone()
+        return row["value"] if row else 0
+
+    def apply(self, changes: List[Dict[str, Any]], cursor: int) -> None:
+        """在一个事务中应用一页变更并推进游标"""
+        upserts = [tuple(change.get(col) for col in IMAGE_COLUMNS)
+                   for change in changes if change["op"] == "upsert"]
+        deletes = [(change["md5"],) for change in changes if change["op"] == "delete"]
+
+        with self.conn:
+            if upserts:
+                placeholders = ", ".join("?" * len(IMAGE_COLUMNS))
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO images ({', '.join(IMAGE_COLUMNS)}) VALUES ({placeholders})",
+                    upserts
+                )
+            if deletes:
+                self.conn.executemany("DELETE FROM images WHERE md5 = ?", deletes)
+            self._set_cursor(cursor)
+
+    def reset(self) -> None:
+        """清空镜像，下次从头同步"""
+        with self.conn:
+            self.conn.execute("DELETE FROM images")
+            self._set_cursor(0)
+
+    def _set_cursor(self, cursor: int) -> None:
+        self.conn.execute("""
+            INSERT INTO mirror_meta (key, value) VALUES ('cursor', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (cursor,))
+
+    def sync(self, client: ImageProxyClient, page_size: int = 1000) -> Dict[str, Any]:
+        """
+        从服务器拉取并应用所有新变更
+
+        Returns:
+            {"applied": 变更数, "pages": 页数, "cursor": 最新游标, "reset": 是否进行了全量重建}
+        """
+        start = time.time()
+        summary = {"applied": 0, "pages": 0, "cursor": self.cursor, "reset": False}
+        while True:
+            result = client.get_changes(since=self.cursor, limit=page_size)
+            if result.get("reset"):
+                logger.warning("服务器已清理游标之后的删除记录，重建本地镜像")
+                self.reset()
+                summary["reset"] = True
+                continue
+
+            self.apply(result["changes"], result["cursor"])
+            summary["applied"] += len(result["changes"])
+            summary["pages"] += 1
+            if not result["has_more"]:
+                break
+
+        summary["cursor"] = self.cursor
+        summary["elapsed"] = round(time.time() - start, 3)
+        return summary
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# -------------------------------
+# 命令行
+# -------------------------------
+
+def add_mirror_arguments(parser) -> None:
+    """为 mirror 子命令添加参数"""
+    parser.add_argument("output", nargs="?", default=DEFAULT_MIRROR_FILE, help="本地镜像数据库文件")
+    parser.add_argument("--config", "-c", help="配置文件路径")
+    parser.add_argument("--server", "-s", help="服务器地址")
+    parser.add_argument("--username", "-u", help="用户名")
+    parser.add_argument("--password", "-p", help="密码")
+    parser.add_argument("--page-size", type=int, default=1000, help="每页变更数（默认1000）")
+
+
+def run_mirror(args) -> int:
+    """执行 mirror 子命令"""
+    mirror = MetadataMirror(args.output)
+    try:
+        with ImageProxyClient(args.server, args.username, args.password, config_file=args.config) as client:
+            summary = mirror.sync(client, page_size=args.page_size)
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 镜像同步完成: 变更 {summary['applied']}, "
+              f"游标 {summary['cursor']}, 耗时 {summary['elapsed']}s"
+              + ("（已全量重建）" if summary["reset"] else ""))
+        return 0
+    except Exception as e:
+        print(f"❌ 镜像同步失败: {e}")
+        return 1
+    finally:
+        mirror.close()
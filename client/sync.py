@@ -0,0 +1,438 @@
+"""
+目录增量同步模块
+
+维护本地状态索引（路径、大小、修改时间、MD5、URL），每次同步只对新增或
+变化的文件计算MD5并上传。未变化的文件只需一次 stat 即可跳过，大目录的重复
+同步不再需要重新计算所有文件的哈希。
+
+支持单次同步和持续监听两种模式：安装了 watchdog 时使用系统文件事件
+（Linux 下为 inotify），否则退化为定时轮询。
+"""
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from client import ImageProxyClient
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+
+logger = logging.getLogger("image_proxy_client.sync")
+
+# 默认同步的图片扩展名
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+# 默认状态索引文件名（保存在同步目录下）
+DEFAULT_STATE_FILE = ".image_proxy_sync.json"
+
+# URL 剩余有效期不足该秒数时重新获取
+URL_REFRESH_MARGIN = 86400
+
+
+class SyncIndex:
+    """同步状态索引，以相对路径为键记录文件状态"""
+
+    VERSION = 1
+
+    def __init__(self, state_file: Path):
+        self.state_file = Path(state_file)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """加载索引文件，文件不存在或损坏时从空索引开始"""
+        if not self.state_file.exists():
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.entries = data.get("entries", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取同步索引失败，将重新建立: {e}")
+            self.entries = {}
+
+    def save(self) -> None:
+        """原子写入索引文件"""
+        tmp_file = self.state_file.with_name(self.state_file.name + ".tmp")
+        with self._lock:
+            data = {"version": self.VERSION, "entries": self.entries}
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def get(self, rel_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self.entries.get(rel_path)
+
+    def update(self, rel_path: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self.entries[rel_path] = entry
+
+    def remove(self, rel_path: str) -> None:
+        with self._lock:
+            self.entries.pop(rel_path, None)
+
+
+class DirectorySyncer:
+    """目录同步器"""
+
+    def __init__(self,
+                 root: Path,
+                 client_factory: Callable[[], ImageProxyClient],
+                 index: Optional[SyncIndex] = None,
+                 jobs: int = 4,
+                 extensions: Optional[set] = None):
+        """
+        Args:
+            root: 同步目录
+            client_factory: 创建客户端的工厂函数，每个工作线程持有一个客户端
+            index: 状态索引，默认使用目录下的 .image_proxy_sync.json
+            jobs: 并发上传数
+            extensions: 需要同步的文件扩展名
+        """
+        self.root = Path(root).resolve()
+        self.client_factory = client_factory
+        self.index = index or SyncIndex(self.root / DEFAULT_STATE_FILE)
+        self.jobs = max(1, jobs)
+        self.extensions = {e.lower() for e in (extensions or IMAGE_EXTENSIONS)}
+
+        self.file_count = 0
+        self._local = threading.local()
+        self._clients: List[ImageProxyClient] = []
+        self._clients_lock = threading.Lock()
+
+    def _get_client(self) -> ImageProxyClient:
+        """获取当前线程的客户端（requests.Session 不保证线程安全）"""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self.client_factory()
+            self._local.client = client
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def _walk(self) -> Dict[str, os.stat_result]:
+        """遍历目录，返回 {相对路径: stat结果}"""
+        found = {}
+        stack = [self.root]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(Path(entry.path))
+                        elif entry.is_file() and Path(entry.name).suffix.lower() in self.extensions:
+                            rel_path = Path(entry.path).relative_to(self.root).as_posix()
+                            found[rel_path] = entry.stat()
+            except OSError as e:
+                logger.warning(f"无法读取目录 {current}: {e}")
+        return found
+
+    def is_relevant(self, path: str) -> bool:
+        """
+        文件事件是否可能影响同步结果（与 _walk 的过滤规则一致）
+
+        状态索引默认保存在同步目录下，写入索引及其临时文件产生的事件需要忽略，
+        否则每次保存都会触发下一次同步。
+        """
+        resolved = Path(path).resolve()
+        try:
+            rel_path = resolved.relative_to(self.root)
+        except ValueError:
+            return False
+        state_file = self.index.state_file.resolve()
+        if resolved in (state_file, state_file.with_name(state_file.name + ".tmp")):
+            return False
+        if any(part.startswith(".") for part in rel_path.parts):
+            return False
+        return rel_path.suffix.lower() in self.extensions
+
+    def scan(self) -> Tuple[List[str], List[str]]:
+        """
+        对比目录和索引（仅使用 stat 信息）
+
+        Returns:
+            (需要处理的相对路径列表, 已删除的相对路径列表)
+        """
+        now = int(time.time())
+        found = self._walk()
+        self.file_count = len(found)
+        changed = []
+        for rel_path, st in found.items():
+            entry = self.index.get(rel_path)
+            if (entry is None
+                    or entry.get("size") != st.st_size
+                    or entry.get("mtime_ns") != st.st_mtime_ns
+                    or not entry.get("url")
+                    or entry.get("expire_at", 0) - now < URL_REFRESH_MARGIN):
+                changed.append(rel_path)
+
+        removed = [p for p in list(self.index.entries) if p not in found]
+        return changed, removed
+
+    def _prepare(self, rel_path: str) -> Dict[str, Any]:
+        """计算单个文件的MD5；内容未变时直接更新索引"""
+        file_path = self.root / rel_path
+        st = file_path.stat()
+        md5 = self._get_client().get_file_md5(file_path)
+
+        entry = self.index.get(rel_path)
+        now = int(time.time())
+        if (entry and entry.get("md5") == md5 and entry.get("url")
+                and entry.get("expire_at", 0) - now >= URL_REFRESH_MARGIN):
+            # 只是修改时间变化，内容未变
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            self.index.update(rel_path, entry)
+            return {"path": rel_path, "status": "unchanged"}
+        return {"path": rel_path, "status": "pending", "md5": md5,
+                "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def _lookup(self, md5s: List[str]) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+        """
+        通过 /info/batch 批量查询服务器已有的图片
+
+        Returns:
+            (已有图片 {md5: 信息}, 上传前是否仍需逐个查询)
+        """
+        try:
+            return self._get_client().get_images_info(md5s)["found"], False
+        except (requests.RequestException, ValueError) as e:
+            # 批量查询失败时由 upload_or_get 逐个查询
+            logger.warning(f"批量查询图片信息失败: {e}")
+            return {}, True
+
+    def _upload(self, item: Dict[str, Any], check_existing: bool) -> Dict[str, Any]:
+        return self._get_client().upload_or_get(self.root / item["path"], md5=item["md5"],
+                                                check_existing=check_existing)
+
+    def _record(self, item: Dict[str, Any], result: Dict[str, Any], status: str) -> Dict[str, Any]:
+        """把上传或查询结果写入索引"""
+        rel_path = item["path"]
+        if "url" not in result:
+            return {"path": rel_path, "status": "failed", "error": result.get("error", "未知错误")}
+
+        self.index.update(rel_path, {
+            "size": item["size"],
+            "mtime_ns": item["mtime_ns"],
+            "md5": item["md5"],
+            "url": result["url"],
+            "expire_at": result.get("expire_at", 0),
+        })
+        return {"path": rel_path, "status": status}
+
+    def sync_once(self) -> Dict[str, Any]:
+        """
+        执行一次增量同步，返回汇总信息
+
+        变化的文件先并行计算MD5，再通过 /info/batch 批量查询服务器已有的图片，
+        只有服务器不存在的内容才上传（同一内容只上传一次）。
+        """
+        start = time.time()
+        changed, removed = self.scan()
+        summary = {"scanned": self.file_count, "changed": len(changed),
+                   "uploaded": 0, "existing": 0, "unchanged": 0,
+                   "failed": 0, "removed": len(removed), "errors": []}
+
+        def tally(item: Dict[str, Any]) -> None:
+            status = item["status"]
+            summary[status] = summary.get(status, 0) + 1
+            if status == "failed":
+                summary["errors"].append(item)
+                logger.warning(f"同步失败: {item['path']}: {item['error']}")
+
+        for rel_path in removed:
+            self.index.remove(rel_path)
+
+        if changed:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                pending: Dict[str, List[Dict[str, Any]]] = {}   # md5 -> 待处理文件
+                futures = {executor.submit(self._prepare, p): p for p in changed}
+                for future in as_completed(futures):
+                    try:
+                        item = future.result()
+                    except Exception as e:
+                        item = {"path": futures[future], "status": "failed", "error": str(e)}
+                    if item["status"] == "pending":
+                        pending.setdefault(item["md5"], []).append(item)
+                    else:
+                        tally(item)
+
+                found, check_existing = self._lookup(list(pending)) if pending else ({}, False)
+                uploads = {}
+                for md5, items in pending.items():
+                    if md5 in found:
+                        for item in items:
+                            tally(self._record(item, found[md5], "existing"))
+                    else:
+                        uploads[executor.submit(self._upload, items[0], check_existing)] = md5
+
+                for future in as_completed(uploads):
+                    items = pending[uploads[future]]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {"error": str(e)}
+                    status = result.get("status", "uploaded")
+                    for item in items:
+                        tally(self._record(item, result, status))
+
+        if changed or removed:
+            self.index.save()
+
+        summary["elapsed"] = round(time.time() - start, 3)
+        return summary
+
+    def write_manifest(self, output: Path, fmt: Optional[str] = None) -> None:
+        """导出 路径→URL 清单，格式由 fmt 或文件扩展名决定（json/csv）"""
+        output = Path(output)
+        fmt = (fmt or output.suffix.lstrip(".") or "json").lower()
+        rows = sorted(self.index.entries.items())
+
+        tmp_file = output.with_name(output.name + ".tmp")
+        if fmt == "csv":
+            with open(tmp_file, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["path", "md5", "url", "expire_at"])
+                for rel_path, entry in rows:
+                    writer.writerow([rel_path, entry.get("md5"), entry.get("url"), entry.get("expire_at")])
+        elif fmt == "json":
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({rel_path: entry.get("url") for rel_path, entry in rows},
+                          f, ensure_ascii=False, indent=2)
+        else:
+            raise ValueError(f"不支持的清单格式: {fmt}")
+        os.replace(tmp_file, output)
+
+    def close(self) -> None:
+        """关闭所有工作线程的客户端"""
+        with self._clients_lock:
+            for client in self._clients:
+                client.close()
+            self._clients.clear()
+
+
+def watch(syncer: DirectorySyncer,
+          interval: float = 5.0,
+          on_sync: Optional[Callable[[Dict[str, Any]], None]] = None,
+          stop_event: Optional[threading.Event] = None) -> None:
+    """
+    持续监听目录变化并同步
+
+    使用 watchdog 时，文件事件触发同步（interval 作为事件合并窗口和兜底周期）；
+    否则每隔 interval 秒做一次 stat 比对。
+    """
+    stop_event = stop_event or threading.Event()
+    dirty = threading.Event()
+    observer = None
+
+    if WATCHDOG_AVAILABLE:
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                paths = [event.src_path, getattr(event, "dest_path", None)]
+                if any(p and syncer.is_relevant(os.fsdecode(p)) for p in paths):
+                    dirty.set()
+
+        observer = Observer()
+        observer.schedule(_Handler(), str(syncer.root), recursive=True)
+        observer.start()
+        logger.info(f"使用文件系统事件监听: {syncer.root}")
+    else:
+        logger.info(f"未安装 watchdog，使用轮询模式（间隔 {interval}s）: {syncer.root}")
+
+    try:
+        while not stop_event.is_set():
+            summary = syncer.sync_once()
+            if on_sync:
+                on_sync(summary)
+
+            if observer is None:
+                if stop_event.wait(timeout=interval):
+                    break
+                continue
+
+            # 等待文件事件；长时间无事件时也做一次兜底比对
+            deadline = time.time() + interval * 12
+            while not stop_event.is_set() and not dirty.is_set() and time.time() < deadline:
+                dirty.wait(timeout=0.5)
+            # 合并短时间内的连续事件（如大文件分多次写入）
+            if stop_event.wait(timeout=min(interval, 1.0)):
+                break
+            dirty.clear()
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+
+# -------------------------------
+# 命令行
+# -------------------------------
+
+def add_sync_arguments(parser) -> None:
+    """为 sync 子命令添加参数"""
+    parser.add_argument("directory", help="需要同步的目录")
+    parser.add_argument("--config", "-c", help="配置文件路径")
+    parser.add_argument("--server", "-s", help="服务器地址")
+    parser.add_argument("--username", "-u", help="用户名")
+    parser.add_argument("--password", "-p", help="密码")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="并发上传数（默认4）")
+    parser.add_argument("--state", help=f"状态索引文件（默认 <目录>/{DEFAULT_STATE_FILE}）")
+    parser.add_argument("--manifest", "-m", help="输出 路径→URL 清单文件（.json 或 .csv）")
+    parser.add_argument("--format", choices=["json", "csv"], help="清单格式，默认按扩展名判断")
+    parser.add_argument("--watch", "-w", action="store_true", help="持续监听目录变化")
+    parser.add_argument("--interval", type=float, default=5.0, help="轮询间隔秒数（默认5）")
+
+
+def run_sync(args) -> int:
+    """执行 sync 子命令"""
+    root = Path(args.directory)
+    if not root.is_dir():
+        print(f"❌ 目录不存在: {root}")
+        return 1
+
+    def client_factory() -> ImageProxyClient:
+        return ImageProxyClient(args.server, args.username, args.password, config_file=args.config)
+
+    index = SyncIndex(Path(args.state)) if args.state else None
+    syncer = DirectorySyncer(root, client_factory, index=index, jobs=args.jobs)
+
+    def report(summary: Dict[str, Any]) -> None:
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 同步完成: "
+              f"变化 {summary['changed']}, 上传 {summary['uploaded']}, "
+              f"已存在 {summary['existing']}, 未变 {summary['unchanged']}, "
+              f"删除 {summary['removed']}, 失败 {summary['failed']}, "
+              f"耗时 {summary['elapsed']}s")
+        if args.manifest:
+            syncer.write_manifest(Path(args.manifest), args.format)
+
+    try:
+        if args.watch:
+            watch(syncer, interval=args.interval, on_sync=report)
+            return 0
+        summary = syncer.sync_once()
+        report(summary)
+        return 0 if summary["failed"] == 0 else 2
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        syncer.close()
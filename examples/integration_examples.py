@@ -257,45 +257,38 @@ def example_error_handling():
     print("\n=== 错误处理示例 ===")
     
     error_handling_code = '''
-from image_proxy_simple import SimpleImageProxy
+from client import ImageProxyClient, RetryPolicy, CircuitBreaker, CircuitOpenError
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def upload_with_retry(image_path, max_retries=3):
-    """带重试的上传函数"""
-    
-    client = SimpleImageProxy("http://localhost:8000", "admin", "admin123")
-    
-    for attempt in range(max_retries):
-        try:
-            # 检查服务健康状态
-            if not client.is_healthy():
-                logger.warning(f"服务不健康，重试 {attempt + 1}/{max_retries}")
-                time.sleep(2 ** attempt)  # 指数退避
-                continue
-            
-            # 尝试上传
-            url = client.upload_image(image_path)
-            if url:
-                logger.info(f"上传成功: {url}")
-                return url
-            else:
-                logger.warning(f"上传失败，重试 {attempt + 1}/{max_retries}")
-                
-        except Exception as e:
-            logger.error(f"上传异常: {e}, 重试 {attempt + 1}/{max_retries}")
-        
-        if attempt < max_retries - 1:
-            time.sleep(2 ** attempt)
-    
-    logger.error("所有重试均失败")
+# 客户端内置重试：指数退避 + 抖动，遵循服务器的 Retry-After；
+# 连续失败后熔断，服务恢复前快速失败，不必再手写 sleep 循环
+client = ImageProxyClient(
+    "http://localhost:8000", "admin", "admin123",
+    retry_policy=RetryPolicy(max_retries=5, backoff_base=1.0, backoff_max=60),
+    circuit_breaker=CircuitBreaker(failure_threshold=5, recovery_timeout=30),
+)
+
+def upload(image_path):
+    try:
+        result = client.upload_image(image_path)
+        logger.info(f"上传成功: {result['url']}")
+        return result["url"]
+    except CircuitOpenError:
+        logger.error("服务暂不可用，稍后再试")
+    except Exception as e:
+        logger.error(f"上传失败: {e}")
+    finally:
+        # 每次尝试的状态码与耗时
+        for attempt in client.last_attempts:
+            logger.debug(attempt)
     return None
 
 # 使用示例
-url = upload_with_retry("/path/to/image.jpg")
+url = upload("/path/to/image.jpg")
 if url:
     print(f"最终上传成功: {url}")
 else:
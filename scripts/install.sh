@@ -143,6 +143,7 @@ RAW_DOMAIN=$(jq -r '.server.domain' "$CONFIG_FILE")
 DOMAIN=$(echo "$RAW_DOMAIN" | sed 's~https\?://~~' | sed 's:/*$::')
 PORT=$(jq -r '.server.port' "$CONFIG_FILE")
 CLEANUP_TIME=$(jq -r '.cleanup.cleanup_time' "$CONFIG_FILE" 2>/dev/null || echo "03:00:00")
+OPTIMIZE_TIME=$(jq -r '.optimize.start_time // "02:00:00"' "$CONFIG_FILE" 2>/dev/null || echo "02:00:00")
 
 echo "[INFO] domain=$DOMAIN port=$PORT cleanup_time=$CLEANUP_TIME"
 echo "✅ 配置文件验证通过"
@@ -204,6 +205,38 @@ Persistent=true
 WantedBy=timers.target
 EOF
 
+OPTIMIZE_SERVICE=/etc/systemd/system/fastapi-optimize.service
+sudo tee "$OPTIMIZE_SERVICE" > /dev/null <<EOF
+[Unit]
+Description=Image Proxy Storage Optimize Service
+After=fastapi.service
+Documentation=https://github.com/DpengYu/Image-Proxy-Project
+
+[Service]
+WorkingDirectory=$PROJECT_DIR/server
+ExecStart=$VENV_PY optimize_storage.py
+Nice=10
+User=$USER
+Group=$USER
+StandardOutput=append:/var/log/image_proxy/fastapi.log
+StandardError=append:/var/log/image_proxy/fastapi.log
+Environment=PYTHONPATH=$PROJECT_DIR
+EOF
+
+OPTIMIZE_TIMER=/etc/systemd/system/fastapi-optimize.timer
+sudo tee "$OPTIMIZE_TIMER" > /dev/null <<EOF
+[Unit]
+Description=Image Proxy Nightly Storage Optimize Timer
+Documentation=https://github.com/DpengYu/Image-Proxy-Project
+
+[Timer]
+OnCalendar=$OPTIMIZE_TIME
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+EOF
+
 echo "✅ systemd 服务配置完成"
 
 ########################################
@@ -395,6 +428,13 @@ else
   echo "⚠️ 清理定时任务启动失败（非致命错误）"
 fi
 
+# 启动存储优化定时任务（低峰时段无损压缩）
+if sudo systemctl enable --now fastapi-optimize.timer; then
+  echo "✅ 存储优化定时任务启动成功"
+else
+  echo "⚠️ 存储优化定时任务启动失败（非致命错误）"
+fi
+
 ########################################
 # 10. 验证安装
 ########################################
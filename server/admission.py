@@ -0,0 +1,259 @@
+"""
+准入控制模块
+限制同时处理的上传数和在途字节数，超出时按用户排队，以加权差额轮询（DRR）放行；队列已满或
+等待超时返回 503 并带 Retry-After。读取（/secure_get）不排队，且读取并发较高时暂停放行新的上传，优先保证读取
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+
+logger = logging.getLogger("image_proxy.admission")
+
+# 上传耗时的指数移动平均系数（用于估算 Retry-After）
+DURATION_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 60
+
+
+class AdmissionRejected(Exception):
+    """超出准入限制（对应 HTTP 503），retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _UserQueue:
+    """一个用户的等待队列和累计计数"""
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.entries: Deque[List[Any]] = deque()  # [字节数, Future]
+        self.deficit = 0.0
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.wait_total = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "active": self.active,
+            "queue_depth": len(self.entries),
+            "admitted": self.admitted,
+            "avg_queue_wait_ms": round(self.wait_total / self.queued * 1000, 1) if self.queued else 0.0
+        }
+
+
+class AdmissionController:
+    """
+    上传准入控制器
+
+    只在事件循环线程中使用，不需要加锁。等待中的上传按用户分队列，用差额轮询放行：
+    轮到某个用户时其差额增加 quantum_bytes x 权重，差额不小于队首字节数时放行并扣除。
+    各用户按权重比例分得上传字节，批量导入的用户排再多的请求也不会挡住其他用户。
+    选中的请求在字节预算内放不下时继续等待，大文件不会被小文件饿死；单个上传超过字节预算时
+    只在没有其他上传时放行。
+    """
+
+    def __init__(self, max_concurrent_uploads: int = 16, max_inflight_bytes: int = 512 * 1024 * 1024,
+                 max_queue: int = 64, max_wait_seconds: float = 10.0, read_priority_threshold: int = 64,
+                 weights: Optional[Dict[str, float]] = None, max_user_queue: int = 16,
+                 quantum_bytes: int = 1024 * 1024):
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.read_priority_threshold = read_priority_threshold
+        self.weights = weights or {}
+        self.max_user_queue = max_user_queue
+        self.quantum_bytes = quantum_bytes
+
+        self.active_uploads = 0
+        self.inflight_bytes = 0
+        self.active_reads = 0
+        self._users: Dict[str, _UserQueue] = {}
+        # 有等待请求的用户，按轮询顺序排列；队首为当前轮到的用户
+        self._round: Deque[str] = deque()
+        # 当前轮到的用户本轮是否已获得配额
+        self._credited = False
+        self._queue_depth = 0
+        self._avg_duration = 1.0
+        self._counters = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+        self._wait_total = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_depth
+
+    def _user(self, user: str) -> _UserQueue:
+        state = self._users.get(user)
+        if state is None:
+            state = self._users[user] = _UserQueue(user, float(self.weights.get(user, 1)))
+        return state
+
+    def _quantum(self, state: _UserQueue) -> float:
+        return self.quantum_bytes * state.weight
+
+    def _can_admit(self, size: int) -> bool:
+        if self.active_uploads >= self.max_concurrent_uploads:
+            return False
+        if self.active_reads >= self.read_priority_threshold:
+            return False
+        return self.active_uploads == 0 or self.inflight_bytes + size <= self.max_inflight_bytes
+
+    def _reserve(self, state: _UserQueue, size: int) -> None:
+        self.active_uploads += 1
+        self.inflight_bytes += size
+        state.active += 1
+        state.admitted += 1
+        self._counters["admitted"] += 1
+
+    def _select(self) -> _UserQueue:
+        """差额轮询：返回下一个应放行的用户（调用方保证有等待中的请求）"""
+        states = [self._users[user] for user in self._round]
+        current = states[0]
+        if not self._credited:
+            current.deficit += self._quantum(current)
+            self._credited = True
+        if current.deficit >= current.entries[0][0]:
+            return current
+        # 跳过所有用户都不够放行的整轮：每个用户还差几份配额，取最小值减一整轮快进
+        rounds = min(math.ceil((s.entries[0][0] - s.deficit) / self._quantum(s)) for s in states)
+        if rounds > 1:
+            for s in states:
+                s.deficit += (rounds - 1) * self._quantum(s)
+        while True:
+            self._round.rotate(-1)
+            state = self._users[self._round[0]]
+            state.deficit += self._quantum(state)
+            if state.deficit >= state.entries[0][0]:
+                return state
+
+    def _dispatch(self) -> None:
+        """按差额轮询放行等待中的上传"""
+        while self._round:
+            state = self._select()
+            size, future = state.entries[0]
+            if not self._can_admit(size):
+                break
+            self._pop(state)
+            state.deficit -= size
+            self._reserve(state, size)
+            future.set_result(True)
+
+    def _pop(self, state: _UserQueue, entry: Optional[List[Any]] = None) -> None:
+        """从用户队列中移除队首或指定的请求，队列空时该用户退出轮询"""
+        if entry is None:
+            state.entries.popleft()
+        else:
+            state.entries.remove(entry)
+        self._queue_depth -= 1
+        if not state.entries:
+            if self._round[0] == state.name:
+                self._credited = False
+            self._round.remove(state.name)
+            state.deficit = 0.0
+
+    def retry_after(self) -> int:
+        """按平均上传耗时估算排在队尾的请求需要等待的秒数"""
+        rounds = (self.queue_depth + 1) / max(1, self.max_concurrent_uploads)
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(self._avg_duration * rounds)))
+
+    async def _acquire(self, state: _UserQueue, size: int) -> None:
+        if not self._round and self._can_admit(size):
+            self._reserve(state, size)
+            return
+        if self.queue_depth >= self.max_queue or len(state.entries) >= self.max_user_queue:
+            self._counters["rejected_queue_full"] += 1
+            raise AdmissionRejected("上传队列已满", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [size, future]
+        if not state.entries:
+            self._round.append(state.name)
+        state.entries.append(entry)
+        self._queue_depth += 1
+        state.queued += 1
+        self._counters["queued"] += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # 超时的同时恰好被放行
+                return
+            self._remove(state, entry)
+            self._counters["rejected_timeout"] += 1
+            raise AdmissionRejected("上传排队超时", self.retry_after())
+        except BaseException:
+            # 客户端断开等导致的取消：已放行则归还名额
+            if future.done() and not future.cancelled():
+                self._release(state, size)
+            else:
+                self._remove(state, entry)
+            raise
+        finally:
+            wait = time.monotonic() - start
+            self._wait_total += wait
+            state.wait_total += wait
+
+    def _remove(self, state: _UserQueue, entry: List[Any]) -> None:
+        entry[1].cancel()
+        if entry in state.entries:
+            self._pop(state, entry)
+        # 移出的请求可能正挡住其他请求
+        self._dispatch()
+
+    def _release(self, state: _UserQueue, size: int) -> None:
+        self.active_uploads -= 1
+        self.inflight_bytes -= size
+        state.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def upload(self, size: int, user: str = "") -> AsyncIterator[None]:
+        """
+        在准入限制内处理 user 的一个上传（size 为预计字节数）
+
+        Raises:
+            AdmissionRejected: 队列已满或等待超时
+        """
+        state = self._user(user)
+        await self._acquire(state, size)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            self._avg_duration += DURATION_SMOOTHING * (duration - self._avg_duration)
+            self._release(state, size)
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """标记一个进行中的读取；读取不排队"""
+        self.active_reads += 1
+        try:
+            yield
+        finally:
+            self.active_reads -= 1
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """当前状态、累计计数和各用户的排队情况，供 /stats 展示"""
+        queued = self._counters["queued"]
+        return {
+            "active_uploads": self.active_uploads,
+            "inflight_bytes": self.inflight_bytes,
+            "queue_depth": self.queue_depth,
+            "active_reads": self.active_reads,
+            **self._counters,
+            "avg_queue_wait_ms": round(self._wait_total / queued * 1000, 1) if queued else 0.0,
+            "retry_after": self.retry_after(),
+            "users": {user: state.stats() for user, state in self._users.items()}
+        }
@@ -0,0 +1,190 @@
+"""
+上传接收模块
+流式接收上传内容：原始请求体或 multipart 的每个文件分片到达时即写入临时文件并增量计算MD5，
+不在内存中缓存整个请求体
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart < 0.0.13 的模块名
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+logger = logging.getLogger("image_proxy.batch_upload")
+
+# 保留的文件头字节数（用于类型检测）
+HEAD_SIZE = 16
+
+
+class BatchUploadError(Exception):
+    """批量上传请求格式错误（对应 HTTP 400）"""
+    pass
+
+
+class ReceivedPart:
+    """一个已接收完的文件分片"""
+
+    def __init__(self, index: int, filename: Optional[str], path: Path):
+        self.index = index
+        self.filename = filename
+        self.path: Optional[Path] = path
+        self.md5 = ""
+        self.size = 0
+        self.head = b""
+
+    def discard(self) -> None:
+        """删除临时文件"""
+        if self.path is not None:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class HashingWriter:
+    """
+    边写边算的存储写入器
+
+    内容写入 temp_dir 下的临时文件，同时增量计算MD5、大小并保留文件头；
+    超过 max_size 后停止写盘但继续计数，由上层判定为超限。
+    """
+
+    def __init__(self, temp_dir: Path, max_size: int, filename: Optional[str] = None, index: int = 0):
+        fd, path = tempfile.mkstemp(dir=temp_dir, prefix=".upload-", suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.md5()
+        self.max_size = max_size
+        self.part = ReceivedPart(index, filename, Path(path))
+
+    def write(self, chunk: bytes) -> None:
+        part = self.part
+        if len(part.head) < HEAD_SIZE:
+            part.head += chunk[:HEAD_SIZE - len(part.head)]
+        part.size += len(chunk)
+        if part.size <= self.max_size:
+            self._hash.update(chunk)
+            self._file.write(chunk)
+
+    def close(self) -> ReceivedPart:
+        """关闭临时文件，返回接收结果"""
+        self._file.close()
+        self.part.md5 = self._hash.hexdigest()
+        return self.part
+
+    def abort(self) -> None:
+        """放弃写入并删除临时文件"""
+        self._file.close()
+        self.part.discard()
+
+
+def get_boundary(content_type: Optional[str]) -> bytes:
+    """从 Content-Type 中取出 multipart boundary"""
+    if not content_type:
+        raise BatchUploadError("缺少 Content-Type")
+    media_type, params = parse_options_header(content_type)
+    if media_type != b"multipart/form-data" or b"boundary" not in params:
+        raise BatchUploadError("请求必须是 multipart/form-data")
+    return params[b"boundary"]
+
+
+class MultipartReceiver:
+    """
+    multipart 流式接收器
+
+    由调用方把请求体分块传给 write()。每个带文件名的分片交给一个 HashingWriter，
+    写入 temp_dir 下的临时文件并增量计算MD5和大小。
+    """
+
+    def __init__(self, boundary: bytes, temp_dir: Path, max_part_size: int, max_parts: int):
+        self.temp_dir = Path(temp_dir)
+        self.max_part_size = max_part_size
+        self.max_parts = max_parts
+        self.parts: List[ReceivedPart] = []
+        self.finished = False
+
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._writer: Optional[HashingWriter] = None
+
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_end": self._on_end,
+        })
+
+    def write(self, chunk: bytes) -> None:
+        """写入一块请求体"""
+        try:
+            self._parser.write(chunk)
+        except BatchUploadError:
+            raise
+        except Exception as e:
+            raise BatchUploadError(f"multipart 解析失败: {e}")
+
+    def finalize(self) -> None:
+        """请求体读完后调用，检查 multipart 是否完整"""
+        self._parser.finalize()
+        if not self.finished:
+            raise BatchUploadError("multipart 请求体不完整")
+
+    def cleanup(self) -> None:
+        """删除所有未被取走的临时文件"""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+        for part in self.parts:
+            part.discard()
+
+    # ---- 解析回调 ----
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = params.get(b"filename")
+        if filename is None:
+            # 普通表单字段，忽略
+            return
+        if len(self.parts) >= self.max_parts:
+            raise BatchUploadError(f"单次最多上传 {self.max_parts} 个文件")
+
+        self._writer = HashingWriter(self.temp_dir, self.max_part_size,
+                                     filename.decode("utf-8", "replace"), len(self.parts))
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._writer is not None:
+            self._writer.write(data[start:end])
+
+    def _on_part_end(self) -> None:
+        if self._writer is not None:
+            self.parts.append(self._writer.close())
+            self._writer = None
+
+    def _on_end(self) -> None:
+        self.finished = True
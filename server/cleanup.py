@@ -1,4 +1,6 @@
-import sqlite3, os, time, json
+import sqlite3, os, time, json, glob
+from database import DatabaseManager
+from upload_sessions import UploadSessionManager
 
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), "../config/config.json")
 with open(CONFIG_FILE) as f:
@@ -7,20 +9,37 @@ with open(CONFIG_FILE) as f:
 UPLOAD_DIR = "uploads"
 DB_FILE = "images.db"
 EXPIRE_DAYS = config["cleanup"]["expire_days"]
+# 墓碑保留天数：游标早于该期限的增量同步客户端需要全量重建
+TOMBSTONE_RETENTION_DAYS = config["cleanup"].get("tombstone_retention_days", 30)
+# 分片上传会话有效期
+SESSION_TTL_HOURS = config.get("upload_sessions", {}).get("ttl_hours", 24)
+# 派生图片缓存目录
+DERIVED_CACHE_DIR = config.get("transform", {}).get("cache_dir", "cache/derived")
 
 def cleanup():
+    db = DatabaseManager(DB_FILE)  # 同时完成旧数据库的表结构升级
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     expire_time = int(time.time()) - EXPIRE_DAYS*86400
-    c.execute("SELECT path FROM images WHERE created_at < ?", (expire_time,))
+    c.execute("SELECT md5, path FROM images WHERE created_at < ?", (expire_time,))
     rows = c.fetchall()
-    for (path,) in rows:
+    # 格式变体记录由触发器随原图删除，文件需先取出路径
+    variant_paths = db.get_variant_paths([md5 for md5, _ in rows])
+    for path in [path for _, path in rows] + variant_paths:
         if os.path.exists(path):
             os.remove(path)
+    for md5, _ in rows:
+        for derived in glob.glob(os.path.join(DERIVED_CACHE_DIR, md5[:2], md5 + "-*")):
+            os.remove(derived)
     c.execute("DELETE FROM images WHERE created_at < ?", (expire_time,))
     conn.commit()
     conn.close()
-    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Cleanup finished, {len(rows)} files removed.")
+    pruned = db.prune_change_log(TOMBSTONE_RETENTION_DAYS)
+    sessions = UploadSessionManager(os.path.join(UPLOAD_DIR, ".sessions"),
+                                    ttl_seconds=int(SESSION_TTL_HOURS * 3600)).sweep()
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Cleanup finished, {len(rows)} files removed, "
+          f"{len(variant_paths)} format variants removed, "
+          f"{pruned} tombstones pruned, {sessions} upload sessions expired.")
 
 if __name__ == "__main__":
     if config["cleanup"]["enable"]:
@@ -126,6 +126,43 @@ class ConfigLoader:
                     "window_seconds": 60
                 }
             },
+            "download_db": {
+                "snapshot_dir": "snapshots",
+                "snapshot_min_interval_seconds": 60
+            },
+            "upload_sessions": {
+                "chunk_size_mb": 4,
+                "ttl_hours": 24
+            },
+            "transform": {
+                "cache_dir": "cache/derived",
+                "cache_max_mb": 1024,
+                "workers": 2,
+                "max_dimension": 4096
+            },
+            "variants": {
+                "enable": False,
+                "formats": ["avif", "webp"],
+                "quality": 75,
+                "animation_max_frames": 500,
+                "animation_max_pixels": 100000000
+            },
+            "optimize": {
+                "start_time": "02:00:00",
+                "until": "06:00",
+                "workers": 2,
+                "limit": 10000
+            },
+            "admission": {
+                "max_concurrent_uploads": 16,
+                "max_inflight_mb": 512,
+                "max_queue": 64,
+                "max_user_queue": 16,
+                "max_wait_seconds": 10,
+                "lock_timeout_seconds": 30,
+                "read_priority_threshold": 64,
+                "quantum_kb": 1024
+            },
             "logging": {
                 "level": "INFO",
                 "file": None,
@@ -40,6 +40,7 @@ class ConfigValidator:
         self._validate_cleanup_config()
         self._validate_users_config()
         self._validate_security_config()
+        self._validate_admission_config()
     
     def _validate_server_config(self) -> None:
         """验证服务器配置"""
@@ -109,6 +110,11 @@ class ConfigValidator:
             # 验证密码强度
             if len(password) < 6:
                 raise ConfigValidationError(f"用户 {username} 的密码长度至少6位")
+            
+            # 上传调度权重（可选）
+            weight = user.get("weight", 1)
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+                raise ConfigValidationError(f"users[{i}].weight 必须是正数")
     
     def _validate_security_config(self) -> None:
         """验证安全配置"""
@@ -132,6 +138,25 @@ class ConfigValidator:
         if not isinstance(allowed_types, list):
             raise ConfigValidationError("security.upload.allowed_types 必须是数组")
     
+    def _validate_admission_config(self) -> None:
+        """验证上传准入控制配置（可选）"""
+        admission = self.config.get("admission", {})
+        if not isinstance(admission, dict):
+            raise ConfigValidationError("admission 必须是对象")
+        
+        # 整数项及其最小值（队列长度为0表示不排队，直接返回 503）
+        for key, minimum in (("max_concurrent_uploads", 1), ("read_priority_threshold", 1),
+                             ("max_queue", 0), ("max_user_queue", 0)):
+            value = admission.get(key, minimum)
+            if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+                raise ConfigValidationError(f"admission.{key} 必须是不小于{minimum}的整数")
+        
+        # 差额轮询的配额为0时无法放行任何请求
+        for key in ("max_inflight_mb", "max_wait_seconds", "quantum_kb"):
+            value = admission.get(key, 1)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                raise ConfigValidationError(f"admission.{key} 必须是大于0的数字")
+    
     def get_validated_config(self) -> Dict[str, Any]:
         """获取验证后的配置"""
         self.validate()
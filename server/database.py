@@ -4,6 +4,8 @@
 """
 import sqlite3
 import time
+import base64
+import json
 import logging
 from pathlib import Path
 from typing import Optional, List, Dict, Any, Tuple
@@ -12,6 +14,33 @@ from contextlib import contextmanager
 
 logger = logging.getLogger("image_proxy.database")
 
+# 文件大小分布的分桶（上限字节数, 名称），最后一个为兜底
+SIZE_BUCKETS = [
+    (10 * 1024, "<10KB"),
+    (100 * 1024, "10KB-100KB"),
+    (1024 * 1024, "100KB-1MB"),
+    (10 * 1024 * 1024, "1MB-10MB"),
+    (None, ">=10MB"),
+]
+
+
+# 单条 IN (...) 查询的参数个数上限（低于旧版 SQLite 的 999 个变量限制）
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(items: List[Any], size: int = IN_CHUNK_SIZE):
+    """把列表按固定大小切片"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _size_bucket_sql(column: str) -> str:
+    """生成把文件大小映射为分桶序号的 CASE 表达式"""
+    cases = " ".join(
+        f"WHEN {column} < {limit} THEN {i}" for i, (limit, _) in enumerate(SIZE_BUCKETS[:-1])
+    )
+    return f"CASE {cases} ELSE {len(SIZE_BUCKETS) - 1} END"
+
 
 class DatabaseManager:
     """数据库管理器"""
@@ -35,13 +64,31 @@ class DatabaseManager:
                         height INTEGER,
                         access_count INTEGER DEFAULT 0,
                         file_size INTEGER DEFAULT 0,
-                        updated_at INTEGER DEFAULT 0
+                        updated_at INTEGER DEFAULT 0,
+                        blurhash TEXT,
+                        preview TEXT
                     )
                 """)
+                self._migrate_placeholders(c)
+                
+                # WAL 模式：读事务（含快照导出）不阻塞写入
+                c.execute("PRAGMA journal_mode=WAL")
                 
                 # 添加索引
                 c.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON images(created_at)")
                 c.execute("CREATE INDEX IF NOT EXISTS idx_access_count ON images(access_count)")
+                # 列表接口的覆盖索引：按 (created_at, md5) 键集分页，过滤和返回的列都在索引中
+                c.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_images_listing
+                    ON images(created_at, md5, file_size, width, height, access_count, original_name)
+                """)
+                
+                self._init_change_log(c)
+                self._init_stats(c)
+                self.fts_available = self._init_search(c)
+                self._init_variants(c)
+                self._init_optimizations(c)
+                self._init_phash(c)
                 
                 conn.commit()
                 logger.info("数据库初始化完成")
@@ -49,6 +96,368 @@ class DatabaseManager:
             logger.error(f"数据库初始化失败: {e}")
             raise
     
+    def _migrate_placeholders(self, c: sqlite3.Cursor) -> None:
+        """旧数据库升级：为 images 表补充占位图列（旧图片保持 NULL）"""
+        c.execute("PRAGMA table_info(images)")
+        columns = {row["name"] for row in c.fetchall()}
+        for column in ("blurhash", "preview"):
+            if column not in columns:
+                c.execute(f"ALTER TABLE images ADD COLUMN {column} TEXT")
+    
+    def _init_change_log(self, c: sqlite3.Cursor) -> None:
+        """
+        初始化变更日志（供 /changes 增量同步使用）
+        
+        每个MD5只保留一行，记录最近一次变更的序号和类型（upsert/delete），
+        删除记录即为墓碑。由触发器维护，cleanup.py 等直接执行SQL的删除也会被记录。
+        """
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS image_changes (
+                md5 TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                op TEXT NOT NULL,
+                changed_at INTEGER NOT NULL
+            )
+        """)
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_changes_seq ON image_changes(seq)")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS sync_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        
+        for event, row, op in (("INSERT", "NEW", "upsert"),
+                               ("UPDATE", "NEW", "upsert"),
+                               ("DELETE", "OLD", "delete")):
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_images_changes_{event.lower()}
+                AFTER {event} ON images
+                BEGIN
+                    INSERT OR REPLACE INTO image_changes (md5, seq, op, changed_at)
+                    VALUES ({row}.md5,
+                            (SELECT IFNULL(MAX(seq), 0) + 1 FROM image_changes),
+                            '{op}',
+                            CAST(strftime('%s', 'now') AS INTEGER));
+                END
+            """)
+        
+        # 旧数据库升级：为已有图片补齐变更记录
+        c.execute("SELECT COUNT(*) FROM image_changes")
+        if c.fetchone()[0] == 0:
+            c.execute("""
+                INSERT INTO image_changes (md5, seq, op, changed_at)
+                SELECT md5, ROW_NUMBER() OVER (ORDER BY created_at, md5), 'upsert', updated_at
+                FROM images
+            """)
+    
+    def _init_stats(self, c: sqlite3.Cursor) -> None:
+        """
+        初始化统计表（由触发器在插入、更新、删除的同一事务中维护）
+        
+        - image_stats: 单行汇总（图片数、访问数、总大小、去重命中、存储优化结果）
+        - image_daily_stats: 每日上传数和字节数
+        - image_size_buckets: 文件大小分布
+        """
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS image_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_images INTEGER NOT NULL DEFAULT 0,
+                total_access INTEGER NOT NULL DEFAULT 0,
+                total_size INTEGER NOT NULL DEFAULT 0,
+                dedup_hits INTEGER NOT NULL DEFAULT 0,
+                dedup_bytes_saved INTEGER NOT NULL DEFAULT 0,
+                optimize_processed INTEGER NOT NULL DEFAULT 0,
+                optimize_count INTEGER NOT NULL DEFAULT 0,
+                optimize_bytes_saved INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS image_daily_stats (
+                day TEXT PRIMARY KEY,
+                uploads INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS image_size_buckets (
+                bucket INTEGER PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        
+        new_bucket = _size_bucket_sql("NEW.file_size")
+        old_bucket = _size_bucket_sql("OLD.file_size")
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_images_stats_insert
+            AFTER INSERT ON images
+            BEGIN
+                UPDATE image_stats
+                SET total_images = total_images + 1,
+                    total_access = total_access + NEW.access_count,
+                    total_size = total_size + NEW.file_size
+                WHERE id = 1;
+                INSERT INTO image_daily_stats (day, uploads, bytes)
+                VALUES (date(NEW.created_at, 'unixepoch'), 1, NEW.file_size)
+                ON CONFLICT(day) DO UPDATE SET uploads = uploads + 1, bytes = bytes + excluded.bytes;
+                INSERT INTO image_size_buckets (bucket, count)
+                VALUES ({new_bucket}, 1)
+                ON CONFLICT(bucket) DO UPDATE SET count = count + 1;
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_images_stats_delete
+            AFTER DELETE ON images
+            BEGIN
+                UPDATE image_stats
+                SET total_images = total_images - 1,
+                    total_access = total_access - OLD.access_count,
+                    total_size = total_size - OLD.file_size
+                WHERE id = 1;
+                UPDATE image_size_buckets SET count = count - 1
+                WHERE bucket = {old_bucket};
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_images_stats_update
+            AFTER UPDATE OF access_count, file_size ON images
+            BEGIN
+                UPDATE image_stats
+                SET total_access = total_access + NEW.access_count - OLD.access_count,
+                    total_size = total_size + NEW.file_size - OLD.file_size
+                WHERE id = 1;
+                UPDATE image_size_buckets SET count = count - 1
+                WHERE NEW.file_size != OLD.file_size
+                  AND bucket = {old_bucket};
+                INSERT INTO image_size_buckets (bucket, count)
+                SELECT {new_bucket}, 1
+                WHERE NEW.file_size != OLD.file_size
+                ON CONFLICT(bucket) DO UPDATE SET count = count + 1;
+            END
+        """)
+        
+        # 新建或旧数据库升级：全量计算一次
+        c.execute("SELECT COUNT(*) FROM image_stats")
+        if c.fetchone()[0] == 0:
+            self._rebuild_stats(c)
+    
+    def _init_search(self, c: sqlite3.Cursor) -> bool:
+        """
+        初始化原始文件名全文索引（FTS5 外部内容表，由触发器与 images 同步）
+        
+        使用 trigram 分词，任意 3 个字符以上的文件名片段都能走索引。
+        SQLite 未编译 FTS5 时返回 False，搜索退化为 LIKE 全表扫描。
+        """
+        c.execute("SELECT 1 FROM sqlite_master WHERE name = 'images_fts'")
+        exists = c.fetchone() is not None
+        if not exists:
+            try:
+                c.execute("""
+                    CREATE VIRTUAL TABLE images_fts USING fts5(
+                        original_name,
+                        content='images',
+                        content_rowid='rowid',
+                        tokenize='trigram'
+                    )
+                """)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"SQLite 不支持 FTS5 trigram，文件名搜索将使用全表扫描: {e}")
+                return False
+        
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_images_fts_insert
+            AFTER INSERT ON images
+            BEGIN
+                INSERT INTO images_fts (rowid, original_name) VALUES (NEW.rowid, NEW.original_name);
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_images_fts_delete
+            AFTER DELETE ON images
+            BEGIN
+                INSERT INTO images_fts (images_fts, rowid, original_name)
+                VALUES ('delete', OLD.rowid, OLD.original_name);
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_images_fts_update
+            AFTER UPDATE OF original_name ON images
+            BEGIN
+                INSERT INTO images_fts (images_fts, rowid, original_name)
+                VALUES ('delete', OLD.rowid, OLD.original_name);
+                INSERT INTO images_fts (rowid, original_name) VALUES (NEW.rowid, NEW.original_name);
+            END
+        """)
+        
+        # 旧数据库升级：为已有图片建立索引
+        if not exists:
+            c.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+        return True
+    
+    def _init_variants(self, c: sqlite3.Cursor) -> None:
+        """
+        初始化格式变体表（原图的 WebP/AVIF 等重新编码版本）
+        
+        path 为 NULL 表示已尝试生成但不比原图小，避免重复尝试。
+        原图记录删除时由触发器删除变体记录，文件由删除方负责清理。
+        """
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS image_variants (
+                md5 TEXT NOT NULL,
+                format TEXT NOT NULL,
+                path TEXT,
+                file_size INTEGER NOT NULL DEFAULT 0,
+                created_at INTEGER NOT NULL,
+                PRIMARY KEY (md5, format)
+            )
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_images_variants_delete
+            AFTER DELETE ON images
+            BEGIN
+                DELETE FROM image_variants WHERE md5 = OLD.md5;
+            END
+        """)
+    
+    def _init_optimizations(self, c: sqlite3.Cursor) -> None:
+        """
+        初始化存储优化记录表（optimize_storage.py 无损重新压缩的结果）
+        
+        每张图片处理一次；stored_size 等于 original_size 表示未能变小。
+        处理数、变小的文件数和节省字节数由触发器汇总到 image_stats。
+        """
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS image_optimizations (
+                md5 TEXT PRIMARY KEY,
+                original_size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL,
+                optimized_at INTEGER NOT NULL
+            )
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_images_optimizations_delete
+            AFTER DELETE ON images
+            BEGIN
+                DELETE FROM image_optimizations WHERE md5 = OLD.md5;
+            END
+        """)
+        for event, row, sign in (("INSERT", "NEW", "+"), ("DELETE", "OLD", "-")):
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_optimizations_stats_{event.lower()}
+                AFTER {event} ON image_optimizations
+                BEGIN
+                    UPDATE image_stats
+                    SET optimize_processed = optimize_processed {sign} 1,
+                        optimize_count = optimize_count {sign} ({row}.stored_size < {row}.original_size),
+                        optimize_bytes_saved = optimize_bytes_saved {sign} ({row}.original_size - {row}.stored_size)
+                    WHERE id = 1;
+                END
+            """)
+        
+        # 旧数据库升级：补充汇总列并全量计算一次
+        c.execute("PRAGMA table_info(image_stats)")
+        if "optimize_processed" not in {row["name"] for row in c.fetchall()}:
+            for column in ("optimize_processed", "optimize_count", "optimize_bytes_saved"):
+                c.execute(f"ALTER TABLE image_stats ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            self._rebuild_optimization_stats(c)
+    
+    def _rebuild_optimization_stats(self, c: sqlite3.Cursor) -> None:
+        """从 image_optimizations 全量重新计算存储优化汇总"""
+        c.execute("""
+            UPDATE image_stats
+            SET optimize_processed = (SELECT COUNT(*) FROM image_optimizations),
+                optimize_count = (SELECT IFNULL(SUM(stored_size < original_size), 0) FROM image_optimizations),
+                optimize_bytes_saved = (SELECT IFNULL(SUM(original_size - stored_size), 0) FROM image_optimizations)
+            WHERE id = 1
+        """)
+    
+    def _init_phash(self, c: sqlite3.Cursor) -> None:
+        """
+        初始化感知哈希表（64 位 dHash，按有符号整数保存）
+        
+        seq 为写入序号（sync_meta 中的 phash_seq 计数器，删除行不会复用），供各 worker 按游标
+        同步内存索引；只有感知哈希写入才递增，与图片的访问计数等更新无关。
+        """
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS image_phash (
+                md5 TEXT PRIMARY KEY,
+                phash INTEGER NOT NULL,
+                seq INTEGER
+            )
+        """)
+        # 旧数据库升级：已有的哈希在 worker 启动时全量载入，序号保持 NULL
+        c.execute("PRAGMA table_info(image_phash)")
+        if "seq" not in {row["name"] for row in c.fetchall()}:
+            c.execute("ALTER TABLE image_phash ADD COLUMN seq INTEGER")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_phash_seq ON image_phash(seq)")
+        c.execute("INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('phash_seq', 0)")
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_image_phash_seq
+            AFTER INSERT ON image_phash
+            BEGIN
+                UPDATE sync_meta SET value = value + 1 WHERE key = 'phash_seq';
+                UPDATE image_phash SET seq = (SELECT value FROM sync_meta WHERE key = 'phash_seq')
+                WHERE md5 = NEW.md5;
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_images_phash_delete
+            AFTER DELETE ON images
+            BEGIN
+                DELETE FROM image_phash WHERE md5 = OLD.md5;
+            END
+        """)
+    
+    def rebuild_search_index(self) -> None:
+        """从 images 表全量重建文件名全文索引"""
+        if not self.fts_available:
+            raise RuntimeError("SQLite 不支持 FTS5，无法建立全文索引")
+        try:
+            with self.get_connection() as conn:
+                conn.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+                conn.execute("INSERT INTO images_fts (images_fts) VALUES ('optimize')")
+                conn.commit()
+                logger.info("文件名全文索引重建完成")
+        except Exception as e:
+            logger.error(f"重建全文索引失败: {e}")
+            raise
+    
+    def _rebuild_stats(self, c: sqlite3.Cursor) -> None:
+        """全量重新计算统计表（保留去重统计）"""
+        c.execute("INSERT OR IGNORE INTO image_stats (id) VALUES (1)")
+        c.execute("""
+            UPDATE image_stats
+            SET total_images = (SELECT COUNT(*) FROM images),
+                total_access = (SELECT IFNULL(SUM(access_count), 0) FROM images),
+                total_size = (SELECT IFNULL(SUM(file_size), 0) FROM images)
+            WHERE id = 1
+        """)
+        c.execute("DELETE FROM image_daily_stats")
+        c.execute("""
+            INSERT INTO image_daily_stats (day, uploads, bytes)
+            SELECT date(created_at, 'unixepoch'), COUNT(*), IFNULL(SUM(file_size), 0)
+            FROM images GROUP BY 1
+        """)
+        c.execute("DELETE FROM image_size_buckets")
+        c.execute(f"""
+            INSERT INTO image_size_buckets (bucket, count)
+            SELECT {_size_bucket_sql("file_size")}, COUNT(*)
+            FROM images GROUP BY 1
+        """)
+    
+    def rebuild_stats(self) -> None:
+        """全量重新计算统计表（用于修复统计偏差）"""
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                self._rebuild_stats(c)
+                self._rebuild_optimization_stats(c)
+                conn.commit()
+                logger.info("统计表重建完成")
+        except Exception as e:
+            logger.error(f"重建统计表失败: {e}")
+            raise
+    
     @contextmanager
     def get_connection(self):
         """获取数据库连接（上下文管理器）"""
@@ -88,6 +497,74 @@ class DatabaseManager:
             logger.error(f"插入图片记录失败: {e}")
             raise
     
+    def insert_images(self, rows: List[Dict[str, Any]], record_hits: bool = False) -> List[str]:
+        """
+        批量插入图片记录（单个事务，一次提交）
+        
+        Args:
+            rows: 字典列表，包含 md5、path、original_name、width、height、file_size，
+                  可选 phash（有符号64位）、blurhash、preview
+            record_hits: 已存在或批内重复的记录是否按去重命中计数（同 record_dedup_hit）
+            
+        Returns:
+            实际新增的MD5列表（已存在或批内重复的记录被忽略）
+        """
+        if not rows:
+            return []
+        try:
+            now = int(time.time())
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                # 先加写锁，保证查重和插入之间没有其他写入
+                c.execute("BEGIN IMMEDIATE")
+                existing = set()
+                for chunk in _chunks(list({row["md5"] for row in rows})):
+                    placeholders = ','.join(['?'] * len(chunk))
+                    c.execute(f"SELECT md5 FROM images WHERE md5 IN ({placeholders})", chunk)
+                    existing.update(r["md5"] for r in c.fetchall())
+                
+                new_rows = []
+                phash_rows = []
+                hits = []
+                for row in rows:
+                    if row["md5"] in existing:
+                        hits.append((now, row["md5"]))
+                        continue
+                    existing.add(row["md5"])
+                    new_rows.append((row["md5"], str(row["path"]), now, row.get("original_name"),
+                                     row.get("width"), row.get("height"), row.get("file_size", 0), now,
+                                     row.get("blurhash"), row.get("preview")))
+                    if row.get("phash") is not None:
+                        phash_rows.append((row["md5"], row["phash"]))
+                
+                c.executemany("""
+                    INSERT INTO images 
+                    (md5, path, created_at, original_name, width, height, file_size, updated_at,
+                     blurhash, preview)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, new_rows)
+                c.executemany("INSERT OR REPLACE INTO image_phash (md5, phash) VALUES (?, ?)", phash_rows)
+                if record_hits and hits:
+                    c.executemany("""
+                        UPDATE images 
+                        SET access_count = access_count + 1, updated_at = ?
+                        WHERE md5 = ?
+                    """, hits)
+                    c.execute("""
+                        UPDATE image_stats
+                        SET dedup_hits = dedup_hits + ?,
+                            dedup_bytes_saved = dedup_bytes_saved + IFNULL((
+                                SELECT SUM(file_size) FROM images JOIN json_each(?) j ON images.md5 = j.value
+                            ), 0)
+                        WHERE id = 1
+                    """, (len(hits), json.dumps([md5 for _, md5 in hits])))
+                conn.commit()
+                logger.info(f"批量新增图片记录: {len(new_rows)}/{len(rows)}")
+                return [row[0] for row in new_rows]
+        except Exception as e:
+            logger.error(f"批量插入图片记录失败: {e}")
+            raise
+    
     def get_image(self, md5: str) -> Optional[Dict[str, Any]]:
         """获取图片信息"""
         try:
@@ -95,7 +572,7 @@ class DatabaseManager:
                 c = conn.cursor()
                 c.execute("""
                     SELECT md5, path, created_at, original_name, width, height, 
-                           access_count, file_size, updated_at
+                           access_count, file_size, updated_at, blurhash, preview
                     FROM images WHERE md5=?
                 """, (md5,))
                 row = c.fetchone()
@@ -106,6 +583,26 @@ class DatabaseManager:
             logger.error(f"查询图片信息失败: {e}")
             raise
     
+    def get_images(self, md5_list: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取图片信息，返回 {md5: 图片信息}，不存在的MD5不出现在结果中"""
+        result: Dict[str, Dict[str, Any]] = {}
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                for chunk in _chunks(list(dict.fromkeys(md5_list))):
+                    placeholders = ','.join(['?'] * len(chunk))
+                    c.execute(f"""
+                        SELECT md5, path, created_at, original_name, width, height, 
+                               access_count, file_size, updated_at, blurhash, preview
+                        FROM images WHERE md5 IN ({placeholders})
+                    """, chunk)
+                    for row in c.fetchall():
+                        result[row["md5"]] = dict(row)
+            return result
+        except Exception as e:
+            logger.error(f"批量查询图片信息失败: {e}")
+            raise
+    
     def update_access_count(self, md5: str) -> bool:
         """更新访问计数"""
         try:
@@ -127,6 +624,196 @@ class DatabaseManager:
             logger.error(f"更新访问计数失败: {e}")
             raise
     
+    def record_dedup_hit(self, md5: str) -> bool:
+        """记录一次去重命中：增加访问计数，并在同一事务中累计节省的字节数"""
+        try:
+            now = int(time.time())
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                c.execute("""
+                    UPDATE images 
+                    SET access_count = access_count + 1, updated_at = ?
+                    WHERE md5 = ?
+                """, (now, md5))
+                if c.rowcount == 0:
+                    return False
+                c.execute("""
+                    UPDATE image_stats
+                    SET dedup_hits = dedup_hits + 1,
+                        dedup_bytes_saved = dedup_bytes_saved + (SELECT file_size FROM images WHERE md5 = ?)
+                    WHERE id = 1
+                """, (md5,))
+                conn.commit()
+                logger.debug(f"去重命中: {md5}")
+                return True
+        except Exception as e:
+            logger.error(f"记录去重命中失败: {e}")
+            raise
+    
+    def add_variant(self, md5: str, format: str, path: Optional[str], file_size: int = 0) -> bool:
+        """
+        记录格式变体（path 为 None 表示该格式不比原图小）
+        
+        Returns:
+            是否记录成功（原图已被删除时返回 False）
+        """
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                c.execute("""
+                    INSERT OR REPLACE INTO image_variants (md5, format, path, file_size, created_at)
+                    SELECT md5, ?, ?, ?, ? FROM images WHERE md5 = ?
+                """, (format, path, file_size, int(time.time()), md5))
+                conn.commit()
+                return c.rowcount > 0
+        except Exception as e:
+            logger.error(f"记录格式变体失败: {e}")
+            raise
+    
+    def get_variants(self, md5: str, include_skipped: bool = False) -> Dict[str, Dict[str, Any]]:
+        """获取图片的格式变体 {format: {"path", "file_size"}}"""
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                c.execute("""
+                    SELECT format, path, file_size FROM image_variants
+                    WHERE md5 = ? AND (path IS NOT NULL OR ?)
+                """, (md5, include_skipped))
+                return {row["format"]: {"path": row["path"], "file_size": row["file_size"]}
+                        for row in c.fetchall()}
+        except Exception as e:
+            logger.error(f"获取格式变体失败: {e}")
+            raise
+    
+    def get_variant_paths(self, md5_list: List[str]) -> List[str]:
+        """获取一批图片的全部变体文件路径（删除原图前调用）"""
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                paths = []
+                for chunk in _chunks(list(md5_list)):
+                    placeholders = ','.join(['?'] * len(chunk))
+                    c.execute(f"""
+                        SELECT path FROM image_variants
+                        WHERE md5 IN ({placeholders}) AND path IS NOT NULL
+                    """, chunk)
+                    paths.extend(row["path"] for row in c.fetchall())
+                return paths
+        except Exception as e:
+            logger.error(f"获取格式变体路径失败: {e}")
+            raise
+    
+    def get_unoptimized_images(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """获取尚未做过存储优化的图片（按上传时间）"""
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                c.execute("""
+                    SELECT i.md5, i.path, i.file_size FROM images i
+                    LEFT JOIN image_optimizations o ON o.md5 = i.md5
+                    WHERE o.md5 IS NULL
+                    ORDER BY i.created_at LIMIT ?
+                """, (limit,))
+                return [dict(row) for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"查询待优化图片失败: {e}")
+            raise
+    
+    def record_optimization(self, md5: str, original_size: int, stored_size: int) -> bool:
+        """
+        记录存储优化结果
+        
+        Returns:
+            是否记录成功（原图已被清理时返回 False）
+        """
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                # 先显式删除旧记录：REPLACE 隐式删除不触发删除触发器，汇总会重复计算
+                c.execute("DELETE FROM image_optimizations WHERE md5 = ?", (md5,))
+                c.execute("""
+                    INSERT INTO image_optimizations (md5, original_size, stored_size, optimized_at)
+                    SELECT md5, ?, ?, ? FROM images WHERE md5 = ?
+                """, (original_size, stored_size, int(time.time()), md5))
+                conn.commit()
+                return c.rowcount > 0
+        except Exception as e:
+            logger.error(f"记录存储优化结果失败: {e}")
+            raise
+    
+    def iter_phashes(self, batch_size: int = 10000):
+        """按 md5 顺序分批遍历全部感知哈希，产出 (md5, phash)"""
+        last = ""
+        while True:
+            with self.get_connection() as conn:
+                rows = conn.execute("""
+                    SELECT md5, phash FROM image_phash WHERE md5 > ? ORDER BY md5 LIMIT ?
+                """, (last, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row["md5"], row["phash"]
+            last = rows[-1]["md5"]
+    
+    def get_phash_seq(self) -> int:
+        """当前的感知哈希写入序号"""
+        try:
+            with self.get_connection() as conn:
+                return conn.execute("SELECT value FROM sync_meta WHERE key = 'phash_seq'").fetchone()[0]
+        except Exception as e:
+            logger.error(f"查询感知哈希序号失败: {e}")
+            raise
+    
+    def get_phash_changes(self, since: int, limit: int = 1000) -> Tuple[int, List[Tuple[str, int]]]:
+        """
+        获取写入序号大于 since 的感知哈希（供各 worker 同步内存索引）
+        
+        Returns:
+            (新游标, [(md5, 有符号phash)])；返回数量等于 limit 时可能还有更多
+        """
+        try:
+            with self.get_connection() as conn:
+                rows = conn.execute("""
+                    SELECT seq, md5, phash FROM image_phash
+                    WHERE seq > ?
+                    ORDER BY seq
+                    LIMIT ?
+                """, (since, limit)).fetchall()
+            cursor = rows[-1]["seq"] if rows else since
+            return cursor, [(row["md5"], row["phash"]) for row in rows]
+        except Exception as e:
+            logger.error(f"查询感知哈希变更失败: {e}")
+            raise
+    
+    def get_images_without_phash(self, limit: int = 1000) -> List[Dict[str, Any]]:
+        """获取尚未计算感知哈希的图片（旧数据回填用）"""
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                c.execute("""
+                    SELECT i.md5, i.path FROM images i
+                    LEFT JOIN image_phash p ON p.md5 = i.md5
+                    WHERE p.md5 IS NULL
+                    ORDER BY i.created_at LIMIT ?
+                """, (limit,))
+                return [dict(row) for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"查询缺少感知哈希的图片失败: {e}")
+            raise
+    
+    def set_phashes(self, items: List[Tuple[str, int]]) -> None:
+        """批量写入感知哈希 [(md5, 有符号phash)]（原图已删除的忽略）"""
+        try:
+            with self.get_connection() as conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO image_phash (md5, phash)
+                    SELECT md5, ? FROM images WHERE md5 = ?
+                """, [(phash, md5) for md5, phash in items])
+                conn.commit()
+        except Exception as e:
+            logger.error(f"写入感知哈希失败: {e}")
+            raise
+    
     def get_expired_images(self, expire_days: int) -> List[Dict[str, Any]]:
         """获取过期图片列表"""
         try:
@@ -143,39 +830,275 @@ class DatabaseManager:
             raise
     
     def delete_images(self, md5_list: List[str]) -> int:
-        """批量删除图片记录"""
+        """批量删除图片记录（分批执行，单个事务提交）"""
         try:
             with self.get_connection() as conn:
                 c = conn.cursor()
-                placeholders = ','.join(['?'] * len(md5_list))
-                c.execute(f"DELETE FROM images WHERE md5 IN ({placeholders})", md5_list)
+                deleted = 0
+                for chunk in _chunks(list(md5_list)):
+                    placeholders = ','.join(['?'] * len(chunk))
+                    c.execute(f"DELETE FROM images WHERE md5 IN ({placeholders})", chunk)
+                    deleted += c.rowcount
                 conn.commit()
-                deleted = c.rowcount
                 logger.info(f"删除图片记录数: {deleted}")
                 return deleted
         except Exception as e:
             logger.error(f"删除图片记录失败: {e}")
             raise
     
-    def get_stats(self) -> Dict[str, Any]:
-        """获取数据库统计信息"""
+    @staticmethod
+    def encode_cursor(created_at: int, md5: str) -> str:
+        """生成列表分页游标"""
+        return base64.urlsafe_b64encode(f"{created_at}:{md5}".encode("utf-8")).decode("ascii")
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[int, str]:
+        """解析列表分页游标，格式错误时抛出 ValueError"""
+        try:
+            created_at, md5 = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split(":", 1)
+            return int(created_at), md5
+        except Exception:
+            raise ValueError(f"无效的游标: {cursor}")
+    
+    def list_images(self,
+                    cursor: Optional[str] = None,
+                    limit: int = 100,
+                    min_size: Optional[int] = None,
+                    max_size: Optional[int] = None,
+                    min_width: Optional[int] = None,
+                    max_width: Optional[int] = None,
+                    min_height: Optional[int] = None,
+                    max_height: Optional[int] = None,
+                    min_access: Optional[int] = None,
+                    max_access: Optional[int] = None,
+                    name_prefix: Optional[str] = None) -> Dict[str, Any]:
+        """
+        按 (created_at, md5) 键集分页列出图片
+        
+        Args:
+            cursor: 上一页返回的 next_cursor，为空表示第一页
+            limit: 每页数量
+            其余参数: 闭区间过滤条件和文件名前缀
+            
+        Returns:
+            {"items": [...], "next_cursor": 下一页游标，没有更多时为 None}
+        """
+        conditions = []
+        params: List[Any] = []
+        if cursor:
+            created_at, md5 = self.decode_cursor(cursor)
+            conditions.append("(created_at, md5) > (?, ?)")
+            params.extend([created_at, md5])
+        
+        for column, low, high in (("file_size", min_size, max_size),
+                                  ("width", min_width, max_width),
+                                  ("height", min_height, max_height),
+                                  ("access_count", min_access, max_access)):
+            if low is not None:
+                conditions.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{column} <= ?")
+                params.append(high)
+        
+        if name_prefix:
+            conditions.append("substr(original_name, 1, ?) = ?")
+            params.extend([len(name_prefix), name_prefix])
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                c.execute(f"""
+                    SELECT md5, created_at, original_name, width, height, access_count, file_size
+                    FROM images INDEXED BY idx_images_listing
+                    {where}
+                    ORDER BY created_at, md5
+                    LIMIT ?
+                """, params + [limit + 1])
+                rows = [dict(row) for row in c.fetchall()]
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = self.encode_cursor(rows[-1]["created_at"], rows[-1]["md5"])
+            return {"items": rows, "next_cursor": next_cursor}
+        except Exception as e:
+            logger.error(f"列出图片失败: {e}")
+            raise
+    
+    def search_images(self, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+        """
+        按原始文件名片段搜索图片
+        
+        多个以空格分隔的片段需同时出现。片段均不短于 3 个字符时走全文索引并按 bm25 相关度排序，
+        否则（或不支持 FTS5 时）退化为 LIKE 扫描并按上传时间倒序。
+        
+        Returns:
+            {"items": [...], "has_more": 是否还有下一页}
+        """
+        terms = query.split()
+        if not terms:
+            return {"items": [], "has_more": False}
+        
+        columns = "i.md5, i.created_at, i.original_name, i.width, i.height, i.access_count, i.file_size"
+        if self.fts_available and all(len(term) >= 3 for term in terms):
+            # 每个片段作为短语匹配，双引号需转义
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            sql = f"""
+                SELECT {columns}
+                FROM images_fts f JOIN images i ON i.rowid = f.rowid
+                WHERE images_fts MATCH ?
+                ORDER BY f.rank
+                LIMIT ? OFFSET ?
+            """
+            params: List[Any] = [match]
+        else:
+            escaped = [term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") for term in terms]
+            where = " AND ".join("i.original_name LIKE ? ESCAPE '\\'" for _ in terms)
+            sql = f"""
+                SELECT {columns}
+                FROM images i
+                WHERE {where}
+                ORDER BY i.created_at DESC
+                LIMIT ? OFFSET ?
+            """
+            params = [f"%{term}%" for term in escaped]
+        
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                c.execute(sql, params + [limit + 1, offset])
+                rows = [dict(row) for row in c.fetchall()]
+            return {"items": rows[:limit], "has_more": len(rows) > limit}
+        except Exception as e:
+            logger.error(f"搜索图片失败: {e}")
+            raise
+    
+    def get_changes(self, since: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        """
+        获取序号大于 since 的变更
+        
+        Args:
+            since: 上次同步得到的游标，0 表示全量
+            limit: 最多返回的变更数
+            
+        Returns:
+            {"changes": [...], "cursor": 新游标, "has_more": 是否还有更多, "reset": 是否需要全量重建}
+            reset 为 True 表示游标之后的墓碑已被清理，客户端需清空本地镜像并从 0 重新同步
+        """
         try:
             with self.get_connection() as conn:
                 c = conn.cursor()
+                c.execute("SELECT value FROM sync_meta WHERE key = 'pruned_seq'")
+                row = c.fetchone()
+                pruned_seq = row["value"] if row else 0
+                if 0 < since < pruned_seq:
+                    return {"changes": [], "cursor": 0, "has_more": False, "reset": True}
                 
-                # 总图片数
-                c.execute("SELECT COUNT(*) as total FROM images")
-                total = c.fetchone()['total']
+                c.execute("""
+                    SELECT ch.seq, ch.op, ch.md5, ch.changed_at,
+                           i.path, i.created_at, i.original_name, i.width, i.height,
+                           i.access_count, i.file_size, i.updated_at
+                    FROM image_changes ch
+                    LEFT JOIN images i ON i.md5 = ch.md5
+                    WHERE ch.seq > ?
+                    ORDER BY ch.seq
+                    LIMIT ?
+                """, (since, limit + 1))
+                rows = c.fetchall()
+            
+            has_more = len(rows) > limit
+            changes = []
+            for row in rows[:limit]:
+                change = dict(row)
+                if change["op"] == "delete" or change["created_at"] is None:
+                    change = {"seq": change["seq"], "op": "delete", "md5": change["md5"],
+                              "changed_at": change["changed_at"]}
+                changes.append(change)
+            
+            cursor = changes[-1]["seq"] if changes else since
+            return {"changes": changes, "cursor": cursor, "has_more": has_more, "reset": False}
+        except Exception as e:
+            logger.error(f"查询变更记录失败: {e}")
+            raise
+    
+    def prune_change_log(self, retention_days: int) -> int:
+        """
+        清理超过保留期的墓碑
+        
+        游标早于被清理墓碑的客户端之后会收到 reset，需要全量重建。
+        """
+        try:
+            cutoff = int(time.time()) - retention_days * 86400
+            with self.get_connection() as conn:
+                c = conn.cursor()
+                # 保留序号最大的一行，保证序号单调递增
+                c.execute("""
+                    SELECT MAX(seq) AS max_seq FROM image_changes
+                    WHERE op = 'delete' AND changed_at < ?
+                      AND seq < (SELECT MAX(seq) FROM image_changes)
+                """, (cutoff,))
+                max_pruned = c.fetchone()["max_seq"]
+                if max_pruned is None:
+                    return 0
                 
-                # 总访问次数
-                c.execute("SELECT SUM(access_count) as total_access FROM images")
-                total_access = c.fetchone()['total_access'] or 0
+                c.execute("DELETE FROM image_changes WHERE op = 'delete' AND seq <= ?", (max_pruned,))
+                deleted = c.rowcount
+                c.execute("""
+                    INSERT INTO sync_meta (key, value) VALUES ('pruned_seq', ?)
+                    ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+                """, (max_pruned,))
+                conn.commit()
+                logger.info(f"清理墓碑记录数: {deleted}")
+                return deleted
+        except Exception as e:
+            logger.error(f"清理变更记录失败: {e}")
+            raise
+    
+    def backup_to(self, dest: Path) -> None:
+        """
+        使用 SQLite 在线备份 API 导出一致性快照（包含 WAL 中已提交的数据）
+        
+        WAL 模式下一次性完成备份只持有一个读事务，写入不受影响。
+        """
+        dest = Path(dest)
+        if dest.exists():
+            dest.unlink()
+        try:
+            with self.get_connection() as conn:
+                target = sqlite3.connect(dest)
+                try:
+                    conn.backup(target)
+                    # 快照为独立文件，切回 DELETE 模式避免附带 -wal 文件
+                    target.execute("PRAGMA journal_mode=DELETE")
+                finally:
+                    target.close()
+        except Exception as e:
+            logger.error(f"导出数据库快照失败: {e}")
+            raise
+    
+    def get_stats(self, days: int = 30) -> Dict[str, Any]:
+        """
+        获取数据库统计信息
+        
+        汇总数据来自触发器维护的统计表，不随图片数量增长而变慢。
+        
+        Args:
+            days: 返回最近多少天的每日上传统计
+        """
+        try:
+            with self.get_connection() as conn:
+                c = conn.cursor()
                 
-                # 总文件大小
-                c.execute("SELECT SUM(file_size) as total_size FROM images")
-                total_size = c.fetchone()['total_size'] or 0
+                c.execute("""
+                    SELECT total_images, total_access, total_size, dedup_hits, dedup_bytes_saved,
+                           optimize_processed, optimize_count, optimize_bytes_saved
+                    FROM image_stats WHERE id = 1
+                """)
+                totals = c.fetchone()
                 
-                # 最新图片
+                # 最新图片（走 created_at 索引）
                 c.execute("""
                     SELECT original_name, created_at 
                     FROM images 
@@ -184,18 +1107,38 @@ class DatabaseManager:
                 """)
                 latest = c.fetchone()
                 
+                c.execute("""
+                    SELECT day, uploads, bytes FROM image_daily_stats
+                    ORDER BY day DESC LIMIT ?
+                """, (days,))
+                daily = [dict(row) for row in c.fetchall()]
+                
+                c.execute("SELECT bucket, count FROM image_size_buckets")
+                bucket_counts = {row["bucket"]: row["count"] for row in c.fetchall()}
+                
                 return {
-                    "total_images": total,
-                    "total_access": total_access,
-                    "total_size_bytes": total_size,
+                    "total_images": totals["total_images"],
+                    "total_access": totals["total_access"],
+                    "total_size_bytes": totals["total_size"],
                     "latest_image": dict(latest) if latest else None,
-                    "db_file_size": self.db_file.stat().st_size if self.db_file.exists() else 0
+                    "db_file_size": self.db_file.stat().st_size if self.db_file.exists() else 0,
+                    "dedup_hits": totals["dedup_hits"],
+                    "dedup_bytes_saved": totals["dedup_bytes_saved"],
+                    "storage_optimization": {
+                        "processed": totals["optimize_processed"],
+                        "optimized": totals["optimize_count"],
+                        "bytes_saved": totals["optimize_bytes_saved"]
+                    },
+                    "daily_uploads": daily,
+                    "size_histogram": [
+                        {"bucket": name, "count": bucket_counts.get(i, 0)}
+                        for i, (_, name) in enumerate(SIZE_BUCKETS)
+                    ]
                 }
         except Exception as e:
             logger.error(f"获取统计信息失败: {e}")
             raise
 
-
 if __name__ == "__main__":
     # 测试数据库功能
     db = DatabaseManager("test.db")
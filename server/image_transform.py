@@ -0,0 +1,431 @@
+"""
+图片变换模块
+按请求参数（宽高、缩放方式、格式、质量）生成派生图片：变换在进程池中执行，
+结果写入按字节预算做 LRU 淘汰的磁盘缓存，相同的并发请求只计算一次
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps, features
+
+
+logger = logging.getLogger("image_proxy.image_transform")
+
+# 支持的缩放方式：contain 等比缩放到框内，cover 等比缩放后居中裁剪填满，fill 拉伸
+FIT_MODES = ("contain", "cover", "fill")
+
+# 输出格式 -> (Pillow 格式名, 扩展名, MIME 类型)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "png": ("PNG", "png", "image/png"),
+    "webp": ("WEBP", "webp", "image/webp"),
+}
+
+# AVIF 需要 Pillow 编译时带 libavif（Pillow 11.2 起的官方 wheel 自带）
+AVIF_AVAILABLE = features.check("avif")
+if AVIF_AVAILABLE:
+    OUTPUT_FORMATS["avif"] = ("AVIF", "avif", "image/avif")
+
+# Pillow 格式名 -> 输出格式（未指定 format 时沿用原图格式）
+SOURCE_FORMATS = {"JPEG": "jpeg", "PNG": "png", "WEBP": "webp", "AVIF": "avif"}
+
+DEFAULT_QUALITY = 80
+EXIF_ORIENTATION = 0x0112
+
+# 派生图片缓存重新扫描磁盘的最小间隔（秒）：合并其他 worker 写入和淘汰的文件
+CACHE_RESCAN_INTERVAL = 60.0
+# 超过该时间的临时文件视为写入中途中断（更新的可能是其他 worker 正在写入）
+STALE_TEMP_SECONDS = 3600
+
+
+class TransformError(Exception):
+    """变换参数无效（对应 HTTP 400）"""
+    pass
+
+
+class TransformParams:
+    """一组变换参数"""
+
+    def __init__(self, width: Optional[int] = None, height: Optional[int] = None, fit: str = "contain",
+                 format: Optional[str] = None, quality: Optional[int] = None, max_dimension: int = 4096):
+        if width is None and height is None and format is None and quality is None:
+            raise TransformError("至少需要指定一个变换参数")
+        for name, value in (("width", width), ("height", height)):
+            if value is not None and not 1 <= value <= max_dimension:
+                raise TransformError(f"{name} 必须在 1-{max_dimension} 之间")
+        if fit not in FIT_MODES:
+            raise TransformError(f"fit 必须是 {'/'.join(FIT_MODES)} 之一")
+        if fit != "contain" and (width is None or height is None):
+            raise TransformError(f"fit={fit} 需要同时指定 width 和 height")
+        if format is not None and format not in OUTPUT_FORMATS:
+            raise TransformError(f"format 必须是 {'/'.join(OUTPUT_FORMATS)} 之一")
+        if quality is not None and not 1 <= quality <= 100:
+            raise TransformError("quality 必须在 1-100 之间")
+
+        self.width = width
+        self.height = height
+        self.fit = fit
+        self.format = format
+        self.quality = quality
+
+    @property
+    def key(self) -> str:
+        """规范化的参数串，用于签名和缓存键（参数顺序、默认值不影响结果）"""
+        return (f"w={self.width or 0},h={self.height or 0},fit={self.fit},"
+                f"fmt={self.format or 'auto'},q={self.quality or 0}")
+
+    def to_query(self) -> Dict[str, str]:
+        """转换为 URL 查询参数"""
+        query = {}
+        if self.width is not None:
+            query["w"] = str(self.width)
+        if self.height is not None:
+            query["h"] = str(self.height)
+        if self.fit != "contain":
+            query["fit"] = self.fit
+        if self.format is not None:
+            query["fmt"] = self.format
+        if self.quality is not None:
+            query["q"] = str(self.quality)
+        return query
+
+
+def _target_size(size: Tuple[int, int], params: TransformParams) -> Tuple[int, int]:
+    """计算输出尺寸（contain 模式不放大）"""
+    src_w, src_h = size
+    if params.fit != "contain":
+        return params.width, params.height
+    scale = min(params.width / src_w if params.width else 1.0,
+                params.height / src_h if params.height else 1.0,
+                1.0)
+    return max(1, round(src_w * scale)), max(1, round(src_h * scale))
+
+
+def transform_image(src: str, dest: str, params: TransformParams) -> str:
+    """
+    执行变换并把结果写入 dest（在工作进程中运行）
+
+    JPEG 先用 draft() 让解码器直接按 1/2~1/8 缩小解码，其余格式用 reduce() 做整数倍
+    快速缩小，最后再用 LANCZOS 缩放到目标尺寸。
+
+    Returns:
+        输出格式（jpeg/png/webp/avif）
+    """
+    with Image.open(src) as image:
+        fmt = params.format or SOURCE_FORMATS.get(image.format, "png")
+        color_options = _color_options(image)
+        # 尺寸按显示方向计算：EXIF 方向 5-8 需要旋转 90 度，宽高互换
+        rotated = image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8)
+        src_w, src_h = image.size[::-1] if rotated else image.size
+        target = _target_size((src_w, src_h), params)
+        if params.fit == "cover":
+            # cover 先按短边缩放，保证裁剪后仍填满目标框
+            scale = max(target[0] / src_w, target[1] / src_h)
+            decode_size = (max(1, round(src_w * scale)), max(1, round(src_h * scale)))
+        else:
+            decode_size = target
+
+        if image.format == "JPEG":
+            # draft 作用于旋转前的像素
+            image.draft("RGB", decode_size[::-1] if rotated else decode_size)
+        image = ImageOps.exif_transpose(image)
+        factor = min(image.width // decode_size[0], image.height // decode_size[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+
+        if params.fit == "cover":
+            image = ImageOps.fit(image, target, Image.Resampling.LANCZOS)
+        elif image.size != target:
+            image = image.resize(target, Image.Resampling.LANCZOS)
+
+        pil_format = OUTPUT_FORMATS[fmt][0]
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            image = image.convert("RGBA")
+
+        options = dict(color_options)
+        if pil_format in ("JPEG", "WEBP", "AVIF"):
+            options["quality"] = params.quality or DEFAULT_QUALITY
+        if pil_format == "JPEG":
+            options["optimize"] = True
+        image.save(dest, pil_format, **options)
+    return fmt
+
+
+# 动图转换的默认上限：帧数和总像素数（帧数 x 宽 x 高），超过时不转换，避免占满工作进程
+ANIMATION_MAX_FRAMES = 500
+ANIMATION_MAX_PIXELS = 100_000_000
+
+
+def encode_variant(src: str, dest: str, fmt: str, quality: int,
+                   max_frames: int = ANIMATION_MAX_FRAMES, max_pixels: int = ANIMATION_MAX_PIXELS) -> bool:
+    """
+    把原图按原尺寸重新编码为 fmt（在工作进程中运行）
+
+    动图（GIF 等）只转换为动画 WebP，保留每帧时长和循环次数；帧数或总像素超过上限时不转换。
+
+    Returns:
+        是否已写入 dest
+    """
+    with Image.open(src) as image:
+        if getattr(image, "is_animated", False):
+            return _encode_animation(image, dest, fmt, quality, max_frames, max_pixels)
+        options = _color_options(image)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+        image.save(dest, OUTPUT_FORMATS[fmt][0], quality=quality, **options)
+    return True
+
+
+def _color_options(image: Image.Image) -> dict:
+    """
+    保存时沿用原图的 ICC 颜色配置（WebP 等编码器不会自动从 info 中复制），
+    否则广色域图片（如 Display-P3）会按 sRGB 显示而偏色。CMYK 的配置文件转为 RGB 后不再适用。
+    """
+    icc_profile = image.info.get("icc_profile")
+    if not icc_profile or image.mode == "CMYK":
+        return {}
+    return {"icc_profile": icc_profile}
+
+
+def _encode_animation(image: Image.Image, dest: str, fmt: str, quality: int,
+                      max_frames: int, max_pixels: int) -> bool:
+    if fmt != "webp":
+        return False
+    frames = image.n_frames
+    if frames > max_frames or frames * image.width * image.height > max_pixels:
+        logger.info(f"动图超过转换上限: {frames} 帧, {image.width}x{image.height}")
+        return False
+    durations = []
+    for index in range(frames):
+        image.seek(index)
+        durations.append(image.info.get("duration", 0))
+    image.seek(0)
+    # GIF 没有循环扩展时只播放一次；WebP 的 loop=0 表示无限循环
+    image.save(dest, "WEBP", save_all=True, duration=durations, loop=image.info.get("loop", 1),
+               quality=quality, method=4, **_color_options(image))
+    return True
+
+
+class DerivedCache:
+    """
+    派生图片磁盘缓存
+
+    文件保存在 root/<md5前2位>/<md5>-<参数摘要>.<扩展名>，按字节预算做 LRU 淘汰。
+    启动时扫描已有文件，按访问时间恢复 LRU 顺序。单个超过整个预算的结果不挤占其他缓存：
+    放在 LRU 最前，本次照常返回，下次写入时首先淘汰。
+
+    多个 worker 进程共享同一目录：查找未命中时检查磁盘，采用其他 worker 生成的文件；
+    写入时至多每 rescan_interval 秒重新扫描一次目录，字节预算按目录中的全部文件计算。
+    """
+
+    def __init__(self, root: Path, max_bytes: int, rescan_interval: float = CACHE_RESCAN_INTERVAL):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Path, int]" = OrderedDict()
+        self.total_bytes = 0
+        self._scanned_at = 0.0
+        self._rescan()
+
+    def _scan(self) -> List[Tuple[float, Path, int]]:
+        """扫描目录，返回按访问时间排序的 [(atime, 路径, 大小)]，顺带删除过期的临时文件"""
+        files = []
+        now = time.time()
+        for path in self.root.glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # 扫描期间被其他 worker 淘汰或重命名
+                continue
+            if path.name.startswith("."):
+                if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    path.unlink(missing_ok=True)
+                continue
+            files.append((stat.st_atime, path, stat.st_size))
+        return sorted(files)
+
+    def _rescan(self) -> None:
+        """按磁盘内容重建索引：其他 worker 写入的文件按访问时间排在 LRU 前部，已删除的移除"""
+        files = self._scan()
+        with self._lock:
+            entries: "OrderedDict[Path, int]" = OrderedDict(
+                (path, size) for _, path, size in files if path not in self._entries)
+            for path, size in self._entries.items():
+                # 扫描后才写入的文件也保留
+                if path.exists():
+                    entries[path] = size
+            self._entries = entries
+            self.total_bytes = sum(entries.values())
+            self._scanned_at = time.monotonic()
+            self._evict()
+
+    def _track(self, path: Path, size: int) -> None:
+        """登记一个文件并按预算淘汰（调用方持有锁）"""
+        if path in self._entries:
+            self.total_bytes -= self._entries.pop(path)
+        self._entries[path] = size
+        self.total_bytes += size
+        if size > self.max_bytes:
+            self._entries.move_to_end(path, last=False)
+            logger.warning(f"派生图片超过缓存预算，不保留: {path.name}, 大小: {size}")
+        else:
+            # 不淘汰刚登记的文件：调用方马上要返回它
+            self._evict(keep=path)
+
+    def path_for(self, md5: str, params: TransformParams, fmt: str) -> Path:
+        digest = hashlib.sha1(params.key.encode("utf-8")).hexdigest()[:16]
+        return self.root / md5[:2] / f"{md5}-{digest}.{OUTPUT_FORMATS[fmt][1]}"
+
+    def lookup(self, md5: str, params: TransformParams) -> Optional[Path]:
+        """查找缓存，命中时移到 LRU 末尾"""
+        digest = hashlib.sha1(params.key.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            for _, ext, _ in OUTPUT_FORMATS.values():
+                path = self.root / md5[:2] / f"{md5}-{digest}.{ext}"
+                if path in self._entries:
+                    if path.exists():
+                        if self._entries[path] <= self.max_bytes:
+                            self._entries.move_to_end(path)
+                        return path
+                    # 文件被外部删除（如其他 worker 淘汰）
+                    self.total_bytes -= self._entries.pop(path)
+                    continue
+                try:
+                    size = path.stat().st_size
+                except FileNotFoundError:
+                    continue
+                # 其他 worker 生成的文件
+                self._track(path, size)
+                return path
+        return None
+
+    def temp_path(self, md5: str) -> Path:
+        """在目标目录中分配临时文件（结果写完后原子重命名）"""
+        directory = self.root / md5[:2]
+        directory.mkdir(exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        os.close(fd)
+        return Path(path)
+
+    def add(self, tmp_path: Path, path: Path) -> None:
+        """把写好的临时文件放入缓存并按预算淘汰"""
+        size = tmp_path.stat().st_size
+        if time.monotonic() - self._scanned_at >= self.rescan_interval:
+            self._rescan()
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._track(path, size)
+
+    def remove(self, md5: str) -> int:
+        """删除某张原图的全部派生图片（包括其他 worker 生成的），返回删除数量"""
+        with self._lock:
+            paths = list(self.root.glob(f"{md5[:2]}/{md5}-*"))
+            for path in paths:
+                if path in self._entries:
+                    self.total_bytes -= self._entries.pop(path)
+                path.unlink(missing_ok=True)
+        return len(paths)
+
+    def _evict(self, keep: Optional[Path] = None) -> None:
+        while self.total_bytes > self.max_bytes:
+            path = next((p for p in self._entries if p != keep), None)
+            if path is None:
+                break
+            size = self._entries.pop(path)
+            self.total_bytes -= size
+            path.unlink(missing_ok=True)
+            logger.debug(f"淘汰派生图片缓存: {path.name}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+
+class ImageTransformer:
+    """
+    派生图片生成器
+
+    workers > 0 时在进程池中变换（图片解码和缩放是 CPU 密集型，不占用事件循环和 GIL），
+    workers = 0 时使用默认线程池。同一 (md5, 参数) 的并发请求共享一次计算。
+    """
+
+    def __init__(self, cache: DerivedCache, workers: int = 2):
+        self.cache = cache
+        self._executor: Optional[Executor] = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    @property
+    def executor(self) -> Optional[Executor]:
+        """变换使用的进程池（workers = 0 时为 None）"""
+        return self._executor
+
+    async def get(self, md5: str, src: Path, params: TransformParams) -> Tuple[Path, str]:
+        """
+        返回派生图片路径和 MIME 类型，缓存未命中时生成
+
+        Raises:
+            TransformError: 原图无法按参数变换
+        """
+        path = self.cache.lookup(md5, params)
+        if path is not None:
+            return path, _media_type(path)
+
+        key = (md5, params.key)
+        task = self._inflight.get(key)
+        if task is None:
+            # 在独立任务中生成：发起请求的客户端断开（取消）不影响其他等待者
+            task = asyncio.ensure_future(self._generate(md5, src, params))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        path = await asyncio.shield(task)
+        return path, _media_type(path)
+
+    def _finish(self, key: Tuple[str, str], task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 所有等待者都已断开时避免 "exception was never retrieved" 警告
+            task.exception()
+
+    async def _generate(self, md5: str, src: Path, params: TransformParams) -> Path:
+        tmp_path = self.cache.temp_path(md5)
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                fmt = await loop.run_in_executor(self._executor, transform_image, str(src), str(tmp_path), params)
+            except Exception as e:
+                logger.warning(f"图片变换失败: {md5}, 参数: {params.key}, 错误: {e}")
+                raise TransformError(f"图片变换失败: {e}")
+            path = self.cache.path_for(md5, params, fmt)
+            self.cache.add(tmp_path, path)
+        finally:
+            # 成功时临时文件已被重命名；失败或取消时删除
+            tmp_path.unlink(missing_ok=True)
+        logger.debug(f"生成派生图片: {path.name}")
+        return path
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _media_type(path: Path) -> str:
+    ext = path.suffix.lstrip(".")
+    for _, format_ext, media_type in OUTPUT_FORMATS.values():
+        if format_ext == ext:
+            return media_type
+    return "application/octet-stream"
@@ -0,0 +1,127 @@
+"""
+按键加锁模块
+同一内容（MD5）的并发上传只让第一个请求执行解码、写入和入库，其余请求等待它完成后
+按已存在处理。进程内用线程锁，多个 worker 进程之间用锁目录中的文件锁（fcntl.flock）。
+等待有上限，超时抛出 LockTimeout（对应 HTTP 503），持有者卡住时不会无限占用线程
+"""
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+
+logger = logging.getLogger("image_proxy.keyed_lock")
+
+# 默认最长等待秒数
+DEFAULT_TIMEOUT = 30.0
+# 文件锁非阻塞轮询间隔（秒），从最小值逐步加倍到最大值
+POLL_MIN = 0.01
+POLL_MAX = 0.2
+
+
+class LockTimeout(Exception):
+    """等待锁超时（对应 HTTP 503），retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class KeyedLock:
+    """
+    按键加锁
+
+    hold(keys) 按排序后的顺序逐个加锁，多个请求持有重叠的键时不会死锁。
+    加锁前键对应的工作可能已被前一个持有者完成，调用方拿到锁后应重新检查。
+    所有键共用一个截止时间，timeout 秒内未全部拿到时抛出 LockTimeout。
+    """
+
+    def __init__(self, lock_dir: Optional[Path] = None, timeout: float = DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.lock_dir = Path(lock_dir) if lock_dir is not None and fcntl is not None else None
+        if self.lock_dir is not None:
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self._guard = threading.Lock()
+        # 键 -> [线程锁, 引用计数]
+        self._locks: Dict[str, list] = {}
+
+    @contextmanager
+    def hold(self, keys: Iterable[str]) -> Iterator[None]:
+        deadline = time.monotonic() + self.timeout
+        with ExitStack() as stack:
+            for key in sorted(set(keys)):
+                stack.enter_context(self._hold_one(key, deadline))
+            yield
+
+    def _timeout(self, key: str) -> LockTimeout:
+        logger.warning(f"等待上传锁超时: {key}")
+        return LockTimeout(f"等待同一内容的上传完成超时 ({self.timeout:g}s)",
+                           max(1, math.ceil(self.timeout)))
+
+    @contextmanager
+    def _hold_one(self, key: str, deadline: float) -> Iterator[None]:
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        lock = entry[0]
+        try:
+            if not lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise self._timeout(key)
+        except BaseException:
+            self._unref(key, entry)
+            raise
+        try:
+            fd = self._flock(key, deadline) if self.lock_dir is not None else None
+            try:
+                yield
+            finally:
+                if fd is not None:
+                    # 先删除再解锁：等待者拿到锁后发现文件已被替换会重新打开
+                    (self.lock_dir / f"{key}.lock").unlink(missing_ok=True)
+                    os.close(fd)
+        finally:
+            lock.release()
+            self._unref(key, entry)
+
+    def _unref(self, key: str, entry: list) -> None:
+        with self._guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def _flock(self, key: str, deadline: float) -> int:
+        """在截止时间前获取文件锁（非阻塞轮询），返回文件描述符"""
+        path = self.lock_dir / f"{key}.lock"
+        delay = POLL_MIN
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timeout(key)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, POLL_MAX)
+                continue
+            except BaseException:
+                os.close(fd)
+                raise
+            # 锁文件可能在等待期间被前一个持有者删除，此时锁住的是已失效的文件
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(fd).st_ino:
+                return fd
+            os.close(fd)
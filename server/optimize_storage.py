@@ -0,0 +1,249 @@
+"""
+存储优化脚本
+在低峰时段对已上传的图片做无损重新压缩：PNG 以最高 zlib 级别重新编码，JPEG 在字节层面
+去除元数据段（不重新编码）。只在解码后像素完全一致且文件更小时替换原文件；
+数据库中的MD5仍是上传内容的MD5，已发出的URL不受影响。可能与清理脚本同时运行，
+替换前重新确认图片未被清理。
+
+用法:
+    cd server && python optimize_storage.py [--workers 2] [--until 06:00] [--limit 10000] [--db images.db]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from database import DatabaseManager
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), "../config/config.json")
+DB_FILE = "images.db"
+
+# 保留的 JPEG APPn 段：APP0 (JFIF)、APP2 (ICC 颜色配置)、APP14 (Adobe 颜色变换)
+KEEP_APP_MARKERS = (0xE0, 0xE2, 0xEE)
+EXIF_ORIENTATION = 0x0112
+# 重新编码时需要原样保留的 PNG 元数据（gAMA、cHRM、sRGB、pHYs、eXIf）
+PNG_METADATA_KEYS = ("gamma", "chromaticity", "srgb", "dpi", "exif")
+# Pillow 无法原样写回的 PNG 元数据（非米制单位的 pHYs、bKGD），含有时不处理该文件
+PNG_UNSUPPORTED_KEYS = ("aspect", "background")
+
+# 工作进程中的数据库连接（由 _init_worker 设置），用于替换前确认图片未被清理
+_worker_db: Optional[DatabaseManager] = None
+
+
+def strip_jpeg_metadata(data: bytes, keep_exif: bool = False) -> bytes:
+    """
+    去除 JPEG 的注释和元数据段（EXIF、XMP、缩略图等），图像数据原样保留
+
+    Args:
+        keep_exif: 保留 EXIF（图片依赖 EXIF 方向标记时必须保留）
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("不是 JPEG 文件")
+    out = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("JPEG 段结构无效")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # 段之间的填充字节
+            pos += 1
+            continue
+        if marker == 0xDA:
+            # SOS 之后是压缩数据，原样复制到结尾
+            out.append(data[pos:])
+            return b"".join(out)
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        segment = data[pos:pos + 2 + length]
+        is_exif = marker == 0xE1 and segment[4:10] == b"Exif\x00\x00"
+        if marker == 0xFE or (0xE0 <= marker <= 0xEF and marker not in KEEP_APP_MARKERS
+                              and not (keep_exif and is_exif)):
+            pos += 2 + length
+            continue
+        out.append(segment)
+        pos += 2 + length
+    raise ValueError("JPEG 缺少图像数据")
+
+
+def _png_metadata(image: Image.Image) -> dict:
+    """PNG 中影响显示或需要保留的元数据（颜色、分辨率、EXIF 和文本）"""
+    metadata = {key: image.info.get(key) for key in PNG_METADATA_KEYS + PNG_UNSUPPORTED_KEYS}
+    metadata["text"] = dict(image.text)
+    return metadata
+
+
+def _png_info(image: Image.Image) -> PngInfo:
+    """把原图的 gAMA、cHRM、sRGB 和文本块写回 PngInfo（pHYs 和 eXIf 通过 dpi/exif 参数保存）"""
+    info = PngInfo()
+    if "gamma" in image.info:
+        info.add(b"gAMA", round(image.info["gamma"] * 100000).to_bytes(4, "big"))
+    if "chromaticity" in image.info:
+        info.add(b"cHRM", b"".join(round(value * 100000).to_bytes(4, "big")
+                                   for value in image.info["chromaticity"]))
+    if "srgb" in image.info:
+        info.add(b"sRGB", bytes([image.info["srgb"]]))
+    for key, value in image.text.items():
+        info.add_text(key, value, zip=True)
+    return info
+
+
+def _same_pixels(a: Path, b: Path) -> bool:
+    """两张图片解码后的模式、尺寸和像素是否完全一致，PNG 还要求元数据一致"""
+    with Image.open(a) as image_a, Image.open(b) as image_b:
+        if image_a.mode != image_b.mode or image_a.size != image_b.size:
+            return False
+        if image_a.info.get("icc_profile") != image_b.info.get("icc_profile"):
+            return False
+        if image_a.format == "PNG" and _png_metadata(image_a) != _png_metadata(image_b):
+            return False
+        if image_a.mode == "P":
+            # 调色板可能被精简重排，比较展开后的颜色
+            return image_a.convert("RGBA").tobytes() == image_b.convert("RGBA").tobytes()
+        if image_a.info.get("transparency") != image_b.info.get("transparency"):
+            return False
+        return image_a.tobytes() == image_b.tobytes()
+
+
+def _recompress(path: Path, dest: Path) -> bool:
+    """把 path 无损重新压缩到 dest，不支持的格式返回 False"""
+    with Image.open(path) as image:
+        fmt = image.format
+        if fmt == "PNG" and not getattr(image, "is_animated", False):
+            # 文本块可能位于图像数据之后，读取前需要先解码
+            image.load()
+            if any(key in image.info for key in PNG_UNSUPPORTED_KEYS):
+                return False
+            options = {"optimize": True, "compress_level": 9, "pnginfo": _png_info(image)}
+            for key in ("icc_profile", "dpi", "exif"):
+                if key in image.info:
+                    options[key] = image.info[key]
+            image.save(dest, "PNG", **options)
+            return True
+        if fmt == "JPEG":
+            keep_exif = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+            dest.write_bytes(strip_jpeg_metadata(path.read_bytes(), keep_exif))
+            return True
+    return False
+
+
+def _init_worker(db_file: str) -> None:
+    global _worker_db
+    _worker_db = DatabaseManager(db_file)
+
+
+def _still_stored(src: Path, md5: Optional[str]) -> bool:
+    """文件和数据库记录是否都还在（清理脚本先删文件再删记录）"""
+    if not src.exists():
+        return False
+    return md5 is None or _worker_db is None or _worker_db.get_image(md5) is not None
+
+
+def optimize_file(path: str, md5: Optional[str] = None) -> Tuple[int, int]:
+    """
+    无损优化单个文件（在工作进程中运行）
+
+    Args:
+        md5: 图片的MD5，给定时替换前确认数据库记录仍存在
+
+    Returns:
+        (原大小, 优化后大小)；未优化时两者相等
+    """
+    src = Path(path)
+    original_size = src.stat().st_size
+    fd, tmp = tempfile.mkstemp(dir=src.parent, prefix=".optimize-", suffix=".tmp")
+    os.close(fd)
+    tmp_path = Path(tmp)
+    try:
+        if not _recompress(src, tmp_path):
+            return original_size, original_size
+        new_size = tmp_path.stat().st_size
+        if new_size >= original_size or not _same_pixels(src, tmp_path):
+            return original_size, original_size
+        if not _still_stored(src, md5):
+            # 处理期间被清理：不能把文件写回去
+            return original_size, original_size
+        os.replace(tmp_path, src)
+        return original_size, new_size
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _parse_until(value: Optional[str]) -> Optional[float]:
+    """把 HH:MM 转换为截止时间戳（早于当前时间则为次日）"""
+    if not value:
+        return None
+    hour, minute = (int(x) for x in value.split(":")[:2])
+    now = datetime.now()
+    deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if deadline <= now:
+        deadline += timedelta(days=1)
+    return deadline.timestamp()
+
+
+def optimize(db: DatabaseManager, workers: int = 2, limit: int = 10000,
+             deadline: Optional[float] = None, batch_size: int = 100) -> dict:
+    """
+    优化尚未处理的图片，到达截止时间后不再提交新任务
+
+    Returns:
+        {"processed": 处理数, "optimized": 变小的文件数, "bytes_saved": 节省字节数}
+    """
+    summary = {"processed": 0, "optimized": 0, "bytes_saved": 0}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(str(db.db_file),)) as pool:
+        while summary["processed"] < limit and (deadline is None or time.time() < deadline):
+            batch = db.get_unoptimized_images(min(batch_size, limit - summary["processed"]))
+            if not batch:
+                break
+            futures = {pool.submit(optimize_file, image["path"], image["md5"]): image for image in batch}
+            for future in as_completed(futures):
+                image = futures[future]
+                try:
+                    original_size, new_size = future.result()
+                except FileNotFoundError:
+                    # 文件已被清理，记录后跳过
+                    original_size = new_size = image["file_size"]
+                except Exception as e:
+                    print(f"优化失败: {image['md5']}: {e}")
+                    original_size = new_size = image["file_size"]
+                recorded = db.record_optimization(image["md5"], original_size, new_size)
+                summary["processed"] += 1
+                if recorded and new_size < original_size:
+                    summary["optimized"] += 1
+                    summary["bytes_saved"] += original_size - new_size
+    return summary
+
+
+def main():
+    try:
+        with open(CONFIG_FILE, encoding="utf-8") as f:
+            optimize_config = json.load(f).get("optimize", {})
+    except (FileNotFoundError, ValueError):
+        optimize_config = {}
+
+    parser = argparse.ArgumentParser(description="无损压缩已上传的图片")
+    parser.add_argument("--db", default=DB_FILE, help="数据库文件（默认 images.db）")
+    parser.add_argument("--workers", type=int, default=optimize_config.get("workers", 2), help="工作进程数")
+    parser.add_argument("--until", default=optimize_config.get("until"),
+                        help="截止时间 HH:MM，到时不再处理新图片（低峰时段结束时间）")
+    parser.add_argument("--limit", type=int, default=optimize_config.get("limit", 10000), help="最多处理图片数")
+    args = parser.parse_args()
+
+    start = time.time()
+    summary = optimize(DatabaseManager(args.db), workers=args.workers, limit=args.limit,
+                       deadline=_parse_until(args.until))
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Optimize finished in {time.time() - start:.2f}s, "
+          f"{summary['processed']} images processed, {summary['optimized']} recompressed, "
+          f"{summary['bytes_saved']} bytes saved.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+感知哈希模块
+为图片计算 64 位 dHash，并在内存中建立多索引哈希（Multi-Index Hashing）用于按汉明距离
+查找近似重复的图片：同一张图重新编码、缩放或去除 EXIF 后 dHash 基本不变
+"""
+import logging
+import threading
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from PIL import Image
+
+
+logger = logging.getLogger("image_proxy.phash")
+
+HASH_BITS = 64
+# 多索引哈希：把 64 位拆成 4 段 16 位，每段一个倒排表
+SEGMENTS = 4
+SEGMENT_BITS = HASH_BITS // SEGMENTS
+SEGMENT_MASK = (1 << SEGMENT_BITS) - 1
+# 支持的最大查询距离：每段最多枚举 2 位翻转（137 个邻居），查询保持在亚毫秒级
+MAX_DISTANCE = SEGMENTS * 3 - 1
+# 计算哈希前把图片缩小到的边长（dHash 只需要 9x8，入库分析的占位图也用这份缩略图）
+WORK_SIZE = 64
+
+
+def dhash(path) -> Optional[int]:
+    """
+    计算 64 位差异哈希（灰度缩小到 9x8，比较每行相邻像素）
+
+    Returns:
+        无符号 64 位整数；无法解码时返回 None
+    """
+    try:
+        with Image.open(path) as image:
+            return dhash_image(working_copy(image))
+    except Exception as e:
+        logger.warning(f"计算感知哈希失败: {e}")
+        return None
+
+
+def working_copy(image: Image.Image, size: int = WORK_SIZE) -> Image.Image:
+    """
+    把已打开的图片（动图取第一帧）缩小为最长边约 size 的 RGB 或 RGBA 图片
+
+    JPEG 让解码器直接按 1/8 缩小解码，其他格式先按整数倍缩小再重采样，缩小后再转换颜色；
+    只有调色板和带透明色的图片（缩放只能取最近邻）需要在原尺寸上先转换。
+    """
+    mode = "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+    if image.format == "JPEG":
+        image.draft("RGB", (size, size))
+    if image.mode in ("P", "1") or "transparency" in image.info:
+        image = image.convert(mode)
+    else:
+        image = image.copy()
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return image if image.mode == mode else image.convert(mode)
+
+
+def dhash_image(image: Image.Image) -> int:
+    """计算已打开图片的 dHash"""
+    pixels = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS, reducing_gap=3.0).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_signed(value: int) -> int:
+    """无符号 64 位 -> SQLite INTEGER（有符号 64 位）"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value: int) -> int:
+    """SQLite INTEGER -> 无符号 64 位"""
+    return value + (1 << 64) if value < 0 else value
+
+
+def _segment_neighbors(radius: int) -> List[int]:
+    """16 位空间内汉明距离不超过 radius 的所有翻转掩码"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(SEGMENT_BITS), r):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            masks.append(mask)
+    return masks
+
+
+_NEIGHBOR_MASKS = [_segment_neighbors(r) for r in range(MAX_DISTANCE // SEGMENTS + 1)]
+
+
+class HashIndex:
+    """
+    感知哈希的内存索引
+
+    距离 <= d 的两个哈希，4 段中至少有一段距离 <= d // 4（鸽巢原理）。查询时只在各段倒排表中
+    枚举这么多位翻转的邻居得到候选，再用 popcount 精确过滤，不需要遍历全部哈希。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes: Dict[str, int] = {}
+        self._tables: List[Dict[int, Set[str]]] = [{} for _ in range(SEGMENTS)]
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    @staticmethod
+    def _segments(value: int) -> List[int]:
+        return [(value >> (i * SEGMENT_BITS)) & SEGMENT_MASK for i in range(SEGMENTS)]
+
+    def add(self, md5: str, value: int) -> None:
+        with self._lock:
+            if md5 in self._hashes:
+                self._discard(md5)
+            self._hashes[md5] = value
+            for table, segment in zip(self._tables, self._segments(value)):
+                table.setdefault(segment, set()).add(md5)
+
+    def add_many(self, items: Iterable[Tuple[str, int]]) -> None:
+        for md5, value in items:
+            self.add(md5, value)
+
+    def remove(self, md5: str) -> None:
+        with self._lock:
+            self._discard(md5)
+
+    def _discard(self, md5: str) -> None:
+        value = self._hashes.pop(md5, None)
+        if value is None:
+            return
+        for table, segment in zip(self._tables, self._segments(value)):
+            bucket = table.get(segment)
+            if bucket is not None:
+                bucket.discard(md5)
+                if not bucket:
+                    del table[segment]
+
+    def get(self, md5: str) -> Optional[int]:
+        return self._hashes.get(md5)
+
+    def search(self, value: int, max_distance: int, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        查找汉明距离不超过 max_distance 的哈希
+
+        Returns:
+            [(md5, 距离)]，按距离升序
+        """
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f"max_distance 必须在 0-{MAX_DISTANCE} 之间")
+        masks = _NEIGHBOR_MASKS[max_distance // SEGMENTS]
+        results: Dict[str, int] = {}
+        seen: Set[str] = set()
+        with self._lock:
+            for table, segment in zip(self._tables, self._segments(value)):
+                for mask in masks:
+                    bucket = table.get(segment ^ mask)
+                    if not bucket:
+                        continue
+                    for md5 in bucket - seen:
+                        seen.add(md5)
+                        distance = (self._hashes[md5] ^ value).bit_count()
+                        if distance <= max_distance:
+                            results[md5] = distance
+        ordered = sorted(results.items(), key=lambda item: (item[1], item[0]))
+        return ordered[:limit] if limit else ordered
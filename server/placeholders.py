@@ -0,0 +1,133 @@
+"""
+占位图模块
+新图片入库时一次解码，同时得到尺寸、感知哈希和低质量占位图（LQIP）：BlurHash 字符串和
+约 16px 的 WebP 缩略图（data URI）。前端可以在原图下载完成前先渲染占位图，不需要额外请求
+"""
+import base64
+import io
+import logging
+import math
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from phash import dhash_image, working_copy
+
+
+logger = logging.getLogger("image_proxy.placeholders")
+
+BASE83_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+# 计算 BlurHash 前把图片缩小到的边长（分量只反映低频信息，32px 足够）
+BLURHASH_SAMPLE_SIZE = 32
+# 缩略预览的最长边
+PREVIEW_SIZE = 16
+PREVIEW_QUALITY = 40
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(BASE83_CHARS[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+_SRGB_TO_LINEAR = [_srgb_to_linear(v) for v in range(256)]
+
+
+def blurhash_encode(image: Image.Image, x_components: int = 4, y_components: int = 3) -> str:
+    """
+    按 BlurHash 算法编码图片（https://blurha.sh）
+
+    纯 Python 实现，不依赖 blurhash-python 等编译扩展：输入先缩小到
+    BLURHASH_SAMPLE_SIZE，计算量很小，部署时无需额外的二进制包
+    """
+    image = image.convert("RGB")
+    image.thumbnail((BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE), Image.Resampling.BOX)
+    width, height = image.size
+    data = image.tobytes()
+    linear = [_SRGB_TO_LINEAR[v] for v in data]
+
+    # 预先计算每行、每列的余弦基函数
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors: List[List[float]] = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                basis_y = cos_y[j][y]
+                row = y * width * 3
+                for x in range(width):
+                    basis = cos_x[i][x] * basis_y
+                    offset = row + x * 3
+                    r += basis * linear[offset]
+                    g += basis * linear[offset + 1]
+                    b += basis * linear[offset + 2]
+            scale = normalisation / (width * height)
+            factors.append([r * scale, g * scale, b * scale])
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(v) for factor in ac for v in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        max_value = 1
+        result += _base83(0, 1)
+
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        quant = [max(0, min(18, int(_sign_pow(v / max_value, 0.5) * 9 + 9.5))) for v in factor]
+        result += _base83(quant[0] * 19 * 19 + quant[1] * 19 + quant[2], 2)
+    return result
+
+
+def tiny_preview(image: Image.Image, size: int = PREVIEW_SIZE) -> str:
+    """生成最长边为 size 的 WebP 缩略图，返回 data URI"""
+    preview = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    preview.thumbnail((size, size), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    preview.save(buf, "WEBP", quality=PREVIEW_QUALITY, method=6)
+    return "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def analyze_upload(path: str) -> Dict[str, Any]:
+    """
+    入库分析：尺寸、感知哈希、BlurHash 和缩略预览（在 CPU 进程池中运行）
+
+    只解码一次并缩小为约 64px 的工作副本（JPEG 按 1/8 缩小解码），三者共用；只有尺寸取自原图。
+
+    Returns:
+        {"width", "height", "phash", "blurhash", "preview"}；无法解码时各项为 None
+    """
+    result: Dict[str, Optional[Any]] = {"width": None, "height": None, "phash": None,
+                                        "blurhash": None, "preview": None}
+    try:
+        with Image.open(path) as image:
+            result["width"], result["height"] = image.size
+            work = working_copy(image)
+        result["phash"] = dhash_image(work)
+        x_components, y_components = (4, 3) if work.width >= work.height else (3, 4)
+        result["blurhash"] = blurhash_encode(work, x_components, y_components)
+        result["preview"] = tiny_preview(work)
+    except Exception as e:
+        logger.warning(f"图片入库分析失败: {path}: {e}")
+    return result
@@ -0,0 +1,56 @@
+"""
+索引重建脚本
+为已有数据库重建原始文件名全文索引（/search 使用），可选同时重建统计表、回填感知哈希（/similar 使用）
+
+用法:
+    cd server && python rebuild_index.py [--stats] [--phash] [--db images.db]
+"""
+import argparse
+import time
+
+from database import DatabaseManager
+from phash import dhash, to_signed
+
+DB_FILE = "images.db"
+
+
+def backfill_phash(db: DatabaseManager, batch_size: int = 1000) -> int:
+    """为缺少感知哈希的图片补算，无法解码的图片跳过"""
+    total = 0
+    skipped = set()
+    while True:
+        batch = [image for image in db.get_images_without_phash(batch_size + len(skipped))
+                 if image["md5"] not in skipped]
+        if not batch:
+            return total
+        items = []
+        for image in batch:
+            value = dhash(image["path"])
+            if value is None:
+                skipped.add(image["md5"])
+            else:
+                items.append((image["md5"], to_signed(value)))
+        db.set_phashes(items)
+        total += len(items)
+        print(f"感知哈希回填: {total}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建 Image Proxy 数据库索引")
+    parser.add_argument("--db", default=DB_FILE, help="数据库文件（默认 images.db）")
+    parser.add_argument("--stats", action="store_true", help="同时重建统计表")
+    parser.add_argument("--phash", action="store_true", help="为缺少感知哈希的旧图片补算")
+    args = parser.parse_args()
+
+    start = time.time()
+    db = DatabaseManager(args.db)
+    db.rebuild_search_index()
+    if args.stats:
+        db.rebuild_stats()
+    if args.phash:
+        backfill_phash(db)
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Rebuild finished in {time.time() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,15 @@ class SecurityManager:
         except Exception:
             return None
     
+    def sign_transform(self, token: str, transform_key: str) -> str:
+        """为图片变换参数签名（绑定到访问 token，参数被篡改时签名失效）"""
+        msg = f"{token}|{transform_key}".encode("utf-8")
+        return hmac.new(self.secret_key, msg, hashlib.sha256).hexdigest()[:32]
+    
+    def verify_transform(self, token: str, transform_key: str, signature: str) -> bool:
+        """验证图片变换参数签名"""
+        return hmac.compare_digest(self.sign_transform(token, transform_key), signature or "")
+    
     @staticmethod
     def generate_secret_key() -> str:
         """生成安全的密钥"""
@@ -72,10 +81,14 @@ class FileValidator:
     
     def validate_file(self, file_data: bytes, filename: str) -> Dict[str, Any]:
         """验证文件"""
+        return self.validate_upload(file_data[:16], len(file_data), filename)
+    
+    def validate_upload(self, head: bytes, size: int, filename: str) -> Dict[str, Any]:
+        """根据文件头、大小和文件名验证（流式接收的文件无需读入内存）"""
         result = {"valid": True, "errors": []}
         
         # 检查文件大小
-        if len(file_data) > self.max_size_bytes:
+        if size > self.max_size_bytes:
             result["valid"] = False
             result["errors"].append(f"文件大小超限，最大允许 {self.max_size_bytes / 1024 / 1024:.1f}MB")
         
@@ -85,7 +98,7 @@ class FileValidator:
             result["errors"].append("文件名包含非法字符")
         
         # 检查文件类型
-        file_type = self._detect_file_type(file_data)
+        file_type = self._detect_file_type(head)
         if file_type not in self.allowed_types:
             result["valid"] = False
             result["errors"].append(f"不支持的文件类型，支持: {', '.join(self.allowed_types)}")
@@ -146,6 +159,14 @@ class RateLimiter:
         self.requests[client_id].append(now)
         return True
     
+    def get_retry_after(self, client_id: str) -> int:
+        """距离下一次允许请求的秒数（用于 Retry-After 响应头）"""
+        timestamps = self.requests.get(client_id)
+        if not timestamps or len(timestamps) < self.max_requests:
+            return 0
+        oldest = timestamps[-self.max_requests]
+        return max(1, int(oldest + self.window_seconds - time.time()) + 1)
+    
     def cleanup(self) -> None:
         """清理过期记录"""
         now = time.time()
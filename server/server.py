@@ -3,14 +3,20 @@ Image Proxy Server - 重构版本
 高性能图片上传与代理服务，支持安全认证、文件验证、速率限制等功能
 """
 import os
+import re
 import json
 import time
+import asyncio
+import threading
 from io import BytesIO
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlencode
 
-from fastapi import FastAPI, UploadFile, HTTPException, Query, Request, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request, Depends, Body
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from PIL import Image
 
 # 导入自定义模块
@@ -18,6 +24,19 @@ from config_validator import validate_config_file, ConfigValidationError
 from security_utils import SecurityManager, FileValidator, RateLimiter
 from database import DatabaseManager
 from logger_config import setup_logger, get_logger
+from snapshot import SnapshotManager
+from batch_upload import BatchUploadError, HashingWriter, MultipartReceiver, ReceivedPart, get_boundary
+from upload_sessions import UploadSessionError, UploadSessionManager
+from image_transform import DerivedCache, ImageTransformer, TransformError, TransformParams, OUTPUT_FORMATS
+from variants import VariantGenerator
+from phash import HashIndex, MAX_DISTANCE, dhash, to_signed, to_unsigned
+from placeholders import analyze_upload
+from keyed_lock import KeyedLock, LockTimeout
+from admission import AdmissionController, AdmissionRejected
+from transfer_utils import (
+    RangeNotSatisfiable, etag_matches, parse_range,
+    negotiate_encoding, negotiate_format, iter_file, iter_compressed
+)
 
 # -------------------------------
 # 全局变量
@@ -34,10 +53,28 @@ security_manager: Optional[SecurityManager] = None
 file_validator: Optional[FileValidator] = None
 rate_limiter: Optional[RateLimiter] = None
 db_manager: Optional[DatabaseManager] = None
+snapshot_manager: Optional[SnapshotManager] = None
+upload_sessions: Optional[UploadSessionManager] = None
+image_transformer: Optional[ImageTransformer] = None
+variant_generator: Optional[VariantGenerator] = None
+phash_index: Optional[HashIndex] = None
+# 感知哈希索引已同步到的写入序号和上次同步时间（见 sync_phash_index）
+phash_cursor = 0
+phash_synced_at = 0.0
+PHASH_SYNC_BATCH = 1000
+PHASH_SYNC_INTERVAL = 1.0
+phash_sync_lock = threading.Lock()
+upload_locks: Optional[KeyedLock] = None
+admission: Optional[AdmissionController] = None
 logger = None
 
 # 常量
 UPLOAD_DIR = "uploads"
+# 批量查询单次最多MD5数
+MAX_INFO_BATCH = 1000
+# 批量上传单次最多文件数
+MAX_UPLOAD_BATCH = 100
+MD5_PATTERN = re.compile(r"[0-9a-f]{32}")
 
 # -------------------------------
 # 启动事件
@@ -45,7 +82,7 @@ UPLOAD_DIR = "uploads"
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化所有组件"""
-    global config, security_manager, file_validator, rate_limiter, db_manager, logger
+    global config, security_manager, file_validator, rate_limiter, db_manager, snapshot_manager, upload_sessions, image_transformer, variant_generator, phash_index, phash_cursor, phash_synced_at, upload_locks, admission, logger
     
     try:
         # 1. 加载并验证配置
@@ -90,6 +127,77 @@ async def startup_event():
         db_manager = DatabaseManager()
         logger.info("数据库初始化完成")
         
+        # 8. 初始化数据库快照管理器
+        download_config = config.get("download_db", {})
+        snapshot_manager = SnapshotManager(
+            db_manager,
+            snapshot_dir=download_config.get("snapshot_dir", "snapshots"),
+            min_interval=download_config.get("snapshot_min_interval_seconds", 60)
+        )
+        logger.info("数据库快照管理器初始化完成")
+        
+        # 9. 初始化分片上传会话管理器（会话目录位于上传目录内，拼接后可直接重命名到位）
+        session_config = config.get("upload_sessions", {})
+        upload_sessions = UploadSessionManager(
+            Path(UPLOAD_DIR) / ".sessions",
+            chunk_size=int(session_config.get("chunk_size_mb", 4) * 1024 * 1024),
+            ttl_seconds=int(session_config.get("ttl_hours", 24) * 3600)
+        )
+        upload_sessions.sweep()
+        logger.info("分片上传会话管理器初始化完成")
+        
+        # 10. 初始化图片变换（派生图片缓存 + 进程池）
+        transform_config = config.get("transform", {})
+        image_transformer = ImageTransformer(
+            DerivedCache(
+                Path(transform_config.get("cache_dir", "cache/derived")),
+                max_bytes=int(transform_config.get("cache_max_mb", 1024) * 1024 * 1024)
+            ),
+            workers=transform_config.get("workers", 2)
+        )
+        logger.info("图片变换初始化完成")
+        
+        # 11. 初始化格式变体生成（可选，新上传的图片在后台生成 AVIF/WebP 版本）
+        variant_config = config.get("variants", {})
+        if variant_config.get("enable", False):
+            variant_generator = VariantGenerator(
+                db_manager,
+                UPLOAD_DIR,
+                formats=variant_config.get("formats", ["avif", "webp"]),
+                quality=variant_config.get("quality", 75),
+                encoder=image_transformer.executor,
+                max_frames=variant_config.get("animation_max_frames", 500),
+                max_pixels=variant_config.get("animation_max_pixels", 100000000)
+            )
+            logger.info(f"格式变体生成已启用: {', '.join(variant_generator.formats)}")
+        
+        # 12. 加载感知哈希索引（近似重复查找）
+        load_start = time.time()
+        phash_index = HashIndex()
+        # 先记下写入序号再载入：载入期间其他 worker 写入的哈希在首次查询时补上
+        phash_cursor = db_manager.get_phash_seq()
+        phash_synced_at = 0.0
+        phash_index.add_many((md5, to_unsigned(value)) for md5, value in db_manager.iter_phashes())
+        logger.info(f"感知哈希索引加载完成: {len(phash_index)} 条, 耗时 {time.time() - load_start:.2f}s")
+        
+        # 13. 初始化上传锁（同一内容的并发上传只处理一次，锁文件位于上传目录内，多个 worker 共享）
+        upload_locks = KeyedLock(Path(UPLOAD_DIR) / ".locks",
+                                 timeout=config.get("admission", {}).get("lock_timeout_seconds", 30))
+        
+        # 14. 初始化上传准入控制（限制并发上传数和在途字节数，读取优先）
+        admission_config = config.get("admission", {})
+        admission = AdmissionController(
+            max_concurrent_uploads=admission_config.get("max_concurrent_uploads", 16),
+            max_inflight_bytes=int(admission_config.get("max_inflight_mb", 512) * 1024 * 1024),
+            max_queue=admission_config.get("max_queue", 64),
+            max_wait_seconds=admission_config.get("max_wait_seconds", 10),
+            read_priority_threshold=admission_config.get("read_priority_threshold", 64),
+            weights={u["username"]: u.get("weight", 1) for u in config.get("users", [])},
+            max_user_queue=admission_config.get("max_user_queue", 16),
+            quantum_bytes=max(1, int(admission_config.get("quantum_kb", 1024) * 1024))
+        )
+        logger.info("上传准入控制初始化完成")
+        
         logger.info("=== 所有组件初始化完成 ===")
         
     except Exception as e:
@@ -114,121 +222,696 @@ def check_rate_limit(request: Request):
     client_ip = request.client.host
     if not rate_limiter.is_allowed(client_ip):
         logger.warning(f"速率限制触发: {client_ip}")
-        raise HTTPException(status_code=429, detail="请求过于频繁，请稍后再试")
+        raise HTTPException(
+            status_code=429,
+            detail="请求过于频繁，请稍后再试",
+            headers={"Retry-After": str(rate_limiter.get_retry_after(client_ip))}
+        )
+
+async def admit_upload(request: Request, current_user: Dict[str, str] = Depends(get_current_user)):
+    """
+    上传准入控制：超出并发上传数或在途字节数时按用户加权公平排队，队列已满或等待超时返回 503 和 Retry-After
+    
+    在途字节按 Content-Length 计算，没有请求体（如完成分片上传）时按单文件上限计算。
+    速率限制在排队之前检查，超限的请求不占用队列位置。
+    """
+    check_rate_limit(request)
+    if admission is None:
+        yield
+        return
+    content_length = request.headers.get("content-length")
+    size = int(content_length) if content_length and content_length.isdigit() else 0
+    try:
+        async with admission.upload(size or file_validator.max_size_bytes, current_user["username"]):
+            yield
+    except AdmissionRejected as e:
+        logger.warning(f"上传被拒绝: {e}, 用户: {current_user['username']}, 队列长度: {admission.queue_depth}")
+        raise HTTPException(status_code=503, detail=f"服务繁忙: {e}，请稍后重试",
+                            headers={"Retry-After": str(e.retry_after)})
+
+def lock_busy(e: LockTimeout) -> HTTPException:
+    """同一内容的上传锁等待超时：返回 503 和 Retry-After，由客户端稍后重试"""
+    return HTTPException(status_code=503, detail=f"服务繁忙: {e}，请稍后重试",
+                         headers={"Retry-After": str(e.retry_after)})
+
+async def track_read():
+    """标记进行中的读取：读取不受准入限制，读取并发较高时暂停放行新的上传"""
+    if admission is None:
+        yield
+        return
+    with admission.read():
+        yield
 
 # -------------------------------
 # 工具函数
 # -------------------------------
-def get_image_size(data: bytes) -> tuple:
-    """获取图片尺寸"""
+def get_image_size(data) -> tuple:
+    """获取图片尺寸（data 为图片内容或文件路径，文件只读取头部）"""
     try:
-        image = Image.open(BytesIO(data))
-        return image.size
+        with Image.open(BytesIO(data) if isinstance(data, bytes) else data) as image:
+            return image.size
     except Exception as e:
         logger.warning(f"无法获取图片尺寸: {e}")
         return None, None
 
-def generate_image_url(md5: str, username: str, password: str) -> str:
-    """生成图片访问URL"""
+def generate_image_url(md5: str, username: str, password: str,
+                       transform: Optional[TransformParams] = None) -> str:
+    """生成图片访问URL（指定 transform 时生成带签名变换参数的派生图片URL）"""
     expire_days = config["cleanup"]["expire_days"]
     expire_time = int(time.time()) + expire_days * 86400
     token = security_manager.generate_token(username, password, md5, expire_time)
     
     server_domain = config["server"]["domain"].rstrip("/")
-    return f"{server_domain}/secure_get/{md5}?token={token}"
+    url = f"{server_domain}/secure_get/{md5}?token={token}"
+    if transform is not None:
+        query = transform.to_query()
+        query["sig"] = security_manager.sign_transform(token, transform.key)
+        url += "&" + urlencode(query)
+    return url
+
+def parse_transform(width: Optional[int], height: Optional[int], fit: Optional[str],
+                    fmt: Optional[str], quality: Optional[int]) -> Optional[TransformParams]:
+    """解析变换查询参数，全部为空时返回 None（原图）"""
+    if width is None and height is None and fit is None and fmt is None and quality is None:
+        return None
+    try:
+        return TransformParams(width, height, fit or "contain", fmt, quality,
+                               max_dimension=config.get("transform", {}).get("max_dimension", 4096))
+    except TransformError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def build_image_info(image_info: Dict[str, Any], username: str, password: str) -> Dict[str, Any]:
+    """把数据库记录转换为 /info 响应格式"""
+    return {
+        "url": generate_image_url(image_info["md5"], username, password),
+        "expire_at": image_info["created_at"] + config["cleanup"]["expire_days"] * 86400,
+        "name": image_info["original_name"],
+        "width": image_info["width"],
+        "height": image_info["height"],
+        "access_count": image_info["access_count"],
+        "file_size": image_info["file_size"],
+        "blurhash": image_info.get("blurhash"),
+        "preview": image_info.get("preview"),
+        "status": "existing"
+    }
 
 # -------------------------------
 # API 端点
 # -------------------------------
+def parse_declared_upload(request: Request) -> Tuple[Optional[str], Optional[int]]:
+    """解析客户端预先声明的内容MD5和大小（X-Content-MD5 / X-Content-Size 请求头）"""
+    md5 = request.headers.get("x-content-md5")
+    size = request.headers.get("x-content-size")
+    if md5 is not None:
+        md5 = md5.strip().lower()
+        if not MD5_PATTERN.fullmatch(md5):
+            raise HTTPException(status_code=400, detail="X-Content-MD5 格式错误")
+    if size is not None:
+        try:
+            size = int(size)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Content-Size 格式错误")
+        if size > file_validator.max_size_bytes:
+            raise HTTPException(status_code=413, detail="文件过大")
+    return md5, size
+
+async def skip_body(request: Request) -> None:
+    """
+    不需要请求体时调用
+    
+    客户端发送了 Expect: 100-continue 时不读取（服务器不会回复 100，客户端也就不发送请求体）；
+    否则读出并丢弃，避免在客户端仍在发送时关闭连接。
+    """
+    if request.headers.get("expect", "").lower() == "100-continue":
+        return
+    async for _ in request.stream():
+        pass
+
+async def receive_multipart(request: Request, max_parts: int) -> MultipartReceiver:
+    """流式接收 multipart 请求体，调用方负责 receiver.cleanup()"""
+    receiver = MultipartReceiver(get_boundary(request.headers.get("content-type")),
+                                 Path(UPLOAD_DIR), file_validator.max_size_bytes, max_parts)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(receiver.write, chunk)
+        receiver.finalize()
+    except BaseException:
+        receiver.cleanup()
+        raise
+    return receiver
+
 @app.post("/upload")
 async def upload_image(
     request: Request,
-    file: UploadFile,
-    current_user: Dict[str, str] = Depends(get_current_user)
+    near_duplicate: Optional[int] = Query(None, ge=0, le=MAX_DISTANCE,
+                                          description="近似重复的最大汉明距离，命中时返回已有图片"),
+    current_user: Dict[str, str] = Depends(get_current_user),
+    _admitted: None = Depends(admit_upload)
 ):
-    """上传图片接口"""
-    # 速率限制检查
-    check_rate_limit(request)
+    """
+    上传图片接口（multipart/form-data，文件字段 file）
     
-    logger.info(f"用户 {current_user['username']} 开始上传文件: {file.filename}")
+    秒传：客户端可用 X-Content-MD5（及可选的 X-Content-Size）请求头预先声明内容。
+    服务器已有该内容时直接返回 existing 而不接收文件，配合 Expect: 100-continue 时请求体不会发送；
+    否则边接收边计算MD5，与声明不符时返回 400。
+    
+    指定 near_duplicate 时，感知哈希距离在该范围内的已有图片视为同一张，返回 similar 而不保存新文件。
+    """
+    declared_md5, declared_size = parse_declared_upload(request)
     
     try:
-        # 读取文件内容
-        content = await file.read()
+        # 秒传：内容已存在时不接收请求体
+        if declared_md5:
+            existing_image = await run_in_threadpool(db_manager.get_image, declared_md5)
+            if existing_image:
+                await skip_body(request)
+                await run_in_threadpool(db_manager.record_dedup_hit, declared_md5)
+                logger.info(f"用户 {current_user['username']} 秒传命中: {declared_md5}")
+                return {
+                    "md5": declared_md5,
+                    "url": generate_image_url(declared_md5, current_user['username'], current_user['password']),
+                    "expire_at": existing_image["created_at"] + config["cleanup"]["expire_days"] * 86400,
+                    "name": existing_image["original_name"],
+                    "width": existing_image["width"],
+                    "height": existing_image["height"],
+                    "access_count": existing_image["access_count"] + 1,
+                    "blurhash": existing_image["blurhash"],
+                    "preview": existing_image["preview"],
+                    "status": "existing"
+                }
+        
+        receiver = await receive_multipart(request, max_parts=1)
+        try:
+            if not receiver.parts:
+                raise HTTPException(status_code=400, detail="缺少上传文件")
+            part = receiver.parts[0]
+            logger.info(f"用户 {current_user['username']} 上传文件: {part.filename}, 大小: {part.size} bytes")
+            
+            # 文件验证
+            validation_result = file_validator.validate_upload(part.head, part.size, part.filename or "unknown")
+            if not validation_result["valid"]:
+                logger.warning(f"文件验证失败: {validation_result['errors']}")
+                raise HTTPException(status_code=400, detail=f"文件验证失败: {', '.join(validation_result['errors'])}")
+            
+            # 校验声明的内容
+            if declared_md5 and part.md5 != declared_md5:
+                logger.warning(f"内容MD5与声明不符: {part.md5} != {declared_md5}")
+                raise HTTPException(status_code=400, detail="内容MD5与声明不符")
+            if declared_size is not None and part.size != declared_size:
+                raise HTTPException(status_code=400, detail="内容大小与声明不符")
+            
+            result = (await run_in_threadpool(
+                store_batch, [part], current_user['username'], current_user['password'], near_duplicate
+            ))[0]
+        finally:
+            receiver.cleanup()
+        
+        logger.info(f"图片上传完成: {result['md5']}, 状态: {result['status']}")
+        return result
         
-        # 文件验证
-        validation_result = file_validator.validate_file(content, file.filename or "unknown")
+    except HTTPException:
+        raise
+    except BatchUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LockTimeout as e:
+        raise lock_busy(e)
+    except Exception as e:
+        logger.error(f"上传处理失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+def store_batch(parts: List[ReceivedPart], username: str, password: str,
+                near_distance: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    校验、去重并保存批量上传的文件，数据库记录在一个事务中提交
+    
+    新图片在入库前（在图片变换进程池中）一次解码得到尺寸、感知哈希和占位图；指定 near_distance 时，与已有图片距离不超过该值的视为近似重复，
+    不保存，返回已有图片（status 为 similar，带 distance）。
+    
+    同一内容的并发上传按MD5加锁（跨 worker 进程用文件锁）：只有第一个请求解码、写入和入库，
+    其余请求等它完成后按已存在处理。
+    
+    Returns:
+        与 parts 顺序一致的结果列表，每项格式同 /upload 响应并带 md5；失败项为 {"status": "error", "error": ...}
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(parts)
+    valid_parts = []
+    for part in parts:
+        name = part.filename or "unknown"
+        validation = file_validator.validate_upload(part.head, part.size, name)
+        if not validation["valid"]:
+            results[part.index] = {"name": part.filename, "status": "error",
+                                   "error": f"文件验证失败: {', '.join(validation['errors'])}"}
+            part.discard()
+        else:
+            valid_parts.append(part)
+    
+    existing = db_manager.get_images([part.md5 for part in valid_parts])
+    new_md5s = [part.md5 for part in valid_parts if part.md5 not in existing and part.path is not None]
+    with upload_locks.hold(new_md5s) if upload_locks is not None else nullcontext():
+        if new_md5s:
+            # 加锁前同一内容可能已被其他请求保存
+            existing.update(db_manager.get_images(new_md5s))
+        ingest_parts(valid_parts, existing, results, username, password, near_distance)
+    return results
+
+def ingest_parts(valid_parts: List[ReceivedPart], existing: Dict[str, Dict[str, Any]],
+                 results: List[Optional[Dict[str, Any]]], username: str, password: str,
+                 near_distance: Optional[int]) -> None:
+    """保存已校验的文件并写入 results（调用方已持有新内容的MD5锁）"""
+    expire_seconds = config["cleanup"]["expire_days"] * 86400
+    rows: List[Dict[str, Any]] = []
+    row_index: List[int] = []
+    analyses = analyze_parts([part for part in valid_parts if part.md5 not in existing and part.path is not None])
+    for part in valid_parts:
+        file_path = Path(UPLOAD_DIR) / f"{part.md5}.png"  # 统一使用PNG格式
+        info = existing.get(part.md5)
+        analysis = analyses.get(part.md5, {})
+        phash = analysis.get("phash")
+        if info is None and part.path is not None:
+            similar = find_near_duplicate(phash, near_distance) if near_distance is not None else None
+            if similar is not None:
+                similar_info, distance = similar
+                part.discard()
+                results[part.index] = {
+                    **build_image_info(similar_info, username, password),
+                    "md5": similar_info["md5"],
+                    "status": "similar",
+                    "distance": distance
+                }
+                continue
+        if info is None and part.path is not None:
+            os.replace(part.path, file_path)
+            part.path = None
+        else:
+            part.discard()
+        
+        if info is None:
+            width, height = analysis.get("width"), analysis.get("height")
+            if width is None:
+                width, height = get_image_size(file_path)
+            info = {"md5": part.md5, "original_name": part.filename, "width": width or 0,
+                    "height": height or 0, "file_size": part.size, "created_at": int(time.time()),
+                    "access_count": 0, "blurhash": analysis.get("blurhash"), "preview": analysis.get("preview")}
+            existing[part.md5] = info
+        rows.append({"md5": part.md5, "path": str(file_path), "original_name": part.filename,
+                     "width": info["width"], "height": info["height"], "file_size": part.size,
+                     "phash": to_signed(phash) if phash is not None else None,
+                     "blurhash": info.get("blurhash"), "preview": info.get("preview")})
+        row_index.append(part.index)
+    
+    new_md5s = db_manager.insert_images(rows, record_hits=True)
+    if phash_index is not None:
+        new_set = set(new_md5s)
+        for row in rows:
+            if row["md5"] in new_set and row["phash"] is not None:
+                phash_index.add(row["md5"], to_unsigned(row["phash"]))
+    if variant_generator and new_md5s:
+        variant_generator.enqueue(new_md5s)
+    inserted = set(new_md5s)
+    for index, row in zip(row_index, rows):
+        md5 = row["md5"]
+        info = existing[md5]
+        uploaded = md5 in inserted
+        inserted.discard(md5)  # 批内重复的后续项视为已存在
+        results[index] = {
+            "md5": md5,
+            "url": generate_image_url(md5, username, password),
+            "expire_at": info["created_at"] + expire_seconds,
+            "name": row["original_name"] if uploaded else info["original_name"],
+            "width": info["width"],
+            "height": info["height"],
+            "access_count": 0 if uploaded else info["access_count"] + 1,
+            "blurhash": info.get("blurhash"),
+            "preview": info.get("preview"),
+            "status": "uploaded" if uploaded else "existing"
+        }
+
+def analyze_parts(parts: List[ReceivedPart]) -> Dict[str, Dict[str, Any]]:
+    """
+    分析新上传的图片（尺寸、感知哈希、占位图），每个MD5只分析一次
+    
+    有图片变换进程池时并行提交到进程池，避免 CPU 密集的编码阻塞线程池。
+    
+    Returns:
+        {md5: analyze_upload 的结果}
+    """
+    paths: Dict[str, str] = {}
+    for part in parts:
+        paths.setdefault(part.md5, str(part.path))
+    executor = image_transformer.executor if image_transformer is not None else None
+    if executor is None:
+        return {md5: analyze_upload(path) for md5, path in paths.items()}
+    futures = {md5: executor.submit(analyze_upload, path) for md5, path in paths.items()}
+    return {md5: future.result() for md5, future in futures.items()}
+
+def sync_phash_index() -> None:
+    """
+    把其他 worker 进程写入的感知哈希同步到本进程的索引（按 image_phash.seq 游标，至多每秒一次）
+    
+    每个 worker 有自己的内存索引，查询前先同步，其他 worker 上传或回填的图片最多一秒后也能找到。
+    已删除的图片不同步，查询命中时发现记录不存在再从索引移除。
+    """
+    global phash_cursor, phash_synced_at
+    if time.monotonic() - phash_synced_at < PHASH_SYNC_INTERVAL:
+        return
+    if not phash_sync_lock.acquire(blocking=False):
+        # 其他线程正在同步
+        return
+    try:
+        while True:
+            cursor, changes = db_manager.get_phash_changes(phash_cursor, PHASH_SYNC_BATCH)
+            for md5, value in changes:
+                phash_index.add(md5, to_unsigned(value))
+            phash_cursor = cursor
+            if len(changes) < PHASH_SYNC_BATCH:
+                break
+        phash_synced_at = time.monotonic()
+    finally:
+        phash_sync_lock.release()
+
+def find_near_duplicate(phash: Optional[int], max_distance: int) -> Optional[Tuple[Dict[str, Any], int]]:
+    """在感知哈希索引中查找最接近的已有图片，返回 (图片记录, 距离)"""
+    if phash is None or phash_index is None:
+        return None
+    sync_phash_index()
+    for md5, distance in phash_index.search(phash, max_distance, limit=5):
+        info = db_manager.get_image(md5)
+        if info is not None:
+            return info, distance
+        # 图片已被 cleanup.py 删除
+        phash_index.remove(md5)
+    return None
+
+@app.post("/upload/batch")
+async def upload_batch(
+    request: Request,
+    format: str = Query("json", pattern="^(ndjson|json)$"),
+    near_duplicate: Optional[int] = Query(None, ge=0, le=MAX_DISTANCE,
+                                          description="近似重复的最大汉明距离，命中时返回已有图片"),
+    current_user: Dict[str, str] = Depends(get_current_user),
+    _admitted: None = Depends(admit_upload)
+):
+    """
+    批量上传接口：multipart/form-data 中每个文件分片各自校验、去重和保存
+    
+    请求体边接收边解析，每个文件写入临时文件并增量计算MD5，不整体缓存在内存中；
+    所有新图片在一个数据库事务中提交，结果在整批处理完成后一次返回：
+    json 格式为结果数组，ndjson 格式每行一个结果（仅是输出格式，不提供逐个进度）。
+    """
+    try:
+        receiver = await receive_multipart(request, MAX_UPLOAD_BATCH)
+        try:
+            results = await run_in_threadpool(
+                store_batch, receiver.parts, current_user['username'], current_user['password'], near_duplicate
+            )
+        finally:
+            receiver.cleanup()
+    except BatchUploadError as e:
+        logger.warning(f"批量上传请求无效: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except LockTimeout as e:
+        raise lock_busy(e)
+    except Exception as e:
+        logger.error(f"批量上传处理失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+    
+    counts = {status: sum(1 for r in results if r["status"] == status)
+              for status in ("uploaded", "existing", "similar", "error")}
+    logger.info(f"用户 {current_user['username']} 批量上传 {len(results)} 个文件: "
+                f"新增 {counts['uploaded']}, 已存在 {counts['existing']}, 近似重复 {counts['similar']}, "
+                f"失败 {counts['error']}")
+    
+    if format == "json":
+        return results
+    return Response(
+        content="".join(json.dumps(item, ensure_ascii=False) + "\n" for item in results),
+        media_type="application/x-ndjson"
+    )
+
+async def receive_raw(request: Request, filename: Optional[str]) -> ReceivedPart:
+    """把原始请求体直接流式写入存储临时文件，调用方负责 part.discard()"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > file_validator.max_size_bytes:
+        raise HTTPException(status_code=413, detail="文件过大")
+    
+    writer = HashingWriter(Path(UPLOAD_DIR), file_validator.max_size_bytes, filename)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(writer.write, chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+async def store_raw(request: Request, current_user: Dict[str, str],
+                    filename: Optional[str], expected_md5: Optional[str] = None) -> Dict[str, Any]:
+    """接收原始请求体，校验后按普通上传保存"""
+    part = await receive_raw(request, filename)
+    # 未提供文件名时以MD5命名
+    part.filename = part.filename or f"{part.md5}.png"
+    try:
+        validation_result = file_validator.validate_upload(part.head, part.size, part.filename)
         if not validation_result["valid"]:
-            logger.warning(f"文件验证失败: {validation_result['errors']}")
             raise HTTPException(status_code=400, detail=f"文件验证失败: {', '.join(validation_result['errors'])}")
+        if expected_md5 and part.md5 != expected_md5:
+            logger.warning(f"内容MD5与地址不符: {part.md5} != {expected_md5}")
+            raise HTTPException(status_code=400, detail="内容MD5与地址不符")
+        return (await run_in_threadpool(
+            store_batch, [part], current_user['username'], current_user['password']
+        ))[0]
+    finally:
+        part.discard()
+
+@app.put("/objects/{md5}")
+async def put_object(
+    md5: str,
+    request: Request,
+    name: Optional[str] = Query(None, max_length=255),
+    current_user: Dict[str, str] = Depends(get_current_user),
+    _admitted: None = Depends(admit_upload)
+):
+    """
+    按内容地址上传图片：请求体为原始图片字节，无 multipart 开销
+    
+    幂等：已存在时直接返回 existing，不接收请求体（配合 Expect: 100-continue 时不会发送）；
+    否则边接收边计算MD5，与地址中的MD5不符时返回 400。响应格式同 /upload。
+    """
+    md5 = md5.lower()
+    if not MD5_PATTERN.fullmatch(md5):
+        raise HTTPException(status_code=400, detail="MD5 格式错误")
+    
+    try:
+        existing_image = await run_in_threadpool(db_manager.get_image, md5)
+        if existing_image:
+            await skip_body(request)
+            await run_in_threadpool(db_manager.record_dedup_hit, md5)
+            return {"md5": md5, **build_image_info(existing_image, current_user['username'], current_user['password'])}
         
-        # 计算MD5
-        md5 = security_manager.get_data_md5(content)
+        result = await store_raw(request, current_user, name, md5)
+        logger.info(f"用户 {current_user['username']} 上传对象: {md5}, 状态: {result['status']}")
+        return result
         
-        # 检查数据库中是否已存在
-        existing_image = db_manager.get_image(md5)
-        if existing_image:
-            logger.info(f"图片已存在: {md5}")
-            
-            # 更新访问计数
-            db_manager.update_access_count(md5)
-            
-            return {
-                "url": generate_image_url(md5, current_user['username'], current_user['password']),
-                "expire_at": existing_image["created_at"] + config["cleanup"]["expire_days"] * 86400,
-                "name": existing_image["original_name"],
-                "width": existing_image["width"],
-                "height": existing_image["height"],
-                "access_count": existing_image["access_count"] + 1,
-                "status": "existing"
-            }
-        
-        # 保存新文件
-        filename = f"{md5}.png"  # 统一使用PNG格式
-        file_path = Path(UPLOAD_DIR) / filename
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
+    except HTTPException:
+        raise
+    except LockTimeout as e:
+        raise lock_busy(e)
+    except Exception as e:
+        logger.error(f"上传对象失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@app.post("/objects")
+async def post_object(
+    request: Request,
+    name: Optional[str] = Query(None, max_length=255),
+    current_user: Dict[str, str] = Depends(get_current_user),
+    _admitted: None = Depends(admit_upload)
+):
+    """上传图片：请求体为原始图片字节，服务器计算MD5。响应格式同 /upload。"""
+    try:
+        result = await store_raw(request, current_user, name)
+        logger.info(f"用户 {current_user['username']} 上传对象: {result['md5']}, 状态: {result['status']}")
+        return result
         
-        # 获取图片信息
-        width, height = get_image_size(content)
-        file_size = len(content)
-        
-        # 保存到数据库
-        success = db_manager.insert_image(
-            md5=md5,
-            path=str(file_path),
-            original_name=file.filename or "unknown",
-            width=width or 0,
-            height=height or 0,
-            file_size=file_size
-        )
+    except HTTPException:
+        raise
+    except LockTimeout as e:
+        raise lock_busy(e)
+    except Exception as e:
+        logger.error(f"上传对象失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@app.post("/uploads")
+async def create_upload_session(
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    size: int = Query(..., ge=1),
+    md5: Optional[str] = Query(None),
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """
+    创建分片上传会话
+    
+    提供 md5 且服务器已有该内容时直接返回 {"status": "existing", ...}（秒传），不创建会话；
+    否则返回会话信息 {"upload_id", "chunk_size", "received", "expires_at", ...}。
+    """
+    check_rate_limit(request)
+    
+    if size > file_validator.max_size_bytes:
+        raise HTTPException(status_code=413, detail="文件过大")
+    if md5 is not None:
+        md5 = md5.lower()
+        if not MD5_PATTERN.fullmatch(md5):
+            raise HTTPException(status_code=400, detail="MD5 格式错误")
+    
+    try:
+        if md5:
+            existing_image = await run_in_threadpool(db_manager.get_image, md5)
+            if existing_image:
+                await run_in_threadpool(db_manager.record_dedup_hit, md5)
+                logger.info(f"用户 {current_user['username']} 秒传命中: {md5}")
+                return {"md5": md5, **build_image_info(existing_image, current_user['username'], current_user['password'])}
+        
+        session = await run_in_threadpool(upload_sessions.create, current_user['username'], filename, size, md5)
+        return session.to_dict()
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"创建上传会话失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(
+    upload_id: str,
+    request: Request,
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """查询上传会话，received 为已收到的字节范围列表 [[start, end), ...]"""
+    check_rate_limit(request)
+    try:
+        session = upload_sessions.load(upload_id, current_user['username'])
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return session.to_dict()
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: Dict[str, str] = Depends(get_current_user),
+    _admitted: None = Depends(admit_upload)
+):
+    """
+    上传一个分片：请求体为原始字节，offset 必须按 chunk_size 对齐
+    
+    分片可以并行、乱序、重复上传；只有完整收到的分片才会被记录。
+    """
+    try:
+        session = upload_sessions.load(upload_id, current_user['username'])
+        index = upload_sessions.chunk_index(session, offset)
+        expected = session.chunk_length(index)
         
-        if not success:
-            logger.error(f"数据库插入失败: {md5}")
-            raise HTTPException(status_code=500, detail="保存图片信息失败")
+        f, tmp_path = upload_sessions.open_chunk(session, index)
+        written = 0
+        try:
+            with f:
+                async for chunk in request.stream():
+                    written += len(chunk)
+                    if written > expected:
+                        raise UploadSessionError(f"分片长度超出 {expected} 字节")
+                    await run_in_threadpool(f.write, chunk)
+            upload_sessions.commit_chunk(session, index, tmp_path, written)
+        finally:
+            tmp_path.unlink(missing_ok=True)
         
-        logger.info(f"新图片上传成功: {md5}, 大小: {file_size} bytes")
+        return {"upload_id": upload_id, "offset": offset, "size": written}
         
-        return {
-            "url": generate_image_url(md5, current_user['username'], current_user['password']),
-            "expire_at": int(time.time()) + config["cleanup"]["expire_days"] * 86400,
-            "name": file.filename,
-            "width": width,
-            "height": height,
-            "access_count": 0,
-            "status": "uploaded"
-        }
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.error(f"保存分片失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload_session(
+    upload_id: str,
+    request: Request,
+    md5: Optional[str] = Query(None),
+    current_user: Dict[str, str] = Depends(get_current_user),
+    _admitted: None = Depends(admit_upload)
+):
+    """
+    完成分片上传：拼接分片、校验MD5（创建会话或本次请求中提供的），然后按普通上传保存
+    
+    响应格式同 /upload。分片不完整时返回 409，可查询会话后补传缺失的分片。
+    """
+    try:
+        session = upload_sessions.load(upload_id, current_user['username'])
+        expected_md5 = (md5 or session.md5 or "").lower() or None
+        
+        part = await run_in_threadpool(upload_sessions.assemble, session, Path(UPLOAD_DIR))
+        try:
+            if expected_md5 and part.md5 != expected_md5:
+                logger.warning(f"分片上传MD5不符: {part.md5} != {expected_md5}")
+                # 无法判断是哪个分片损坏，丢弃会话由客户端重新上传
+                upload_sessions.discard(session)
+                raise HTTPException(status_code=400, detail="内容MD5与声明不符")
+            
+            validation_result = file_validator.validate_upload(part.head, part.size, part.filename or "unknown")
+            if not validation_result["valid"]:
+                upload_sessions.discard(session)
+                raise HTTPException(status_code=400, detail=f"文件验证失败: {', '.join(validation_result['errors'])}")
+            
+            result = (await run_in_threadpool(
+                store_batch, [part], current_user['username'], current_user['password']
+            ))[0]
+        finally:
+            part.discard()
+        
+        upload_sessions.discard(session)
+        logger.info(f"分片上传完成: {result['md5']}, 分片数: {session.chunk_count}, 状态: {result['status']}")
+        return result
         
     except HTTPException:
         raise
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except LockTimeout as e:
+        raise lock_busy(e)
     except Exception as e:
-        logger.error(f"上传处理失败: {e}")
+        logger.error(f"完成分片上传失败: {e}")
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
+@app.delete("/uploads/{upload_id}")
+async def delete_upload_session(
+    upload_id: str,
+    request: Request,
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """取消上传会话并删除已收到的分片"""
+    check_rate_limit(request)
+    try:
+        session = upload_sessions.load(upload_id, current_user['username'])
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    upload_sessions.discard(session)
+    return {"upload_id": upload_id, "status": "deleted"}
+
 @app.get("/secure_get/{md5}")
-async def secure_get(md5: str, token: str, request: Request):
-    """安全图片访问接口"""
+async def secure_get(
+    md5: str,
+    token: str,
+    request: Request,
+    w: Optional[int] = Query(None, description="输出宽度"),
+    h: Optional[int] = Query(None, description="输出高度"),
+    fit: Optional[str] = Query(None, description="缩放方式: contain/cover/fill"),
+    fmt: Optional[str] = Query(None, description="输出格式: jpeg/png/webp"),
+    q: Optional[int] = Query(None, description="输出质量 1-100"),
+    sig: Optional[str] = Query(None, description="变换参数签名"),
+    _reading: None = Depends(track_read)
+):
+    """安全图片访问接口（带变换参数时返回派生图片）"""
     # 速率限制检查
     check_rate_limit(request)
     
@@ -244,6 +927,11 @@ async def secure_get(md5: str, token: str, request: Request):
             logger.warning(f"Token与图片不匹配: {md5} != {md5_token}")
             raise HTTPException(status_code=403, detail="Token与图片不匹配")
         
+        transform = parse_transform(w, h, fit, fmt, q)
+        if transform is not None and not security_manager.verify_transform(token, transform.key, sig):
+            logger.warning(f"变换参数签名无效: {md5}, 参数: {transform.key}")
+            raise HTTPException(status_code=403, detail="变换参数签名无效")
+        
         # 获取图片信息
         image_info = db_manager.get_image(md5)
         if not image_info:
@@ -258,8 +946,27 @@ async def secure_get(md5: str, token: str, request: Request):
         # 更新访问计数
         db_manager.update_access_count(md5)
         
+        if transform is not None:
+            try:
+                derived_path, media_type = await image_transformer.get(md5, file_path, transform)
+            except TransformError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            logger.debug(f"派生图片访问: {md5}, 参数: {transform.key}, 用户: {username}")
+            return FileResponse(derived_path, media_type=media_type)
+        
+        # 按 Accept 选择更小的格式变体；响应随 Accept 变化，需告知缓存
+        headers = {"Vary": "Accept"}
+        variants = db_manager.get_variants(md5)
+        if variants:
+            by_type = {OUTPUT_FORMATS[fmt][2]: v for fmt, v in variants.items() if fmt in OUTPUT_FORMATS}
+            chosen = negotiate_format(request.headers.get("accept"),
+                                      {media_type: v["file_size"] for media_type, v in by_type.items()})
+            if chosen and Path(by_type[chosen]["path"]).exists():
+                logger.debug(f"图片访问: {md5}, 变体: {chosen}, 用户: {username}")
+                return FileResponse(by_type[chosen]["path"], media_type=chosen, headers=headers)
+        
         logger.debug(f"图片访问: {md5}, 用户: {username}")
-        return FileResponse(file_path)
+        return FileResponse(file_path, headers=headers)
         
     except HTTPException:
         raise
@@ -281,21 +988,72 @@ async def get_image_info(
         if not image_info:
             raise HTTPException(status_code=404, detail="图片不存在")
         
+        return build_image_info(image_info, current_user['username'], current_user['password'])
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取图片信息失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@app.get("/url/{md5}")
+async def get_image_url(
+    md5: str,
+    request: Request,
+    w: Optional[int] = Query(None, description="输出宽度"),
+    h: Optional[int] = Query(None, description="输出高度"),
+    fit: Optional[str] = Query(None, description="缩放方式: contain/cover/fill"),
+    fmt: Optional[str] = Query(None, description="输出格式: jpeg/png/webp"),
+    q: Optional[int] = Query(None, description="输出质量 1-100"),
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """生成图片访问URL，可附带签名的变换参数"""
+    check_rate_limit(request)
+    
+    try:
+        transform = parse_transform(w, h, fit, fmt, q)
+        if not db_manager.get_image(md5):
+            raise HTTPException(status_code=404, detail="图片不存在")
+        
         return {
-            "url": generate_image_url(md5, current_user['username'], current_user['password']),
-            "expire_at": image_info["created_at"] + config["cleanup"]["expire_days"] * 86400,
-            "name": image_info["original_name"],
-            "width": image_info["width"],
-            "height": image_info["height"],
-            "access_count": image_info["access_count"],
-            "file_size": image_info["file_size"],
-            "status": "existing"
+            "md5": md5,
+            "url": generate_image_url(md5, current_user['username'], current_user['password'], transform)
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"获取图片信息失败: {e}")
+        logger.error(f"生成图片URL失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@app.post("/info/batch")
+async def get_images_info(
+    request: Request,
+    md5s: List[str] = Body(..., embed=True),
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """
+    批量查询图片信息接口：请求体 {"md5s": [...]}
+    
+    返回 {"found": {md5: 图片信息}, "missing": [md5, ...]}，一次数据库查询完成。
+    """
+    check_rate_limit(request)
+    
+    if len(md5s) > MAX_INFO_BATCH:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {MAX_INFO_BATCH} 个MD5")
+    
+    try:
+        images = await run_in_threadpool(db_manager.get_images, md5s)
+        found = {
+            md5: build_image_info(info, current_user['username'], current_user['password'])
+            for md5, info in images.items()
+        }
+        missing = [md5 for md5 in dict.fromkeys(md5s) if md5 not in found]
+        logger.info(f"用户 {current_user['username']} 批量查询图片: {len(md5s)} 个, 已存在 {len(found)}")
+        return {"found": found, "missing": missing}
+        
+    except Exception as e:
+        logger.error(f"批量查询图片信息失败: {e}")
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
 @app.get("/download_db")
@@ -303,19 +1061,73 @@ async def download_db(
     request: Request,
     current_user: Dict[str, str] = Depends(get_current_user)
 ):
-    """下载数据库接口"""
+    """
+    下载数据库接口
+    
+    基于 SQLite 在线备份 API 导出一致性快照（包含 WAL 中已提交的数据），
+    数据未变化时所有下载者共享同一个快照。
+    支持 If-None-Match（未变化时返回304）、Range/If-Range 断点续传，
+    以及按 Accept-Encoding 进行 zstd/gzip 压缩传输（仅完整下载时）。
+    响应头 X-Content-MD5 为未压缩快照的MD5，供客户端校验。
+    """
     check_rate_limit(request)
     
     try:
-        db_file = db_manager.db_file
-        if not db_file.exists():
-            raise HTTPException(status_code=404, detail="数据库文件不存在")
-        
-        logger.info(f"用户 {current_user['username']} 下载数据库")
-        return FileResponse(
-            db_file, 
-            filename="images.db", 
-            media_type="application/octet-stream"
+        snapshot = await asyncio.wrap_future(snapshot_manager.get_snapshot())
+        db_file = snapshot.path
+        etag = snapshot.etag
+        headers = {
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Vary": "Accept-Encoding",
+            "Content-Disposition": 'attachment; filename="images.db"',
+        }
+        
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            logger.info(f"用户 {current_user['username']} 数据库未变化，返回304")
+            return Response(status_code=304, headers=headers)
+        
+        headers["X-Content-MD5"] = snapshot.md5
+        size = snapshot.size
+        
+        # 断点续传：If-Range 不匹配时忽略 Range，返回完整内容
+        if_range = request.headers.get("if-range")
+        if not if_range or if_range == etag:
+            try:
+                byte_range = parse_range(request.headers.get("range"), size)
+            except RangeNotSatisfiable:
+                raise HTTPException(
+                    status_code=416,
+                    detail="请求范围无效",
+                    headers={"Content-Range": f"bytes */{size}"}
+                )
+            if byte_range:
+                start, end = byte_range
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+                headers["Content-Length"] = str(end - start + 1)
+                logger.info(f"用户 {current_user['username']} 续传数据库: {start}-{end}/{size}")
+                return StreamingResponse(
+                    iter_file(db_file, start, end),
+                    status_code=206,
+                    media_type="application/octet-stream",
+                    headers=headers
+                )
+        
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        logger.info(f"用户 {current_user['username']} 下载数据库（{encoding}）")
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+            return StreamingResponse(
+                iter_compressed(db_file, encoding),
+                media_type="application/octet-stream",
+                headers=headers
+            )
+        
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            iter_file(db_file),
+            media_type="application/octet-stream",
+            headers=headers
         )
         
     except HTTPException:
@@ -324,6 +1136,172 @@ async def download_db(
         logger.error(f"下载数据库失败: {e}")
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
+@app.get("/images")
+async def list_images(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    min_width: Optional[int] = None,
+    max_width: Optional[int] = None,
+    min_height: Optional[int] = None,
+    max_height: Optional[int] = None,
+    min_access: Optional[int] = None,
+    max_access: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    format: str = Query("json", pattern="^(ndjson|json)$"),
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """
+    图片列表接口：按 (created_at, md5) 键集分页，支持大小、尺寸、访问次数范围和文件名前缀过滤
+    
+    json 格式返回一页 {"items", "next_cursor"}；
+    ndjson 格式从游标开始流式导出全部匹配结果（每页 limit 条），最后一行为 {"next_cursor": null}。
+    """
+    check_rate_limit(request)
+    
+    filters = {
+        "min_size": min_size, "max_size": max_size,
+        "min_width": min_width, "max_width": max_width,
+        "min_height": min_height, "max_height": max_height,
+        "min_access": min_access, "max_access": max_access,
+        "name_prefix": name_prefix,
+    }
+    
+    try:
+        page = await run_in_threadpool(db_manager.list_images, cursor, limit, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"列出图片失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+    
+    logger.info(f"用户 {current_user['username']} 列出图片: cursor={cursor}, 格式={format}")
+    if format == "json":
+        return page
+    
+    def iter_lines():
+        current = page
+        while True:
+            for item in current["items"]:
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            if not current["next_cursor"]:
+                break
+            current = db_manager.list_images(current["next_cursor"], limit, **filters)
+        yield json.dumps({"next_cursor": None}) + "\n"
+    
+    return StreamingResponse(iter_lines(), media_type="application/x-ndjson")
+
+@app.get("/search")
+async def search_images(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """
+    按原始文件名片段搜索图片，结果按相关度排序
+    
+    返回 {"items", "has_more", "next_offset"}，has_more 为 true 时以 next_offset 请求下一页。
+    """
+    check_rate_limit(request)
+    
+    try:
+        result = await run_in_threadpool(db_manager.search_images, q, limit, offset)
+    except Exception as e:
+        logger.error(f"搜索图片失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+    
+    result["next_offset"] = offset + len(result["items"]) if result["has_more"] else None
+    logger.info(f"用户 {current_user['username']} 搜索图片: {q}, 命中 {len(result['items'])}")
+    return result
+
+@app.get("/similar/{md5}")
+async def find_similar(
+    md5: str,
+    request: Request,
+    max_distance: int = Query(6, ge=0, le=MAX_DISTANCE, description="最大汉明距离（64位dHash）"),
+    limit: int = Query(20, ge=1, le=100, description="最多返回数量"),
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """查找与指定图片近似重复的图片（按感知哈希距离升序）"""
+    check_rate_limit(request)
+    
+    try:
+        image_info = await run_in_threadpool(db_manager.get_image, md5)
+        if not image_info:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        
+        await run_in_threadpool(sync_phash_index)
+        value = phash_index.get(md5)
+        if value is None:
+            # 旧图片没有感知哈希：现场计算并补存
+            value = await run_in_threadpool(dhash, image_info["path"])
+            if value is None:
+                raise HTTPException(status_code=422, detail="无法计算该图片的感知哈希")
+            await run_in_threadpool(db_manager.set_phashes, [(md5, to_signed(value))])
+            phash_index.add(md5, value)
+        
+        matches = [(m, d) for m, d in phash_index.search(value, max_distance, limit=limit + 1) if m != md5][:limit]
+        images = await run_in_threadpool(db_manager.get_images, [m for m, _ in matches])
+        items = []
+        for match_md5, distance in matches:
+            info = images.get(match_md5)
+            if info is None:
+                phash_index.remove(match_md5)
+                continue
+            items.append({
+                **build_image_info(info, current_user['username'], current_user['password']),
+                "md5": match_md5,
+                "distance": distance
+            })
+        return {"md5": md5, "items": items}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"近似图片查询失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@app.get("/changes")
+async def get_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    format: str = Query("ndjson", pattern="^(ndjson|json)$"),
+    current_user: Dict[str, str] = Depends(get_current_user)
+):
+    """
+    增量同步接口：返回游标之后的图片新增、更新（访问计数）和删除
+    
+    NDJSON 格式每行一条变更，最后一行为 {"cursor", "has_more", "reset"}。
+    """
+    check_rate_limit(request)
+    
+    try:
+        result = await run_in_threadpool(db_manager.get_changes, since, limit)
+        logger.info(f"用户 {current_user['username']} 增量同步: since={since}, 变更数={len(result['changes'])}")
+        
+        if format == "json":
+            return result
+        
+        def iter_lines():
+            for change in result["changes"]:
+                yield json.dumps(change, ensure_ascii=False) + "\n"
+            yield json.dumps({
+                "cursor": result["cursor"],
+                "has_more": result["has_more"],
+                "reset": result["reset"]
+            }) + "\n"
+        
+        return StreamingResponse(iter_lines(), media_type="application/x-ndjson")
+        
+    except Exception as e:
+        logger.error(f"获取变更记录失败: {e}")
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
 @app.get("/stats")
 async def get_stats(
     request: Request,
@@ -334,6 +1312,8 @@ async def get_stats(
     
     try:
         stats = db_manager.get_stats()
+        if admission is not None:
+            stats["admission"] = admission.stats()
         logger.info(f"用户 {current_user['username']} 查看系统统计")
         return stats
         
@@ -362,6 +1342,16 @@ async def shutdown_event():
     # 清理速率限制器
     if rate_limiter:
         rate_limiter.cleanup()
+    
+    # 关闭快照管理器
+    if snapshot_manager:
+        snapshot_manager.close()
+    
+    # 关闭格式变体生成和图片变换进程池
+    if variant_generator:
+        variant_generator.close()
+    if image_transformer:
+        image_transformer.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,165 @@
+"""
+数据库快照模块
+基于 SQLite 在线备份 API 生成一致性快照，供 /download_db 下载
+"""
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from database import DatabaseManager
+
+
+logger = logging.getLogger("image_proxy.snapshot")
+
+# 超过该时间仍未完成的临时文件视为崩溃进程遗留
+STALE_TEMP_SECONDS = 3600
+
+
+class Snapshot:
+    """一个已生成的数据库快照"""
+
+    def __init__(self, path: Path, version: int, md5: str, size: int):
+        self.path = path
+        self.version = version
+        self.md5 = md5
+        self.size = size
+        self.created_at = time.time()
+
+    @property
+    def etag(self) -> str:
+        # 以内容MD5作为ETag，服务重启后相同内容的快照ETag不变
+        return f'"{self.md5}"'
+
+
+class SnapshotManager:
+    """
+    快照管理器
+
+    - 通过常驻连接上的 PRAGMA data_version 判断数据库是否有新的提交
+    - 数据未变化时所有下载者共享同一个快照
+    - 快照在后台线程生成，并发请求等待同一个生成任务
+    - WAL 模式下备份只持有一个读事务，不阻塞上传写入
+    - 多个 worker 共用快照目录：文件名带进程号和随机后缀，先写临时文件再原子改名，
+      清理时只处理已完成的快照，当前快照被其他 worker 清理后重新生成
+    """
+
+    def __init__(self, db_manager: DatabaseManager,
+                 snapshot_dir: str = "snapshots",
+                 min_interval: float = 0,
+                 keep: int = 2):
+        """
+        Args:
+            db_manager: 数据库管理器
+            snapshot_dir: 快照存放目录
+            min_interval: 两次生成快照的最小间隔（秒），间隔内复用旧快照
+            keep: 保留的快照文件数（正在被下载的旧快照不会被立即删除）
+        """
+        self.db_manager = db_manager
+        self.snapshot_dir = Path(snapshot_dir)
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        self.min_interval = min_interval
+        self.keep = max(1, keep)
+
+        self._version_conn = sqlite3.connect(str(db_manager.db_file), check_same_thread=False)
+        self._version_lock = threading.Lock()
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-snapshot")
+        self._current: Optional[Snapshot] = None
+        self._pending: Optional[Future] = None
+
+    def data_version(self) -> int:
+        """当前数据版本（其他连接每次提交都会改变该值）"""
+        with self._version_lock:
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get_snapshot(self) -> Future:
+        """
+        获取与当前数据版本一致的快照
+
+        Returns:
+            结果为 Snapshot 的 Future；快照已是最新时立即完成
+        """
+        version = self.data_version()
+        with self._lock:
+            current = self._current
+            if current is not None:
+                fresh = current.version == version
+                throttled = time.time() - current.created_at < self.min_interval
+                if (fresh or throttled) and current.path.exists():
+                    future: Future = Future()
+                    future.set_result(current)
+                    return future
+
+            if self._pending is None:
+                self._pending = self._executor.submit(self._build, version)
+                self._pending.add_done_callback(self._on_built)
+            return self._pending
+
+    def _on_built(self, future: Future) -> None:
+        with self._lock:
+            self._pending = None
+
+    def _build(self, version: int) -> Snapshot:
+        """使用在线备份 API 生成快照"""
+        start = time.time()
+        name = f"images-{int(start)}-{os.getpid()}-{secrets.token_hex(4)}"
+        final_path = self.snapshot_dir / f"{name}.db"
+        tmp_path = self.snapshot_dir / f"{name}.tmp"
+
+        try:
+            self.db_manager.backup_to(tmp_path)
+
+            md5_hash = hashlib.md5()
+            with open(tmp_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    md5_hash.update(chunk)
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        snapshot = Snapshot(final_path, version, md5_hash.hexdigest(), final_path.stat().st_size)
+        logger.info(f"数据库快照生成完成: {final_path.name}, 大小: {snapshot.size} bytes, "
+                    f"耗时: {time.time() - start:.2f}s")
+        with self._lock:
+            self._current = snapshot
+        self._prune(final_path)
+        return snapshot
+
+    def _prune(self, newest: Path) -> None:
+        """
+        删除多余的旧快照（POSIX 下正在读取的文件删除后仍可继续读取）
+
+        只处理改名完成的 .db 文件，其他 worker 正在写入的 .tmp 文件仅在长时间未完成时才清理
+        """
+        now = time.time()
+        snapshots = []
+        for path in self.snapshot_dir.glob("images-*"):
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue  # 已被其他 worker 改名或删除
+            if path.suffix == ".db":
+                snapshots.append((mtime, path))
+            elif path.suffix == ".tmp" and now - mtime > STALE_TEMP_SECONDS:
+                path.unlink(missing_ok=True)
+
+        snapshots.sort()
+        for _, path in snapshots[:-self.keep]:
+            if path != newest:
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError as e:
+                    logger.warning(f"删除旧快照失败: {path}: {e}")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        with self._version_lock:
+            self._version_conn.close()
@@ -0,0 +1,152 @@
+"""
+文件传输工具模块
+提供 ETag 匹配、Range 断点续传和压缩传输等下载辅助功能
+"""
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+
+# 传输分块大小
+CHUNK_SIZE = 1024 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 请求无法满足（对应 HTTP 416）"""
+    pass
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断 If-None-Match 是否命中当前 ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # 弱比较：忽略 W/ 前缀
+    return any(tag.replace("W/", "", 1) == etag for tag in candidates)
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 请求头
+
+    Returns:
+        (start, end) 闭区间；没有 Range 或格式无法识别时返回 None
+
+    Raises:
+        RangeNotSatisfiable: 范围超出文件大小
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+
+    start_str, end_str = spec.split("-", 1)
+    try:
+        if start_str == "":
+            # bytes=-N：最后N个字节
+            length = int(end_str)
+            if length <= 0:
+                raise RangeNotSatisfiable(spec)
+            return max(0, size - length), size - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(spec)
+    return start, min(end, size - 1)
+
+
+def _parse_accept(header: str) -> Dict[str, float]:
+    """解析 Accept 类请求头为 {名称: q值}"""
+    accepted = {}
+    for item in header.lower().split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip()
+        q = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate_format(accept: Optional[str], variants: Dict[str, int]) -> Optional[str]:
+    """
+    根据 Accept 选择最小的可接受图片变体
+
+    只有明确列出的 MIME 类型才算接受（image/* 和 */* 不代表支持 AVIF/WebP）。
+
+    Args:
+        accept: Accept 请求头
+        variants: {MIME 类型: 文件大小}
+
+    Returns:
+        选中的 MIME 类型，没有可接受的变体时返回 None
+    """
+    if not accept or not variants:
+        return None
+    accepted = _parse_accept(accept)
+    candidates = [(size, media_type) for media_type, size in variants.items()
+                  if accepted.get(media_type, 0) > 0]
+    return min(candidates)[1] if candidates else None
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+    """根据 Accept-Encoding 选择压缩方式：zstd > gzip > identity"""
+    if not accept_encoding:
+        return "identity"
+    accepted = _parse_accept(accept_encoding)
+
+    if ZSTD_AVAILABLE and accepted.get("zstd", 0) > 0:
+        return "zstd"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return "identity"
+
+
+def iter_file(path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """按块读取文件 [start, end] 区间"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def iter_compressed(path: Path, encoding: str) -> Iterator[bytes]:
+    """流式压缩文件内容"""
+    if encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        yield from iter_file(path)
+        return
+
+    for chunk in iter_file(path):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
@@ -0,0 +1,236 @@
+"""
+分片续传模块
+大文件按固定大小分片上传，每个分片单独保存在会话目录中，支持并行上传、查询已收到的范围、
+断点续传，完成时按顺序拼接为一个文件（Linux 上使用 os.copy_file_range 在内核中复制）
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from batch_upload import HEAD_SIZE, ReceivedPart
+
+
+logger = logging.getLogger("image_proxy.upload_sessions")
+
+# 拼接和计算MD5时的读缓冲区大小
+COPY_BUFFER_SIZE = 1024 * 1024
+
+UPLOAD_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadSessionError(Exception):
+    """分片上传请求无效，status_code 为对应的 HTTP 状态码"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadSession:
+    """一个分片上传会话"""
+
+    def __init__(self, path: Path, meta: Dict[str, Any]):
+        self.path = path
+        self.upload_id: str = meta["upload_id"]
+        self.username: str = meta["username"]
+        self.filename: str = meta["filename"]
+        self.size: int = meta["size"]
+        self.chunk_size: int = meta["chunk_size"]
+        self.md5: Optional[str] = meta.get("md5")
+        self.created_at: int = meta["created_at"]
+        self.expires_at: int = meta["expires_at"]
+
+    @property
+    def chunk_count(self) -> int:
+        return max(1, (self.size + self.chunk_size - 1) // self.chunk_size)
+
+    def chunk_length(self, index: int) -> int:
+        """第 index 个分片应有的字节数"""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def chunk_path(self, index: int) -> Path:
+        return self.path / f"{index:08d}.chunk"
+
+    def received_chunks(self) -> List[int]:
+        """已完整收到的分片序号"""
+        return sorted(int(p.stem) for p in self.path.glob("*.chunk"))
+
+    def received_ranges(self) -> List[Tuple[int, int]]:
+        """已收到的字节范围（左闭右开，相邻分片合并）"""
+        ranges: List[Tuple[int, int]] = []
+        for index in self.received_chunks():
+            start = index * self.chunk_size
+            end = start + self.chunk_length(index)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def to_dict(self) -> Dict[str, Any]:
+        received = self.received_ranges()
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "received": [list(r) for r in received],
+            "received_bytes": sum(end - start for start, end in received),
+            "expires_at": self.expires_at,
+        }
+
+
+class UploadSessionManager:
+    """
+    分片上传会话管理器
+
+    会话保存在 root/<upload_id>/ 下：session.json 记录元数据，每个分片先写入 .tmp 文件，
+    收完整后原子重命名为 <序号>.chunk，中断的分片不会被当作已收到。
+    root 应与上传目录在同一文件系统上，拼接结果可以直接重命名到位。
+    """
+
+    def __init__(self, root: Path, chunk_size: int = 4 * 1024 * 1024, ttl_seconds: int = 86400):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self.ttl_seconds = ttl_seconds
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def create(self, username: str, filename: str, size: int, md5: Optional[str] = None) -> UploadSession:
+        """创建会话"""
+        now = int(time.time())
+        upload_id = secrets.token_hex(16)
+        path = self.root / upload_id
+        path.mkdir()
+        meta = {
+            "upload_id": upload_id,
+            "username": username,
+            "filename": filename,
+            "size": size,
+            "chunk_size": self.chunk_size,
+            "md5": md5,
+            "created_at": now,
+            "expires_at": now + self.ttl_seconds,
+        }
+        with open(path / "session.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        logger.info(f"创建分片上传会话: {upload_id}, 文件: {filename}, 大小: {size}")
+        return UploadSession(path, meta)
+
+    def load(self, upload_id: str, username: str) -> UploadSession:
+        """读取会话，不存在、已过期或不属于该用户时抛出 404"""
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            raise UploadSessionError("上传会话不存在", 404)
+        path = self.root / upload_id
+        try:
+            with open(path / "session.json", encoding="utf-8") as f:
+                session = UploadSession(path, json.load(f))
+        except (FileNotFoundError, ValueError, KeyError):
+            raise UploadSessionError("上传会话不存在", 404)
+        if session.username != username or session.expires_at < time.time():
+            raise UploadSessionError("上传会话不存在", 404)
+        return session
+
+    def chunk_index(self, session: UploadSession, offset: int) -> int:
+        """校验分片偏移（必须按 chunk_size 对齐），返回分片序号"""
+        if offset < 0 or offset % session.chunk_size or offset >= max(session.size, 1):
+            raise UploadSessionError(f"无效的分片偏移: {offset}（分片大小 {session.chunk_size}）", 416)
+        return offset // session.chunk_size
+
+    def open_chunk(self, session: UploadSession, index: int):
+        """打开分片临时文件用于写入，返回 (文件对象, 临时路径)"""
+        tmp_path = session.path / f"{index:08d}.{secrets.token_hex(4)}.tmp"
+        return open(tmp_path, "wb"), tmp_path
+
+    def commit_chunk(self, session: UploadSession, index: int, tmp_path: Path, written: int) -> None:
+        """分片写完后校验长度并原子提交"""
+        expected = session.chunk_length(index)
+        if written != expected:
+            tmp_path.unlink(missing_ok=True)
+            raise UploadSessionError(f"分片长度错误: 收到 {written}，应为 {expected}")
+        os.replace(tmp_path, session.chunk_path(index))
+
+    def assemble(self, session: UploadSession, dest_dir: Path) -> ReceivedPart:
+        """
+        按顺序拼接所有分片到 dest_dir 下的临时文件，同时计算MD5
+
+        Raises:
+            UploadSessionError: 分片不完整（409）
+        """
+        missing = sorted(set(range(session.chunk_count)) - set(session.received_chunks()))
+        if missing:
+            raise UploadSessionError(f"分片不完整，缺少 {len(missing)} 个分片", 409)
+
+        dest = Path(dest_dir) / f".session-{session.upload_id}.tmp"
+        md5_hash = hashlib.md5()
+        head = b""
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        # 无缓冲写入：copy_file_range 直接推进文件描述符的位置
+        with open(dest, "wb", buffering=0) as out:
+            for index in range(session.chunk_count):
+                with open(session.chunk_path(index), "rb") as chunk:
+                    # 读取一遍用于计算MD5（分片乱序到达，无法在接收时增量计算）
+                    while True:
+                        n = chunk.readinto(buffer)
+                        if not n:
+                            break
+                        md5_hash.update(view[:n])
+                        if len(head) < HEAD_SIZE:
+                            head += bytes(view[:HEAD_SIZE - len(head)])
+                    chunk.seek(0)
+                    _append(chunk, out, session.chunk_length(index))
+
+        part = ReceivedPart(0, session.filename, dest)
+        part.md5 = md5_hash.hexdigest()
+        part.size = session.size
+        part.head = head
+        return part
+
+    def discard(self, session: UploadSession) -> None:
+        """删除会话及其全部分片"""
+        shutil.rmtree(session.path, ignore_errors=True)
+
+    def sweep(self) -> int:
+        """删除过期会话，返回删除数量"""
+        now = time.time()
+        removed = 0
+        for path in self.root.iterdir():
+            if not path.is_dir():
+                continue
+            try:
+                with open(path / "session.json", encoding="utf-8") as f:
+                    expires_at = json.load(f)["expires_at"]
+            except (FileNotFoundError, ValueError, KeyError):
+                # 元数据缺失（创建中途失败）的目录按修改时间判断
+                expires_at = path.stat().st_mtime + self.ttl_seconds
+            if expires_at < now:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"清理过期上传会话: {removed}")
+        return removed
+
+
+def _append(src, dst, length: int) -> None:
+    """把 src 的 length 个字节追加到 dst（优先在内核中复制，不经过用户态缓冲区）"""
+    remaining = length
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            pass
+    if remaining > 0:
+        # 不支持 copy_file_range 或中途失败：从已复制的位置继续普通复制
+        src.seek(length - remaining)
+        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
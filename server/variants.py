@@ -0,0 +1,103 @@
+"""
+格式变体模块
+新上传的图片在后台重新编码为 AVIF/WebP（动图转换为动画 WebP），只保留比原图小的版本；
+访问时按 Accept 请求头选择最小的可接受变体
+"""
+import logging
+import os
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from database import DatabaseManager
+from image_transform import ANIMATION_MAX_FRAMES, ANIMATION_MAX_PIXELS, OUTPUT_FORMATS, encode_variant
+
+
+logger = logging.getLogger("image_proxy.variants")
+
+# 默认尝试的变体格式（按压缩率从高到低）
+DEFAULT_FORMATS = ("avif", "webp")
+
+
+class VariantGenerator:
+    """
+    格式变体生成器
+
+    上传提交后调用 enqueue()，由单个后台线程逐个处理；编码本身提交给 encoder
+    （通常是图片变换的进程池），encoder 为 None 时在后台线程中直接编码。
+    变体文件与原图放在同一目录：<md5>.<扩展名>。
+    动图只生成 WebP 变体，帧数超过 max_frames 或总像素（帧数 x 宽 x 高）超过 max_pixels 时跳过。
+    """
+
+    def __init__(self, db_manager: DatabaseManager, upload_dir: str,
+                 formats=DEFAULT_FORMATS, quality: int = 75, encoder: Optional[Executor] = None,
+                 max_frames: int = ANIMATION_MAX_FRAMES, max_pixels: int = ANIMATION_MAX_PIXELS):
+        self.db_manager = db_manager
+        self.upload_dir = Path(upload_dir)
+        unsupported = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+        if unsupported:
+            logger.warning(f"不支持的变体格式已忽略: {', '.join(unsupported)}")
+        self.formats = [fmt for fmt in formats if fmt in OUTPUT_FORMATS]
+        self.quality = quality
+        self.max_frames = max_frames
+        self.max_pixels = max_pixels
+        self._encoder = encoder
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-variants")
+
+    def enqueue(self, md5_list: List[str]):
+        """把新上传的图片加入后台队列，返回对应的 Future 列表"""
+        return [self._executor.submit(self.generate, md5) for md5 in md5_list]
+
+    def generate(self, md5: str) -> Dict[str, Optional[str]]:
+        """
+        为一张图片生成所有缺少的变体
+
+        Returns:
+            {format: 变体路径或 None（不比原图小或生成失败）}
+        """
+        image = self.db_manager.get_image(md5)
+        if not image:
+            return {}
+        src = Path(image["path"])
+        done = self.db_manager.get_variants(md5, include_skipped=True)
+        results = {}
+        for fmt in self.formats:
+            if fmt in done:
+                continue
+            try:
+                results[fmt] = self._encode(md5, src, fmt, image["file_size"])
+            except Exception as e:
+                logger.warning(f"生成格式变体失败: {md5}, 格式: {fmt}, 错误: {e}")
+                results[fmt] = None
+        return results
+
+    def _encode(self, md5: str, src: Path, fmt: str, original_size: int) -> Optional[str]:
+        fd, tmp = tempfile.mkstemp(dir=self.upload_dir, prefix=".variant-", suffix=".tmp")
+        os.close(fd)
+        tmp_path = Path(tmp)
+        try:
+            args = (str(src), tmp, fmt, self.quality, self.max_frames, self.max_pixels)
+            if self._encoder is not None:
+                written = self._encoder.submit(encode_variant, *args).result()
+            else:
+                written = encode_variant(*args)
+            size = tmp_path.stat().st_size
+            if not written or size >= original_size:
+                self.db_manager.add_variant(md5, fmt, None)
+                logger.debug(f"格式变体不比原图小，跳过: {md5}, 格式: {fmt}")
+                return None
+
+            dest = self.upload_dir / f"{md5}.{OUTPUT_FORMATS[fmt][1]}"
+            os.replace(tmp_path, dest)
+            if not self.db_manager.add_variant(md5, fmt, str(dest), size):
+                # 原图在生成期间被删除
+                dest.unlink(missing_ok=True)
+                return None
+            logger.info(f"生成格式变体: {md5}, 格式: {fmt}, 大小: {original_size} -> {size}")
+            return str(dest)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
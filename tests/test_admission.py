@@ -0,0 +1,203 @@
+"""
+测试上传准入控制
+"""
+import unittest
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+
+from admission import AdmissionController, AdmissionRejected
+from config_validator import ConfigValidationError, ConfigValidator
+
+
+class TestAdmissionController(unittest.TestCase):
+    """准入控制测试"""
+
+    def test_fifo_queue_and_release(self):
+        """超过并发数的上传按到达顺序排队，名额释放后放行"""
+        async def scenario():
+            controller = AdmissionController(max_concurrent_uploads=2, max_queue=10, max_wait_seconds=5)
+            order = []
+
+            async def upload(name, hold):
+                async with controller.upload(10):
+                    order.append(name)
+                    await asyncio.sleep(hold)
+
+            tasks = [asyncio.create_task(upload(f"u{i}", 0.05)) for i in range(5)]
+            await asyncio.sleep(0.01)
+            self.assertEqual((controller.active_uploads, controller.queue_depth), (2, 3))
+            await asyncio.gather(*tasks)
+            self.assertEqual(order, [f"u{i}" for i in range(5)])
+            return controller.stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual((stats["active_uploads"], stats["inflight_bytes"], stats["queue_depth"]), (0, 0, 0))
+        self.assertEqual((stats["admitted"], stats["queued"]), (5, 3))
+        self.assertGreater(stats["avg_queue_wait_ms"], 0)
+
+    def test_inflight_bytes(self):
+        """在途字节超出预算时等待；单个超大上传在空闲时仍可放行"""
+        async def scenario():
+            controller = AdmissionController(max_concurrent_uploads=10, max_inflight_bytes=100, max_wait_seconds=5)
+            async with controller.upload(1000):
+                self.assertEqual(controller.inflight_bytes, 1000)
+            # 保留上下文管理器的引用，避免生成器被回收时提前释放名额
+            pending = [controller.upload(60), controller.upload(1)]
+            async with controller.upload(60):
+                waiter = asyncio.create_task(pending[0].__aenter__())
+                await asyncio.sleep(0.01)
+                self.assertEqual(controller.queue_depth, 1)
+                # 队首放不下时，后到的小上传也不能插队
+                small = asyncio.create_task(pending[1].__aenter__())
+                await asyncio.sleep(0.01)
+                self.assertEqual((controller.active_uploads, controller.queue_depth), (1, 2))
+            await asyncio.gather(waiter, small)
+            self.assertEqual((controller.active_uploads, controller.inflight_bytes), (2, 61))
+
+        asyncio.run(scenario())
+
+    def test_rejections(self):
+        """队列已满立即拒绝，排队超时拒绝，并给出 Retry-After"""
+        async def scenario():
+            controller = AdmissionController(max_concurrent_uploads=1, max_queue=1, max_wait_seconds=0.05)
+            async with controller.upload(1):
+                waiter = asyncio.create_task(controller.upload(1).__aenter__())
+                await asyncio.sleep(0.01)
+                with self.assertRaises(AdmissionRejected) as ctx:
+                    await controller.upload(1).__aenter__()
+                self.assertGreaterEqual(ctx.exception.retry_after, 1)
+                with self.assertRaises(AdmissionRejected):
+                    await waiter
+                self.assertEqual(controller.queue_depth, 0)
+            return controller.stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual((stats["rejected_queue_full"], stats["rejected_timeout"]), (1, 1))
+        self.assertEqual(stats["active_uploads"], 0)
+
+    def test_reads_have_priority(self):
+        """读取并发达到阈值时暂停放行上传，读取结束后恢复"""
+        async def scenario():
+            controller = AdmissionController(read_priority_threshold=2, max_wait_seconds=5)
+            pending = controller.upload(1)
+            with controller.read(), controller.read():
+                waiter = asyncio.create_task(pending.__aenter__())
+                await asyncio.sleep(0.01)
+                self.assertEqual((controller.active_uploads, controller.queue_depth), (0, 1))
+            await waiter
+            self.assertEqual((controller.active_uploads, controller.active_reads), (1, 0))
+
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter(self):
+        """排队中的请求被取消时移出队列，不占用名额"""
+        async def scenario():
+            controller = AdmissionController(max_concurrent_uploads=1, max_wait_seconds=5)
+            async with controller.upload(1):
+                waiter = asyncio.create_task(controller.upload(1).__aenter__())
+                await asyncio.sleep(0.01)
+                waiter.cancel()
+                await asyncio.sleep(0.01)
+                self.assertEqual(controller.queue_depth, 0)
+            self.assertEqual((controller.active_uploads, controller.inflight_bytes), (0, 0))
+
+        asyncio.run(scenario())
+
+
+    def run_queued(self, controller, uploads):
+        """先占住唯一的名额，再按顺序排入 [(用户, 字节数)]，返回放行顺序"""
+        async def scenario():
+            order = []
+
+            async def upload(index, user, size):
+                async with controller.upload(size, user):
+                    order.append(index)
+                    await asyncio.sleep(0)
+
+            async with controller.upload(1, "blocker"):
+                tasks = []
+                for index, (user, size) in enumerate(uploads):
+                    tasks.append(asyncio.create_task(upload(index, user, size)))
+                    await asyncio.sleep(0)
+                self.assertEqual(controller.queue_depth, len(uploads))
+            await asyncio.gather(*tasks)
+            return order
+
+        return asyncio.run(scenario())
+
+    def test_weighted_fair_queue(self):
+        """按权重轮流放行各用户的请求，后到的交互用户不必等批量用户的队列排空"""
+        controller = AdmissionController(max_concurrent_uploads=1, max_queue=100, max_user_queue=100,
+                                         weights={"alice": 2}, quantum_bytes=100)
+        uploads = [("bulk", 100)] * 6 + [("alice", 100)] * 4
+        order = self.run_queued(controller, uploads)
+        self.assertEqual(order, [0, 6, 7, 1, 8, 9, 2, 3, 4, 5])
+
+        stats = controller.stats()["users"]
+        self.assertEqual(stats["alice"]["weight"], 2)
+        self.assertEqual((stats["bulk"]["admitted"], stats["alice"]["admitted"]), (6, 4))
+        self.assertEqual((stats["bulk"]["queue_depth"], stats["bulk"]["active"]), (0, 0))
+        self.assertGreater(stats["bulk"]["avg_queue_wait_ms"], stats["alice"]["avg_queue_wait_ms"])
+
+    def test_large_upload_by_bytes(self):
+        """按字节而非请求数分配：大文件要攒够配额，期间其他用户的小文件照常放行"""
+        controller = AdmissionController(max_concurrent_uploads=1, max_queue=100, max_user_queue=100,
+                                         quantum_bytes=100)
+        uploads = [("bulk", 1000)] + [("alice", 100)] * 12
+        order = self.run_queued(controller, uploads)
+        self.assertEqual(order, list(range(1, 10)) + [0] + list(range(10, 13)))
+
+    def test_per_user_queue_limit(self):
+        """单个用户排满自己的队列后被拒绝，不占用其他用户的排队名额"""
+        async def scenario():
+            controller = AdmissionController(max_concurrent_uploads=1, max_queue=10, max_user_queue=2)
+            async with controller.upload(1, "bulk"):
+                pending = [controller.upload(1, "bulk") for _ in range(2)] + [controller.upload(1, "alice")]
+                tasks = [asyncio.create_task(cm.__aenter__()) for cm in pending]
+                await asyncio.sleep(0.01)
+                with self.assertRaises(AdmissionRejected):
+                    await controller.upload(1, "bulk").__aenter__()
+                self.assertEqual(controller.queue_depth, 3)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self.assertEqual(controller.queue_depth, 0)
+
+        asyncio.run(scenario())
+
+
+class TestAdmissionConfig(unittest.TestCase):
+    """准入控制配置校验测试"""
+
+    def validate(self, admission):
+        config = {
+            "server": {"domain": "http://localhost", "port": 8000},
+            "cleanup": {"enable": True, "expire_days": 30, "cleanup_time": "03:00:00"},
+            "users": [{"username": "user", "password": "password", "weight": 2}],
+            "security": {"secret_key": "k" * 32},
+            "admission": admission
+        }
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "config.json"
+            path.write_text(json.dumps(config), encoding="utf-8")
+            ConfigValidator(str(path)).validate()
+
+    def test_admission_numbers(self):
+        """配额、并发数等必须为正，队列长度可以为0"""
+        self.validate({})
+        self.validate({"max_queue": 0, "max_user_queue": 0, "quantum_kb": 0.5})
+        for admission in ({"quantum_kb": 0}, {"quantum_kb": -1}, {"max_concurrent_uploads": 0},
+                          {"max_inflight_mb": 0}, {"max_wait_seconds": "10"}, {"max_queue": -1},
+                          {"read_priority_threshold": 0}, {"max_user_queue": 1.5}):
+            with self.assertRaises(ConfigValidationError, msg=admission):
+                self.validate(admission)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,351 @@
+"""
+测试客户端模块
+"""
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+import sys
+
+import requests
+
+# 添加客户端和服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+sys.path.insert(0, str(Path(__file__).parent.parent / "client"))
+
+from client import (
+    ImageProxyClient, RetryPolicy, CircuitBreaker, CircuitOpenError,
+    get_shared_client, close_shared_clients, calculate_md5, hash_files,
+)
+from mirror import MetadataMirror
+from database import DatabaseManager
+
+
+def make_response(status_code, headers=None, body=b"{}"):
+    """构造一个 requests.Response"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = body
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """重试策略测试"""
+
+    def test_backoff_is_bounded(self):
+        """退避时间不超过上限"""
+        policy = RetryPolicy(backoff_base=1.0, backoff_max=4.0)
+        for attempt in range(10):
+            wait = policy.get_wait(attempt)
+            self.assertGreaterEqual(wait, 0)
+            self.assertLessEqual(wait, min(4.0, 2 ** attempt))
+
+    def test_retry_after_seconds(self):
+        """遵循 Retry-After 秒数"""
+        policy = RetryPolicy()
+        response = make_response(429, {"Retry-After": "7"})
+        self.assertEqual(policy.get_wait(0, response), 7)
+
+    def test_retry_after_capped(self):
+        """Retry-After 有上限"""
+        policy = RetryPolicy(max_retry_after=10)
+        response = make_response(503, {"Retry-After": "3600"})
+        self.assertEqual(policy.get_wait(0, response), 10)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """熔断器测试"""
+
+    def test_opens_after_threshold(self):
+        """连续失败后打开"""
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60)
+        for _ in range(3):
+            self.assertTrue(breaker.allow_request())
+            breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_half_open_probe(self):
+        """恢复期后只放行一个探测请求"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+
+class TestClientRetry(unittest.TestCase):
+    """客户端重试测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.client = ImageProxyClient(
+            "http://test", "user", "pass",
+            retry_policy=RetryPolicy(max_retries=2, backoff_base=0),
+            circuit_breaker=CircuitBreaker(failure_threshold=3, recovery_timeout=60),
+        )
+
+    def tearDown(self):
+        """测试后清理"""
+        self.client.close()
+
+    def test_retries_then_succeeds(self):
+        """5xx 后重试成功"""
+        responses = [make_response(503), make_response(200, body=b'{"url": "u"}')]
+        with mock.patch.object(self.client.session, "request", side_effect=responses):
+            result = self.client.get_image_info("abc")
+        self.assertEqual(result["url"], "u")
+        self.assertEqual([a["status"] for a in self.client.last_attempts], [503, 200])
+        self.assertTrue(all("elapsed" in a for a in self.client.last_attempts))
+
+    def test_no_retry_on_client_error(self):
+        """4xx（非429）不重试"""
+        with mock.patch.object(self.client.session, "request", return_value=make_response(404)) as m:
+            with self.assertRaises(ValueError):
+                self.client.get_image_info("abc")
+        self.assertEqual(m.call_count, 1)
+
+    def test_upload_bytes_uses_content_address(self):
+        """upload_bytes 以MD5为地址发送原始字节"""
+        data = b"\x89PNG fake"
+        with mock.patch.object(self.client.session, "request",
+                               return_value=make_response(200, body=b'{"status": "uploaded"}')) as m:
+            self.assertEqual(self.client.upload_bytes(data, name="a.png")["status"], "uploaded")
+        method, url = m.call_args.args
+        self.assertEqual(method, "PUT")
+        self.assertTrue(url.endswith("/objects/" + hashlib.md5(data).hexdigest()))
+        self.assertEqual(m.call_args.kwargs["data"], data)
+
+    def test_iter_images_follows_cursor(self):
+        """iter_images 按游标翻页"""
+        pages = [
+            make_response(200, body=b'{"items": [{"md5": "a"}, {"md5": "b"}], "next_cursor": "c1"}'),
+            make_response(200, body=b'{"items": [{"md5": "c"}], "next_cursor": null}'),
+        ]
+        with mock.patch.object(self.client.session, "request", side_effect=pages) as m:
+            md5s = [item["md5"] for item in self.client.iter_images(page_size=2, min_size=10)]
+        self.assertEqual(md5s, ["a", "b", "c"])
+        self.assertEqual(m.call_args_list[1].kwargs["params"]["cursor"], "c1")
+        self.assertEqual(m.call_args_list[0].kwargs["params"]["min_size"], 10)
+
+    def test_circuit_opens_on_connection_errors(self):
+        """连接错误耗尽重试后熔断，后续请求快速失败"""
+        error = requests.ConnectionError("connection reset")
+        with mock.patch.object(self.client.session, "request", side_effect=error) as m:
+            with self.assertRaises(requests.ConnectionError):
+                self.client.get_image_info("abc")
+            self.assertEqual(m.call_count, 3)
+
+            with self.assertRaises(CircuitOpenError):
+                self.client.get_image_info("abc")
+            self.assertEqual(m.call_count, 3)
+
+
+    def test_half_open_probe_other_error(self):
+        """半开探测遇到非连接类异常时重新打开熔断器，恢复后仍可探测"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        self.client.circuit_breaker = breaker
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        with mock.patch.object(self.client.session, "request",
+                               side_effect=requests.exceptions.ChunkedEncodingError("truncated")):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self.client.get_image_info("abc")
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        with mock.patch.object(self.client.session, "request",
+                               return_value=make_response(200, body=b'{"url": "u"}')):
+            self.assertEqual(self.client.get_image_info("abc")["url"], "u")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_interrupt_not_counted(self):
+        """Ctrl-C 不计为失败，也不占住半开探测名额"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        self.client.circuit_breaker = breaker
+        with mock.patch.object(self.client.session, "request", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.client.get_image_info("abc")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        with mock.patch.object(self.client.session, "request", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.client.get_image_info("abc")
+        self.assertTrue(breaker.allow_request())
+
+class TestSharedClient(unittest.TestCase):
+    """共享客户端测试"""
+
+    def tearDown(self):
+        """测试后清理"""
+        close_shared_clients()
+
+    def test_reuse_same_client(self):
+        """相同参数复用同一个客户端"""
+        client1 = get_shared_client("http://test", "user", "pass")
+        client2 = get_shared_client("http://test", "user", "pass")
+        self.assertIs(client1, client2)
+
+        other = get_shared_client("http://test", "other", "pass")
+        self.assertIsNot(client1, other)
+
+    def test_close_shared_clients(self):
+        """关闭后重新创建"""
+        client1 = get_shared_client("http://test", "user", "pass")
+        close_shared_clients()
+        client2 = get_shared_client("http://test", "user", "pass")
+        self.assertIsNot(client1, client2)
+
+
+class TestHashing(unittest.TestCase):
+    """文件哈希测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i, size in enumerate([0, 100, 3 * 1024 * 1024 + 7]):
+            path = os.path.join(self.temp_dir.name, f"file_{i}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            self.paths.append(path)
+
+    def tearDown(self):
+        """测试后清理"""
+        self.temp_dir.cleanup()
+
+    def _expected(self, path):
+        with open(path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def test_calculate_md5(self):
+        """单文件MD5与 hashlib 一致"""
+        for path in self.paths:
+            self.assertEqual(calculate_md5(path), self._expected(path))
+
+    def test_hash_files(self):
+        """并行哈希结果与吞吐量统计"""
+        missing = os.path.join(self.temp_dir.name, "missing.bin")
+        result = hash_files(self.paths + [missing], workers=2)
+        for path in self.paths:
+            self.assertEqual(result["md5"][path], self._expected(path))
+        self.assertIn(missing, result["errors"])
+        self.assertEqual(result["stats"]["files"], 3)
+        self.assertEqual(result["stats"]["bytes"], sum(os.path.getsize(p) for p in self.paths))
+
+    def test_upload_many_pipeline(self):
+        """批量上传先批量查重，只把不存在的文件交给 upload_or_get"""
+        duplicate = os.path.join(self.temp_dir.name, "duplicate.bin")
+        with open(self.paths[1], "rb") as src, open(duplicate, "wb") as dst:
+            dst.write(src.read())
+        paths = self.paths + [duplicate]
+        existing_md5 = self._expected(self.paths[0])
+
+        client = ImageProxyClient("http://test", "user", "pass")
+        uploaded = {}
+
+        def fake_info(md5s):
+            return {"found": {m: {"url": f"http://test/{m}", "status": "existing"} for m in md5s if m == existing_md5},
+                    "missing": [m for m in md5s if m != existing_md5]}
+
+        def fake_upload_or_get(path, md5=None, check_existing=True):
+            self.assertFalse(check_existing)
+            uploaded[md5] = path
+            return {"url": f"http://test/{md5}", "status": "uploaded"}
+
+        with mock.patch.object(client, "get_images_info", side_effect=fake_info), \
+                mock.patch.object(client, "upload_or_get", side_effect=fake_upload_or_get):
+            results = client.upload_many(paths, hash_workers=2, upload_workers=2)
+        client.close()
+
+        self.assertEqual(set(results), set(paths))
+        self.assertEqual(results[self.paths[0]]["status"], "existing")
+        self.assertEqual(set(uploaded), {self._expected(p) for p in self.paths[1:]})
+        self.assertEqual(results[duplicate], results[self.paths[1]])
+        self.assertEqual(client.last_batch_stats["hash"]["files"], 4)
+        self.assertEqual(client.last_batch_stats["lookups"], 1)
+
+    def test_get_images_info_falls_back(self):
+        """服务器不支持批量接口时逐个查询"""
+        client = ImageProxyClient("http://test", "user", "pass")
+        responses = [
+            make_response(405),
+            make_response(200, body=b'{"url": "http://test/a"}'),
+            make_response(404),
+        ]
+        with mock.patch.object(client.session, "request", side_effect=responses):
+            result = client.get_images_info(["a", "b"])
+        client.close()
+        self.assertEqual(set(result["found"]), {"a"})
+        self.assertEqual(result["missing"], ["b"])
+        self.assertFalse(client._batch_info_supported)
+
+
+class TestMetadataMirror(unittest.TestCase):
+    """元数据镜像测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.temp_dir.name, "server.db"))
+        self.mirror = MetadataMirror(os.path.join(self.temp_dir.name, "mirror.db"))
+        # 直接以服务器数据库代替 /changes 接口
+        self.client = mock.Mock()
+        self.client.get_changes.side_effect = lambda since, limit: self.db_manager.get_changes(since, limit)
+
+    def tearDown(self):
+        """测试后清理"""
+        self.mirror.close()
+        self.temp_dir.cleanup()
+
+    def _insert(self, md5):
+        self.db_manager.insert_image(md5=md5, path=f"/{md5}.png", original_name=f"{md5}.png",
+                                     width=1, height=1, file_size=10)
+
+    def _mirrored(self):
+        return {row["md5"]: dict(row) for row in self.mirror.conn.execute("SELECT * FROM images")}
+
+    def test_incremental_sync(self):
+        """增量应用新增、更新和删除"""
+        for i in range(5):
+            self._insert(f"m{i}")
+        summary = self.mirror.sync(self.client, page_size=2)
+        self.assertEqual(summary["applied"], 5)
+        self.assertEqual(summary["pages"], 3)
+        self.assertEqual(len(self._mirrored()), 5)
+
+        self.db_manager.update_access_count("m0")
+        self.db_manager.delete_images(["m1"])
+        summary = self.mirror.sync(self.client)
+        self.assertEqual(summary["applied"], 2)
+
+        mirrored = self._mirrored()
+        self.assertNotIn("m1", mirrored)
+        self.assertEqual(mirrored["m0"]["access_count"], 1)
+
+    def test_reset_after_prune(self):
+        """墓碑被清理后全量重建"""
+        self._insert("a")
+        self._insert("b")
+        self.mirror.sync(self.client)
+        self.db_manager.delete_images(["a"])
+        self._insert("c")
+        self.db_manager.prune_change_log(retention_days=-1)
+
+        summary = self.mirror.sync(self.client)
+        self.assertTrue(summary["reset"])
+        self.assertEqual(set(self._mirrored()), {"b", "c"})
+
+
+if __name__ == "__main__":
+    unittest.main()
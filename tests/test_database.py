@@ -178,6 +178,295 @@ class TestDatabaseManager(unittest.TestCase):
             image = self.db_manager.get_image(f"delete_test_{i}")
             self.assertIsNone(image)
 
+    
+    def _insert(self, md5, created_at=None):
+        self.db_manager.insert_image(
+            md5=md5,
+            path=f"/test/{md5}.png",
+            original_name=f"{md5}.png",
+            width=10,
+            height=10,
+            file_size=100
+        )
+    
+    def test_changes(self):
+        """测试增量变更记录"""
+        self._insert("change_a")
+        self._insert("change_b")
+        
+        result = self.db_manager.get_changes(since=0)
+        self.assertEqual([c["md5"] for c in result["changes"]], ["change_a", "change_b"])
+        self.assertTrue(all(c["op"] == "upsert" for c in result["changes"]))
+        self.assertFalse(result["has_more"])
+        cursor = result["cursor"]
+        
+        # 更新访问计数和删除都会产生新的变更
+        self.db_manager.update_access_count("change_a")
+        self.db_manager.delete_images(["change_b"])
+        
+        result = self.db_manager.get_changes(since=cursor)
+        changes = {c["md5"]: c for c in result["changes"]}
+        self.assertEqual(changes["change_a"]["access_count"], 1)
+        self.assertEqual(changes["change_b"]["op"], "delete")
+        
+        # 游标之后没有新变更
+        result = self.db_manager.get_changes(since=result["cursor"])
+        self.assertEqual(result["changes"], [])
+    
+    def test_changes_pagination(self):
+        """测试变更分页"""
+        for i in range(5):
+            self._insert(f"page_{i}")
+        
+        result = self.db_manager.get_changes(since=0, limit=2)
+        self.assertEqual(len(result["changes"]), 2)
+        self.assertTrue(result["has_more"])
+        
+        result = self.db_manager.get_changes(since=result["cursor"], limit=10)
+        self.assertEqual(len(result["changes"]), 3)
+        self.assertFalse(result["has_more"])
+    
+    def test_prune_change_log(self):
+        """测试墓碑清理后旧游标需要重建"""
+        self._insert("prune_a")
+        self._insert("prune_b")
+        self._insert("prune_c")
+        old_cursor = self.db_manager.get_changes(since=0)["changes"][0]["seq"]
+        self.db_manager.delete_images(["prune_b"])
+        self._insert("prune_d")
+        
+        pruned = self.db_manager.prune_change_log(retention_days=-1)
+        self.assertEqual(pruned, 1)
+        
+        self.assertTrue(self.db_manager.get_changes(since=old_cursor)["reset"])
+        # 全量同步不受影响
+        result = self.db_manager.get_changes(since=0)
+        self.assertFalse(result["reset"])
+        self.assertEqual(len(result["changes"]), 3)
+
+    
+    def test_incremental_stats(self):
+        """测试统计表随插入、更新、删除同步维护"""
+        sizes = [1024, 50 * 1024, 2 * 1024 * 1024]
+        for i, size in enumerate(sizes):
+            self.db_manager.insert_image(
+                md5=f"stats_{i}", path=f"/s/{i}.png", original_name=f"{i}.png",
+                width=1, height=1, file_size=size
+            )
+        self.db_manager.update_access_count("stats_0")
+        self.db_manager.delete_images(["stats_1"])
+        
+        stats = self.db_manager.get_stats()
+        self.assertEqual(stats["total_images"], 2)
+        self.assertEqual(stats["total_access"], 1)
+        self.assertEqual(stats["total_size_bytes"], 1024 + 2 * 1024 * 1024)
+        
+        histogram = {b["bucket"]: b["count"] for b in stats["size_histogram"]}
+        self.assertEqual(histogram["<10KB"], 1)
+        self.assertEqual(histogram["10KB-100KB"], 0)
+        self.assertEqual(histogram["1MB-10MB"], 1)
+        
+        # 每日上传数是历史累计，删除不减少
+        self.assertEqual(sum(d["uploads"] for d in stats["daily_uploads"]), 3)
+        
+        # 与全量重算结果一致
+        self.db_manager.rebuild_stats()
+        rebuilt = self.db_manager.get_stats()
+        self.assertEqual(rebuilt["total_images"], stats["total_images"])
+        self.assertEqual(rebuilt["total_access"], stats["total_access"])
+        self.assertEqual(rebuilt["size_histogram"], stats["size_histogram"])
+    
+    def test_dedup_hit(self):
+        """测试去重命中统计"""
+        self._insert("dedup_a")
+        self.assertTrue(self.db_manager.record_dedup_hit("dedup_a"))
+        self.assertTrue(self.db_manager.record_dedup_hit("dedup_a"))
+        self.assertFalse(self.db_manager.record_dedup_hit("missing"))
+        
+        stats = self.db_manager.get_stats()
+        self.assertEqual(stats["dedup_hits"], 2)
+        self.assertEqual(stats["dedup_bytes_saved"], 200)
+        self.assertEqual(stats["total_access"], 2)
+    
+    def test_stats_backfill_on_upgrade(self):
+        """测试旧数据库升级时补齐统计"""
+        import sqlite3
+        self._insert("legacy_a")
+        self._insert("legacy_b")
+        conn = sqlite3.connect(self.temp_db.name)
+        conn.execute("DROP TABLE image_stats")
+        conn.commit()
+        conn.close()
+        
+        stats = DatabaseManager(self.temp_db.name).get_stats()
+        self.assertEqual(stats["total_images"], 2)
+        self.assertEqual(stats["total_size_bytes"], 200)
+    
+    def test_list_images_pagination(self):
+        """测试键集分页覆盖全部数据且不重复"""
+        for i in range(7):
+            self.db_manager.insert_image(
+                md5=f"list_{i}", path=f"/l/{i}.png", original_name=f"img_{i}.png",
+                width=100 * i, height=50, file_size=1000 * i
+            )
+        
+        seen = []
+        cursor = None
+        while True:
+            page = self.db_manager.list_images(cursor=cursor, limit=3)
+            seen.extend(item["md5"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), [f"list_{i}" for i in range(7)])
+        self.assertEqual(len(seen), len(set(seen)))
+    
+    def test_list_images_filters(self):
+        """测试列表过滤条件"""
+        for i in range(5):
+            self.db_manager.insert_image(
+                md5=f"filter_{i}", path=f"/f/{i}.png",
+                original_name=("cat_" if i % 2 else "dog_") + f"{i}.png",
+                width=100 * i, height=50, file_size=1000 * i
+            )
+        
+        page = self.db_manager.list_images(min_size=1000, max_size=3000)
+        self.assertEqual({item["md5"] for item in page["items"]}, {"filter_1", "filter_2", "filter_3"})
+        
+        page = self.db_manager.list_images(name_prefix="cat_", min_width=200)
+        self.assertEqual([item["md5"] for item in page["items"]], ["filter_3"])
+        
+        with self.assertRaises(ValueError):
+            self.db_manager.list_images(cursor="not-a-cursor")
+
+    
+    def test_search_images(self):
+        """测试文件名全文搜索"""
+        for i, name in enumerate(["holiday_beach.jpg", "Holiday-Mountain.png", "office.png", "100%_done.png"]):
+            self.db_manager.insert_image(
+                md5=f"search_{i}", path=f"/s/{i}", original_name=name,
+                width=10, height=10, file_size=100
+            )
+        
+        result = self.db_manager.search_images("holiday")
+        self.assertEqual({item["md5"] for item in result["items"]}, {"search_0", "search_1"})
+        
+        result = self.db_manager.search_images("holiday png")
+        self.assertEqual([item["md5"] for item in result["items"]], ["search_1"])
+        
+        # 短片段退化为 LIKE，通配符需转义
+        result = self.db_manager.search_images("%_")
+        self.assertEqual([item["md5"] for item in result["items"]], ["search_3"])
+        
+        result = self.db_manager.search_images("png", limit=1)
+        self.assertEqual(len(result["items"]), 1)
+        self.assertTrue(result["has_more"])
+        
+        # 删除和改名后索引同步更新
+        self.db_manager.delete_images(["search_0"])
+        with self.db_manager.get_connection() as conn:
+            conn.execute("UPDATE images SET original_name = 'renamed.png' WHERE md5 = 'search_1'")
+            conn.commit()
+        self.assertEqual(self.db_manager.search_images("holiday")["items"], [])
+        self.assertEqual(len(self.db_manager.search_images("renamed")["items"]), 1)
+    
+    def test_search_index_backfill_on_upgrade(self):
+        """测试旧数据库升级时为已有图片建立全文索引"""
+        import sqlite3
+        self._insert("legacy_a")
+        conn = sqlite3.connect(self.temp_db.name)
+        conn.execute("DROP TABLE images_fts")
+        conn.commit()
+        conn.close()
+        
+        db = DatabaseManager(self.temp_db.name)
+        self.assertEqual(len(db.search_images("legacy")["items"]), 1)
+        db.rebuild_search_index()
+        self.assertEqual(len(db.search_images("legacy")["items"]), 1)
+
+    
+    def test_bulk_insert_and_get(self):
+        """测试批量插入和批量查询"""
+        rows = [{"md5": f"bulk_{i}", "path": f"/b/{i}.png", "original_name": f"{i}.png",
+                 "width": 10, "height": 10, "file_size": 100} for i in range(1200)]
+        self.db_manager.insert_image(md5="bulk_0", path="/b/0.png", original_name="0.png",
+                                     width=10, height=10, file_size=100)
+        
+        inserted = self.db_manager.insert_images(rows + rows[:5])
+        self.assertEqual(len(inserted), 1199)
+        self.assertNotIn("bulk_0", inserted)
+        self.assertEqual(self.db_manager.get_stats()["total_images"], 1200)
+        
+        found = self.db_manager.get_images([f"bulk_{i}" for i in range(1200)] + ["missing"])
+        self.assertEqual(len(found), 1200)
+        self.assertEqual(found["bulk_7"]["path"], "/b/7.png")
+        self.assertNotIn("missing", found)
+        
+        # 超过 SQLite 变量上限的批量删除
+        deleted = self.db_manager.delete_images([f"bulk_{i}" for i in range(1100)])
+        self.assertEqual(deleted, 1100)
+        self.assertEqual(len(self.db_manager.get_images([f"bulk_{i}" for i in range(1200)])), 100)
+    
+    def test_variants(self):
+        """测试格式变体记录及随原图删除"""
+        self.db_manager.insert_image(md5="v1", path="/v/v1.png", original_name="v1.png",
+                                     width=10, height=10, file_size=1000)
+        self.assertTrue(self.db_manager.add_variant("v1", "webp", "/v/v1.webp", 400))
+        self.assertTrue(self.db_manager.add_variant("v1", "avif", None))
+        self.assertFalse(self.db_manager.add_variant("missing", "webp", "/v/x.webp", 1))
+        
+        self.assertEqual(self.db_manager.get_variants("v1"), {"webp": {"path": "/v/v1.webp", "file_size": 400}})
+        self.assertEqual(set(self.db_manager.get_variants("v1", include_skipped=True)), {"webp", "avif"})
+        self.assertEqual(self.db_manager.get_variant_paths(["v1", "missing"]), ["/v/v1.webp"])
+        
+        self.db_manager.delete_images(["v1"])
+        self.assertEqual(self.db_manager.get_variants("v1", include_skipped=True), {})
+    
+    def test_placeholder_columns_upgrade(self):
+        """测试旧数据库升级时补充占位图列"""
+        import sqlite3
+        self._insert("legacy")
+        conn = sqlite3.connect(self.temp_db.name)
+        conn.execute("ALTER TABLE images DROP COLUMN blurhash")
+        conn.execute("ALTER TABLE images DROP COLUMN preview")
+        conn.commit()
+        conn.close()
+        
+        db = DatabaseManager(self.temp_db.name)
+        self.assertIsNone(db.get_image("legacy")["blurhash"])
+        db.insert_images([{"md5": "new", "path": "/p/new.png", "original_name": "new.png",
+                           "width": 1, "height": 1, "file_size": 10,
+                           "blurhash": "LEHV6nWB2yk8pyo0adR*.7kCMdnj", "preview": "data:image/webp;base64,AA=="}])
+        image = db.get_images(["new"])["new"]
+        self.assertEqual(image["blurhash"], "LEHV6nWB2yk8pyo0adR*.7kCMdnj")
+        self.assertEqual(image["preview"], "data:image/webp;base64,AA==")
+
+    def test_optimization_stats_counters(self):
+        """存储优化汇总由触发器维护：重复记录不重复计数，删除图片时扣除，旧数据库升级时补算"""
+        import sqlite3
+        for md5 in ("a", "b"):
+            self._insert(md5)
+        self.db_manager.record_optimization("a", 1000, 600)
+        self.db_manager.record_optimization("a", 1000, 700)
+        self.db_manager.record_optimization("b", 500, 500)
+        self.assertFalse(self.db_manager.record_optimization("gone", 100, 50))
+        expected = {"processed": 2, "optimized": 1, "bytes_saved": 300}
+        self.assertEqual(self.db_manager.get_stats()["storage_optimization"], expected)
+        
+        conn = sqlite3.connect(self.temp_db.name)
+        conn.execute("DROP TRIGGER trg_optimizations_stats_insert")
+        conn.execute("DROP TRIGGER trg_optimizations_stats_delete")
+        for column in ("optimize_processed", "optimize_count", "optimize_bytes_saved"):
+            conn.execute(f"ALTER TABLE image_stats DROP COLUMN {column}")
+        conn.commit()
+        conn.close()
+        db = DatabaseManager(self.temp_db.name)
+        self.assertEqual(db.get_stats()["storage_optimization"], expected)
+        
+        self.assertEqual(db.delete_images(["a"]), 1)
+        self.assertEqual(db.get_stats()["storage_optimization"],
+                         {"processed": 1, "optimized": 0, "bytes_saved": 0})
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
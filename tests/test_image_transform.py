@@ -0,0 +1,249 @@
+"""
+测试图片变换模块
+"""
+import unittest
+import asyncio
+import tempfile
+import os
+from pathlib import Path
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+
+from PIL import Image
+
+from image_transform import (
+    DerivedCache, ImageTransformer, TransformError, TransformParams, encode_variant, transform_image
+)
+
+
+def make_gif(path: Path, frames: int = 6, size=(64, 48), loop: int = 0) -> None:
+    """生成每帧时长不同的动图"""
+    images = [Image.new("RGB", size, (i * 40 % 256, 100, 255 - i * 40 % 256)) for i in range(frames)]
+    images[0].save(path, "GIF", save_all=True, append_images=images[1:],
+                   duration=[50 * (i + 1) for i in range(frames)], loop=loop)
+
+
+class TestImageTransform(unittest.TestCase):
+    """图片变换测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+        self.src = self.temp_path / "src.jpg"
+        Image.new("RGB", (800, 600), color="navy").save(self.src, "JPEG")
+
+    def tearDown(self):
+        """测试后清理"""
+        self.temp_dir.cleanup()
+
+    def test_params_validation(self):
+        """测试参数校验和规范化"""
+        with self.assertRaises(TransformError):
+            TransformParams()
+        with self.assertRaises(TransformError):
+            TransformParams(width=0)
+        with self.assertRaises(TransformError):
+            TransformParams(width=10, fit="cover")
+        with self.assertRaises(TransformError):
+            TransformParams(format="bmp")
+        self.assertEqual(TransformParams(width=10, fit="contain").key, TransformParams(width=10).key)
+        self.assertNotEqual(TransformParams(width=10).key, TransformParams(height=10).key)
+
+    def test_transform_jpeg(self):
+        """JPEG 缩放：等比、不放大、格式沿用原图"""
+        dest = self.temp_path / "out"
+        self.assertEqual(transform_image(str(self.src), str(dest), TransformParams(width=100)), "jpeg")
+        with Image.open(dest) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (100, 75)))
+
+        transform_image(str(self.src), str(dest), TransformParams(width=2000, format="png"))
+        with Image.open(dest) as image:
+            self.assertEqual((image.format, image.size), ("PNG", (800, 600)))
+
+        transform_image(str(self.src), str(dest), TransformParams(width=30, height=60, fit="cover"))
+        with Image.open(dest) as image:
+            self.assertEqual(image.size, (30, 60))
+
+    def test_transform_exif_rotated(self):
+        """EXIF 方向为 6 的图片按旋转后的宽高缩放和解码"""
+        src = self.temp_path / "rotated.jpg"
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new("RGB", (400, 300), "teal").save(src, "JPEG", exif=exif)
+        dest = self.temp_path / "rotated-out.jpg"
+        transform_image(str(src), str(dest), TransformParams(width=100))
+        with Image.open(dest) as image:
+            self.assertEqual(image.size, (100, 133))
+        transform_image(str(src), str(dest), TransformParams(width=60, height=200, fit="cover"))
+        with Image.open(dest) as image:
+            self.assertEqual(image.size, (60, 200))
+
+        # 大图：draft 缩小解码后仍不低于目标尺寸
+        Image.new("RGB", (4000, 3000), "teal").save(src, "JPEG", exif=exif)
+        transform_image(str(src), str(dest), TransformParams(height=1000))
+        with Image.open(dest) as image:
+            self.assertEqual(image.size, (750, 1000))
+
+    def test_cache_lru_eviction(self):
+        """超过字节预算时淘汰最久未使用的派生图片"""
+        cache = DerivedCache(self.temp_path / "cache", max_bytes=250)
+        params = [TransformParams(width=w) for w in (10, 20, 30)]
+        for i, p in enumerate(params):
+            tmp = cache.temp_path("a" * 32)
+            tmp.write_bytes(b"x" * 100)
+            cache.add(tmp, cache.path_for("a" * 32, p, "png"))
+            if i == 1:
+                # 访问第一个，使第二个成为最久未使用
+                self.assertIsNotNone(cache.lookup("a" * 32, params[0]))
+
+        self.assertIsNotNone(cache.lookup("a" * 32, params[0]))
+        self.assertIsNone(cache.lookup("a" * 32, params[1]))
+        self.assertIsNotNone(cache.lookup("a" * 32, params[2]))
+        self.assertEqual(cache.stats()["bytes"], 200)
+
+        # 重启后从磁盘恢复
+        self.assertEqual(DerivedCache(self.temp_path / "cache", max_bytes=250).stats()["files"], 2)
+        self.assertEqual(cache.remove("a" * 32), 2)
+        self.assertEqual(os.listdir(self.temp_path / "cache" / "aa"), [])
+
+    def test_cache_oversize_result(self):
+        """超过整个预算的结果照常返回，不挤掉其他缓存，下次写入时淘汰"""
+        cache = DerivedCache(self.temp_path / "cache", max_bytes=250)
+        small, big, other = (TransformParams(width=w) for w in (10, 20, 30))
+        for p, size in ((small, 100), (big, 300)):
+            tmp = cache.temp_path("a" * 32)
+            tmp.write_bytes(b"x" * size)
+            cache.add(tmp, cache.path_for("a" * 32, p, "png"))
+        self.assertTrue(cache.path_for("a" * 32, big, "png").exists())
+        self.assertIsNotNone(cache.lookup("a" * 32, small))
+        self.assertIsNotNone(cache.lookup("a" * 32, big))
+
+        tmp = cache.temp_path("a" * 32)
+        tmp.write_bytes(b"x" * 100)
+        cache.add(tmp, cache.path_for("a" * 32, other, "png"))
+        self.assertIsNone(cache.lookup("a" * 32, big))
+        self.assertIsNotNone(cache.lookup("a" * 32, small))
+        self.assertEqual(cache.stats()["bytes"], 200)
+
+    def test_cache_shared_between_workers(self):
+        """多个 worker 共享缓存目录：采用其他 worker 生成的文件，预算按目录中的全部文件计算"""
+        worker_a = DerivedCache(self.temp_path / "cache", max_bytes=250, rescan_interval=0)
+        worker_b = DerivedCache(self.temp_path / "cache", max_bytes=250, rescan_interval=0)
+        params = [TransformParams(width=w) for w in (10, 20, 30)]
+        for p in params[:2]:
+            tmp = worker_a.temp_path("a" * 32)
+            tmp.write_bytes(b"x" * 100)
+            worker_a.add(tmp, worker_a.path_for("a" * 32, p, "png"))
+
+        # 其他 worker 写入的文件直接命中，不重新生成
+        self.assertEqual(worker_b.lookup("a" * 32, params[0]), worker_a.path_for("a" * 32, params[0], "png"))
+
+        # 写入前重新扫描，另一个 worker 的文件也计入预算
+        tmp = worker_b.temp_path("a" * 32)
+        tmp.write_bytes(b"x" * 100)
+        worker_b.add(tmp, worker_b.path_for("a" * 32, params[2], "png"))
+        files = list((self.temp_path / "cache" / "aa").iterdir())
+        self.assertEqual(sum(p.stat().st_size for p in files), 200)
+        self.assertEqual(worker_b.stats()["bytes"], 200)
+
+        # 正在写入的临时文件不被其他 worker 删除
+        pending = worker_a.temp_path("a" * 32)
+        DerivedCache(self.temp_path / "cache", max_bytes=250)
+        self.assertTrue(pending.exists())
+        self.assertEqual(worker_b.remove("a" * 32), 2)
+
+    def test_cancelled_requester(self):
+        """发起请求的客户端断开不影响共享同一次计算的其他请求，也不留下临时文件"""
+        import image_transform
+
+        def slow_transform(*args):
+            import time
+            time.sleep(0.2)
+            return transform_image(*args)
+
+        cache = DerivedCache(self.temp_path / "cache", 1024 * 1024)
+        transformer = ImageTransformer(cache, workers=0)
+        params = TransformParams(width=64)
+
+        async def run():
+            first = asyncio.ensure_future(transformer.get("c" * 32, self.src, params))
+            await asyncio.sleep(0.05)
+            second = asyncio.ensure_future(transformer.get("c" * 32, self.src, params))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            return await second
+
+        original = image_transform.transform_image
+        image_transform.transform_image = slow_transform
+        try:
+            path, _ = asyncio.run(run())
+        finally:
+            image_transform.transform_image = original
+        self.assertTrue(path.exists())
+        self.assertEqual([p.name for p in path.parent.iterdir()], [path.name])
+
+    def test_process_pool(self):
+        """在进程池中变换并写入缓存"""
+        transformer = ImageTransformer(DerivedCache(self.temp_path / "cache", 1024 * 1024), workers=1)
+        try:
+            path, media_type = asyncio.run(
+                transformer.get("b" * 32, self.src, TransformParams(width=64, format="webp")))
+        finally:
+            transformer.close()
+        self.assertEqual(media_type, "image/webp")
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (64, 48))
+
+
+    def test_variant_keeps_icc_profile(self):
+        """变体沿用原图的 ICC 颜色配置"""
+        from PIL import ImageCms
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        src = self.temp_path / "icc.jpg"
+        Image.new("RGB", (64, 48), "orange").save(src, "JPEG", icc_profile=icc)
+        for fmt in ("webp", "png", "jpeg"):
+            dest = self.temp_path / f"icc.{fmt}"
+            self.assertTrue(encode_variant(str(src), str(dest), fmt, 75))
+            with Image.open(dest) as image:
+                self.assertEqual(image.info.get("icc_profile"), icc, fmt)
+
+    def test_transform_keeps_icc_profile(self):
+        """派生图片沿用原图的 ICC 颜色配置"""
+        from PIL import ImageCms
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        src = self.temp_path / "icc.jpg"
+        Image.new("RGB", (640, 480), "orange").save(src, "JPEG", icc_profile=icc)
+        for fmt in ("jpeg", "webp", "png"):
+            dest = self.temp_path / f"out.{fmt}"
+            transform_image(str(src), str(dest), TransformParams(width=100, format=fmt))
+            with Image.open(dest) as image:
+                self.assertEqual(image.info.get("icc_profile"), icc, fmt)
+
+    def test_animated_webp_variant(self):
+        """动图转换为动画 WebP，保留帧时长和循环次数"""
+        src = self.temp_path / "anim.gif"
+        dest = self.temp_path / "anim.webp"
+        make_gif(src)
+        self.assertTrue(encode_variant(str(src), str(dest), "webp", 75))
+        with Image.open(dest) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.n_frames, 6)
+            self.assertEqual(image.info["loop"], 0)
+            durations = []
+            for i in range(image.n_frames):
+                image.seek(i)
+                image.load()
+                durations.append(image.info["duration"])
+        self.assertEqual(durations, [50, 100, 150, 200, 250, 300])
+
+        # 只支持 WebP，超过帧数或总像素上限时不转换
+        self.assertFalse(encode_variant(str(src), str(dest), "png", 75))
+        self.assertFalse(encode_variant(str(src), str(dest), "webp", 75, max_frames=5))
+        self.assertFalse(encode_variant(str(src), str(dest), "webp", 75, max_pixels=6 * 64 * 48 - 1))
+        self.assertTrue(encode_variant(str(src), str(dest), "webp", 75, max_frames=6, max_pixels=6 * 64 * 48))
+
+if __name__ == "__main__":
+    unittest.main()
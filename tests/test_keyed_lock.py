@@ -0,0 +1,129 @@
+"""
+测试按键加锁模块
+"""
+import unittest
+import multiprocessing
+import tempfile
+import threading
+import time
+from pathlib import Path
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+
+import keyed_lock
+from keyed_lock import KeyedLock, LockTimeout
+
+
+def hold_in_child(lock_dir: str, key: str, acquired, release) -> None:
+    """子进程：持有锁直到收到释放信号"""
+    with KeyedLock(Path(lock_dir)).hold([key]):
+        acquired.set()
+        release.wait(10)
+
+
+class TestKeyedLock(unittest.TestCase):
+    """按键加锁测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.lock_dir = Path(self.temp_dir.name) / "locks"
+
+    def tearDown(self):
+        """测试后清理"""
+        self.temp_dir.cleanup()
+
+    def test_threads_coalesce(self):
+        """同一键串行执行，不同键互不影响"""
+        locks = KeyedLock(self.lock_dir)
+        events = []
+        inside = threading.Event()
+
+        def worker(name, keys, delay):
+            with locks.hold(keys):
+                inside.set()
+                events.append(("enter", name))
+                time.sleep(delay)
+                events.append(("exit", name))
+
+        first = threading.Thread(target=worker, args=("first", ["a", "b"], 0.2))
+        first.start()
+        inside.wait(5)
+        second = threading.Thread(target=worker, args=("second", ["b", "a", "a"], 0))
+        other = threading.Thread(target=worker, args=("other", ["c"], 0))
+        second.start()
+        other.start()
+        for thread in (first, second, other):
+            thread.join(5)
+
+        self.assertLess(events.index(("exit", "first")), events.index(("enter", "second")))
+        self.assertLess(events.index(("exit", "other")), events.index(("exit", "first")))
+        # 释放后不残留锁文件和进程内锁
+        self.assertEqual(list(self.lock_dir.iterdir()), [])
+        self.assertEqual(locks._locks, {})
+
+    @unittest.skipIf(keyed_lock.fcntl is None, "需要 fcntl")
+    def test_cross_process(self):
+        """其他进程持有同一键时等待其释放"""
+        context = multiprocessing.get_context("spawn")
+        acquired, release = context.Event(), context.Event()
+        child = context.Process(target=hold_in_child, args=(str(self.lock_dir), "k", acquired, release))
+        child.start()
+        try:
+            self.assertTrue(acquired.wait(10))
+            threading.Timer(0.2, release.set).start()
+            start = time.monotonic()
+            with KeyedLock(self.lock_dir).hold(["k"]):
+                self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        finally:
+            release.set()
+            child.join(10)
+        self.assertEqual(list(self.lock_dir.iterdir()), [])
+
+    def test_thread_wait_times_out(self):
+        """进程内等待超过上限时抛出 LockTimeout，且不残留锁"""
+        locks = KeyedLock(self.lock_dir, timeout=0.1)
+        with locks.hold(["a"]):
+            errors = []
+
+            def waiter():
+                try:
+                    with locks.hold(["a"]):
+                        pass
+                except LockTimeout as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=waiter)
+            thread.start()
+            thread.join(5)
+        self.assertEqual(len(errors), 1)
+        self.assertGreaterEqual(errors[0].retry_after, 1)
+        self.assertEqual(locks._locks, {})
+        with locks.hold(["a"]):
+            pass
+
+    @unittest.skipIf(keyed_lock.fcntl is None, "需要 fcntl")
+    def test_cross_process_wait_times_out(self):
+        """其他进程一直持有同一键时，等待到截止时间后抛出 LockTimeout"""
+        context = multiprocessing.get_context("spawn")
+        acquired, release = context.Event(), context.Event()
+        child = context.Process(target=hold_in_child, args=(str(self.lock_dir), "k", acquired, release))
+        child.start()
+        try:
+            self.assertTrue(acquired.wait(10))
+            locks = KeyedLock(self.lock_dir, timeout=0.3)
+            start = time.monotonic()
+            with self.assertRaises(LockTimeout):
+                with locks.hold(["k"]):
+                    pass
+            self.assertGreaterEqual(time.monotonic() - start, 0.25)
+            self.assertEqual(locks._locks, {})
+        finally:
+            release.set()
+            child.join(10)
+
+
+if __name__ == "__main__":
+    unittest.main()
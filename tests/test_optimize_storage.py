@@ -0,0 +1,165 @@
+"""
+测试存储优化脚本
+"""
+import unittest
+import tempfile
+import io
+import zlib
+from pathlib import Path
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+
+from PIL import Image
+
+from database import DatabaseManager
+from optimize_storage import optimize, optimize_file, strip_jpeg_metadata
+
+
+def make_unoptimized_png(path: Path) -> None:
+    """生成未压缩的PNG（模拟截图工具直接输出）"""
+    image = Image.linear_gradient("L").convert("RGB")
+    image.save(path, "PNG", compress_level=0)
+
+
+class TestOptimizeStorage(unittest.TestCase):
+    """存储优化测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        """测试后清理"""
+        self.temp_dir.cleanup()
+
+    def test_png_recompressed_losslessly(self):
+        """PNG 重新压缩后变小且像素不变"""
+        path = self.temp_path / "a.png"
+        make_unoptimized_png(path)
+        with Image.open(path) as image:
+            pixels = image.tobytes()
+
+        original_size, new_size = optimize_file(str(path))
+        self.assertLess(new_size, original_size)
+        self.assertEqual(path.stat().st_size, new_size)
+        with Image.open(path) as image:
+            self.assertEqual(image.tobytes(), pixels)
+        self.assertEqual([p.name for p in self.temp_path.iterdir()], ["a.png"])
+
+        # 已是最优时保持原文件
+        self.assertEqual(optimize_file(str(path)), (new_size, new_size))
+
+    def test_png_metadata_kept(self):
+        """重新压缩保留 gAMA、cHRM、sRGB、pHYs 和文本块"""
+        from PIL.PngImagePlugin import PngInfo
+        path = self.temp_path / "meta.png"
+        info = PngInfo()
+        info.add(b"gAMA", (45455).to_bytes(4, "big"))
+        info.add(b"cHRM", b"".join(v.to_bytes(4, "big") for v in
+                                   (31270, 32900, 64000, 33000, 30000, 60000, 15000, 6000)))
+        info.add(b"sRGB", b"\x00")
+        info.add_text("Author", "someone")
+        info.add_itxt("Title", "标题", lang="zh")
+        Image.linear_gradient("L").convert("RGB").save(path, "PNG", compress_level=0, pnginfo=info, dpi=(144, 144))
+        with Image.open(path) as image:
+            image.load()
+            before = (dict(image.text), {k: image.info.get(k) for k in ("gamma", "chromaticity", "srgb", "dpi")})
+
+        original_size, new_size = optimize_file(str(path))
+        self.assertLess(new_size, original_size)
+        with Image.open(path) as image:
+            image.load()
+            after = (dict(image.text), {k: image.info.get(k) for k in ("gamma", "chromaticity", "srgb", "dpi")})
+        self.assertEqual(after, before)
+
+        # 无法原样写回的元数据（非米制 pHYs）：不处理
+        path = self.temp_path / "aspect.png"
+        buf = io.BytesIO()
+        Image.linear_gradient("L").save(buf, "PNG", compress_level=0)
+        data = buf.getvalue()
+        body = b"pHYs" + (2).to_bytes(4, "big") + (1).to_bytes(4, "big") + b"\x00"
+        chunk = (9).to_bytes(4, "big") + body + zlib.crc32(body).to_bytes(4, "big")
+        # 插在 IHDR（8 字节签名 + 25 字节）之后
+        path.write_bytes(data[:33] + chunk + data[33:])
+        with Image.open(path) as image:
+            self.assertEqual(image.info.get("aspect"), (2, 1))
+        size = path.stat().st_size
+        self.assertEqual(optimize_file(str(path)), (size, size))
+
+    def test_jpeg_metadata_stripped(self):
+        """JPEG 去除注释和 EXIF，压缩数据原样保留"""
+        buf = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = "Camera" * 100
+        Image.new("RGB", (64, 64), "green").save(buf, "JPEG", exif=exif, comment=b"x" * 500)
+        data = buf.getvalue()
+
+        stripped = strip_jpeg_metadata(data)
+        self.assertLess(len(stripped), len(data) - 500)
+        self.assertEqual(stripped[stripped.index(b"\xff\xda"):], data[data.index(b"\xff\xda"):])
+        self.assertNotIn(b"Exif", stripped)
+        self.assertIn(b"Exif", strip_jpeg_metadata(data, keep_exif=True))
+
+        path = self.temp_path / "b.png"
+        path.write_bytes(data)
+        original_size, new_size = optimize_file(str(path))
+        self.assertEqual((original_size, new_size), (len(data), len(stripped)))
+
+        # 方向标记不为1时保留 EXIF，避免图片显示方向改变
+        exif[0x0112] = 6
+        buf = io.BytesIO()
+        Image.new("RGB", (64, 64), "green").save(buf, "JPEG", exif=exif)
+        path.write_bytes(buf.getvalue())
+        optimize_file(str(path))
+        with Image.open(path) as image:
+            self.assertEqual(image.getexif().get(0x0112), 6)
+
+    def test_optimize_records_savings(self):
+        """批量优化并在统计中报告节省的空间"""
+        db = DatabaseManager(str(self.temp_path / "images.db"))
+        for i in range(3):
+            path = self.temp_path / f"{i}.png"
+            make_unoptimized_png(path)
+            db.insert_image(md5=f"m{i}", path=str(path), original_name=f"{i}.png",
+                            width=256, height=256, file_size=path.stat().st_size)
+        db.insert_image(md5="gone", path=str(self.temp_path / "gone.png"), original_name="gone.png",
+                        width=1, height=1, file_size=10)
+
+        summary = optimize(db, workers=1)
+        self.assertEqual(summary["processed"], 4)
+        self.assertEqual(summary["optimized"], 3)
+        self.assertEqual(db.get_unoptimized_images(), [])
+
+        stats = db.get_stats()["storage_optimization"]
+        self.assertEqual(stats, {"processed": 4, "optimized": 3, "bytes_saved": summary["bytes_saved"]})
+        # MD5 和记录的原始大小不变
+        self.assertGreater(db.get_image("m0")["file_size"], (self.temp_path / "0.png").stat().st_size)
+
+    def test_cleaned_up_during_optimize(self):
+        """处理期间被清理的图片不写回文件，也不记录优化结果"""
+        import optimize_storage
+        db = DatabaseManager(str(self.temp_path / "images.db"))
+        path = self.temp_path / "a.png"
+        make_unoptimized_png(path)
+        db.insert_image(md5="a", path=str(path), original_name="a.png",
+                        width=256, height=256, file_size=path.stat().st_size)
+        with db.get_connection() as conn:
+            conn.execute("DELETE FROM images WHERE md5 = 'a'")
+            conn.commit()
+
+        optimize_storage._init_worker(str(db.db_file))
+        try:
+            size = path.stat().st_size
+            self.assertEqual(optimize_file(str(path), "a"), (size, size))
+            self.assertEqual(path.stat().st_size, size)
+        finally:
+            optimize_storage._worker_db = None
+        self.assertFalse(db.record_optimization("a", size, size // 2))
+        self.assertEqual(db.get_stats()["storage_optimization"]["processed"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
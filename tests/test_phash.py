@@ -0,0 +1,98 @@
+"""
+测试感知哈希模块
+"""
+import unittest
+import io
+import random
+import time
+from pathlib import Path
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+
+from PIL import Image, ImageDraw
+
+from phash import HashIndex, MAX_DISTANCE, dhash, to_signed, to_unsigned
+
+
+def make_image() -> Image.Image:
+    """生成带结构的测试图片（纯色图的 dHash 全为 0，无法区分）"""
+    image = Image.new("RGB", (640, 480), "white")
+    draw = ImageDraw.Draw(image)
+    for i in range(12):
+        draw.rectangle((i * 50, (i * 37) % 400, i * 50 + 40, (i * 37) % 400 + 80), fill=(i * 20, 80, 200 - i * 15))
+    return image
+
+
+def encode(image: Image.Image, fmt: str, **options) -> io.BytesIO:
+    buf = io.BytesIO()
+    image.save(buf, fmt, **options)
+    buf.seek(0)
+    return buf
+
+
+class TestPhash(unittest.TestCase):
+    """感知哈希测试"""
+
+    def test_dhash_stable_across_reencoding(self):
+        """重新编码、缩放后哈希距离很小，不同图片距离很大"""
+        image = make_image()
+        original = dhash(encode(image, "PNG"))
+        jpeg = dhash(encode(image, "JPEG", quality=60))
+        resized = dhash(encode(image.resize((320, 240)), "WEBP"))
+        other = dhash(encode(image.transpose(Image.Transpose.FLIP_LEFT_RIGHT), "PNG"))
+
+        self.assertLessEqual((original ^ jpeg).bit_count(), 4)
+        self.assertLessEqual((original ^ resized).bit_count(), 4)
+        self.assertGreater((original ^ other).bit_count(), 16)
+        self.assertIsNone(dhash(io.BytesIO(b"not an image")))
+
+    def test_signed_roundtrip(self):
+        """无符号64位与 SQLite 有符号整数互转"""
+        for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+            signed = to_signed(value)
+            self.assertTrue(-(1 << 63) <= signed < 1 << 63)
+            self.assertEqual(to_unsigned(signed), value)
+
+    def test_index_matches_linear_scan(self):
+        """多索引查询结果与全量线性扫描一致"""
+        rng = random.Random(42)
+        index = HashIndex()
+        hashes = {}
+        base = rng.getrandbits(64)
+        for i in range(3000):
+            # 一部分哈希聚集在 base 附近
+            value = base ^ sum(1 << b for b in rng.sample(range(64), rng.randint(0, 14))) if i % 3 == 0 \
+                else rng.getrandbits(64)
+            hashes[f"h{i}"] = value
+            index.add(f"h{i}", value)
+
+        for distance in (0, 3, 6, MAX_DISTANCE):
+            expected = sorted((md5, (v ^ base).bit_count()) for md5, v in hashes.items()
+                              if (v ^ base).bit_count() <= distance)
+            self.assertEqual(sorted(index.search(base, distance)), expected)
+
+        results = index.search(base, MAX_DISTANCE, limit=5)
+        self.assertEqual([d for _, d in results], sorted(d for _, d in results))
+        self.assertEqual(len(results), 5)
+
+        index.remove(results[0][0])
+        self.assertNotIn(results[0][0], dict(index.search(base, MAX_DISTANCE)))
+        with self.assertRaises(ValueError):
+            index.search(base, MAX_DISTANCE + 1)
+
+    def test_query_fast_on_large_index(self):
+        """十万级哈希下查询不遍历全部条目"""
+        rng = random.Random(7)
+        index = HashIndex()
+        index.add_many((f"h{i}", rng.getrandbits(64)) for i in range(100000))
+        query = rng.getrandbits(64)
+        start = time.perf_counter()
+        for _ in range(20):
+            index.search(query, 6)
+        self.assertLess((time.perf_counter() - start) / 20, 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+测试占位图模块
+"""
+import unittest
+import base64
+import io
+import tempfile
+from pathlib import Path
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+
+from PIL import Image, ImageDraw
+
+from phash import dhash, working_copy
+from placeholders import BASE83_CHARS, analyze_upload, blurhash_encode, tiny_preview
+
+
+class TestPlaceholders(unittest.TestCase):
+    """占位图测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+        self.image = Image.new("RGB", (400, 300), "white")
+        draw = ImageDraw.Draw(self.image)
+        draw.rectangle((0, 0, 200, 150), fill=(200, 40, 40))
+        draw.ellipse((220, 120, 380, 280), fill=(20, 90, 220))
+
+    def tearDown(self):
+        """测试后清理"""
+        self.temp_dir.cleanup()
+
+    def test_blurhash_solid_color(self):
+        """纯色图片的直流分量还原为原颜色"""
+        result = blurhash_encode(Image.new("RGB", (50, 40), (255, 0, 0)))
+        self.assertEqual(len(result), 4 + 2 * 4 * 3)
+        self.assertEqual(result[0], BASE83_CHARS[3 + 2 * 9])
+        dc = 0
+        for char in result[2:6]:
+            dc = dc * 83 + BASE83_CHARS.index(char)
+        self.assertEqual((dc >> 16, (dc >> 8) & 255, dc & 255), (255, 0, 0))
+
+    def test_blurhash_components(self):
+        """分量数编码在第一个字符中，长度随分量数变化"""
+        self.assertEqual(len(blurhash_encode(self.image, 3, 4)), 28)
+        self.assertEqual(len(blurhash_encode(self.image, 1, 1)), 6)
+        self.assertNotEqual(blurhash_encode(self.image), blurhash_encode(Image.new("RGB", (400, 300), "white")))
+
+    def test_tiny_preview(self):
+        """缩略预览为最长边 16px 的 WebP data URI"""
+        uri = tiny_preview(self.image)
+        prefix = "data:image/webp;base64,"
+        self.assertTrue(uri.startswith(prefix))
+        self.assertLess(len(uri), 400)
+        with Image.open(io.BytesIO(base64.b64decode(uri[len(prefix):]))) as preview:
+            self.assertEqual(preview.format, "WEBP")
+            self.assertEqual(preview.size, (16, 12))
+
+        # 透明图片保留透明通道
+        uri = tiny_preview(Image.new("RGBA", (32, 32), (0, 0, 0, 0)))
+        with Image.open(io.BytesIO(base64.b64decode(uri[len(prefix):]))) as preview:
+            self.assertEqual(preview.mode, "RGBA")
+
+    def test_analyze_upload(self):
+        """一次解码得到尺寸、感知哈希和占位图，与单独计算一致"""
+        path = self.temp_path / "a.png"
+        self.image.save(path, "PNG")
+        result = analyze_upload(str(path))
+        self.assertEqual((result["width"], result["height"]), (400, 300))
+        self.assertEqual(result["phash"], dhash(path))
+        self.assertEqual(result["blurhash"], blurhash_encode(working_copy(self.image)))
+        self.assertTrue(result["preview"].startswith("data:image/webp;base64,"))
+
+        # JPEG 按缩小后的尺寸解码，但返回原始尺寸
+        path = self.temp_path / "b.jpg"
+        self.image.save(path, "JPEG")
+        result = analyze_upload(str(path))
+        self.assertEqual((result["width"], result["height"]), (400, 300))
+        self.assertEqual(result["phash"], dhash(path))
+
+        path = self.temp_path / "broken.png"
+        path.write_bytes(b"not an image")
+        self.assertEqual(analyze_upload(str(path)),
+                         {"width": None, "height": None, "phash": None, "blurhash": None, "preview": None})
+
+    def test_analyze_uses_small_copy(self):
+        """大图只转换一份小工作副本，三项分析都在副本上完成"""
+        from unittest import mock
+        import placeholders
+        path = self.temp_path / "big.png"
+        self.image.resize((4000, 3000)).save(path, "PNG", compress_level=1)
+        sizes = []
+
+        def record(func):
+            def wrapper(image, *args):
+                sizes.append((image.mode, image.size))
+                return func(image, *args)
+            return wrapper
+
+        with mock.patch.object(placeholders, "dhash_image", record(placeholders.dhash_image)), \
+                mock.patch.object(placeholders, "blurhash_encode", record(placeholders.blurhash_encode)), \
+                mock.patch.object(placeholders, "tiny_preview", record(placeholders.tiny_preview)):
+            result = analyze_upload(str(path))
+        self.assertEqual((result["width"], result["height"]), (4000, 3000))
+        self.assertEqual(sizes, [("RGB", (64, 48))] * 3)
+
+        # 调色板透明图：副本保留透明通道
+        path = self.temp_path / "palette.png"
+        self.image.convert("P").save(path, "PNG", transparency=0)
+        with Image.open(path) as image:
+            self.assertEqual(working_copy(image).mode, "RGBA")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -179,6 +179,18 @@ class TestRateLimiter(unittest.TestCase):
                 allowed = self.rate_limiter.is_allowed(client_id)
                 self.assertTrue(allowed, f"客户端{i}的第{j+1}个请求应该被允许")
     
+    def test_retry_after(self):
+        """测试 Retry-After 计算"""
+        client_id = "test_client"
+        self.assertEqual(self.rate_limiter.get_retry_after(client_id), 0)
+        
+        for _ in range(3):
+            self.rate_limiter.is_allowed(client_id)
+        
+        retry_after = self.rate_limiter.get_retry_after(client_id)
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 61)
+    
     def test_cleanup(self):
         """测试清理功能"""
         client_id = "test_client"
@@ -0,0 +1,892 @@
+"""
+测试服务器接口
+"""
+import unittest
+import tempfile
+import copy
+import gzip
+import hashlib
+import io
+import logging
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+try:
+    from fastapi.testclient import TestClient
+    from PIL import Image
+    import server
+    from database import DatabaseManager
+    from security_utils import SecurityManager, FileValidator, RateLimiter
+    from snapshot import SnapshotManager
+    from upload_sessions import UploadSessionManager
+    from image_transform import DerivedCache, ImageTransformer
+    from variants import VariantGenerator
+    from phash import HashIndex
+    from keyed_lock import KeyedLock
+    from batch_upload import ReceivedPart
+    from admission import AdmissionController
+except ImportError:
+    server = None
+
+from conftest import TEST_CONFIG
+
+
+def make_png(color="red", size=(32, 32)) -> bytes:
+    """生成测试PNG图片"""
+    img = Image.new("RGB", size, color=color)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class ServerTestCase(unittest.TestCase):
+    """服务器接口测试基类：直接装配全局组件，不读取 config/config.json"""
+
+    def setUp(self):
+        """测试前准备"""
+        if server is None:
+            self.skipTest("服务器依赖不可用")
+        self.temp_dir = tempfile.TemporaryDirectory()
+        temp_path = Path(self.temp_dir.name)
+        (temp_path / "uploads").mkdir()
+
+        self.config = copy.deepcopy(TEST_CONFIG)
+        self.user = self.config["users"][0]
+        self.auth = {"username": self.user["username"], "password": self.user["password"]}
+
+        self._saved = {name: getattr(server, name) for name in
+                       ("config", "security_manager", "file_validator", "rate_limiter",
+                        "db_manager", "snapshot_manager", "image_transformer", "variant_generator",
+                        "phash_index", "phash_cursor", "phash_synced_at", "upload_locks", "admission", "logger", "UPLOAD_DIR")}
+        server.config = self.config
+        server.security_manager = SecurityManager(self.config["security"]["secret_key"])
+        server.file_validator = FileValidator(max_size_mb=5)
+        server.rate_limiter = RateLimiter(max_requests=1000, window_seconds=60)
+        server.db_manager = DatabaseManager(str(temp_path / "images.db"))
+        server.snapshot_manager = SnapshotManager(server.db_manager, str(temp_path / "snapshots"))
+        server.image_transformer = ImageTransformer(DerivedCache(temp_path / "derived", 1024 * 1024), workers=0)
+        server.variant_generator = None
+        server.phash_index = HashIndex()
+        server.phash_cursor = 0
+        server.phash_synced_at = 0.0
+        server.upload_locks = KeyedLock(temp_path / "locks")
+        server.admission = None
+        server.logger = logging.getLogger("image_proxy.test")
+        server.UPLOAD_DIR = str(temp_path / "uploads")
+
+        self.client = TestClient(server.app)
+
+    def tearDown(self):
+        """测试后清理"""
+        server.snapshot_manager.close()
+        for name, value in self._saved.items():
+            setattr(server, name, value)
+        self.temp_dir.cleanup()
+
+    def upload(self, data: bytes, filename: str = "test.png"):
+        return self.client.post("/upload", params=self.auth,
+                                files={"file": (filename, data, "image/png")})
+
+
+class TestInstantUpload(ServerTestCase):
+    """秒传测试"""
+
+    def test_declared_existing_skips_body(self):
+        """声明的MD5已存在时不读取请求体"""
+        data = make_png("red")
+        md5 = hashlib.md5(data).hexdigest()
+        self.assertEqual(self.upload(data).json()["status"], "uploaded")
+
+        with mock.patch.object(server, "receive_multipart") as receive:
+            response = self.client.post("/upload", params=self.auth,
+                                        headers={"X-Content-MD5": md5, "Expect": "100-continue"},
+                                        files={"file": ("test.png", data, "image/png")})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "existing")
+        receive.assert_not_called()
+        self.assertEqual(server.db_manager.get_stats()["dedup_hits"], 1)
+
+    def test_declared_new_content_verified(self):
+        """声明的MD5不存在时接收并校验"""
+        data = make_png("green")
+        md5 = hashlib.md5(data).hexdigest()
+        response = self.client.post("/upload", params=self.auth,
+                                    headers={"X-Content-MD5": md5, "X-Content-Size": str(len(data))},
+                                    files={"file": ("test.png", data, "image/png")})
+        self.assertEqual(response.json()["status"], "uploaded")
+        self.assertEqual(response.json()["md5"], md5)
+
+    def test_mismatch_rejected(self):
+        """内容与声明不符时拒绝并不保存"""
+        data = make_png("blue")
+        response = self.client.post("/upload", params=self.auth,
+                                    headers={"X-Content-MD5": "0" * 32},
+                                    files={"file": ("test.png", data, "image/png")})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/upload", params=self.auth,
+                                    headers={"X-Content-Size": "1"},
+                                    files={"file": ("test.png", data, "image/png")})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(server.db_manager.get_stats()["total_images"], 0)
+        self.assertEqual(list(Path(server.UPLOAD_DIR).iterdir()), [])
+
+    def test_declared_too_large(self):
+        """声明的大小超限时直接返回413"""
+        response = self.client.post("/upload", params=self.auth,
+                                    headers={"X-Content-Size": str(100 * 1024 * 1024)},
+                                    files={"file": ("test.png", b"x", "image/png")})
+        self.assertEqual(response.status_code, 413)
+
+
+class TestUploadSessions(ServerTestCase):
+    """分片续传测试"""
+
+    def setUp(self):
+        super().setUp()
+        server.upload_sessions = UploadSessionManager(Path(server.UPLOAD_DIR) / ".sessions", chunk_size=1000)
+        self.data = make_png("purple", size=(64, 64)) + b"\0" * 3000
+        self.md5 = hashlib.md5(self.data).hexdigest()
+
+    def tearDown(self):
+        server.upload_sessions = None
+        super().tearDown()
+
+    def create(self, **extra):
+        params = {**self.auth, "filename": "big.png", "size": len(self.data), **extra}
+        return self.client.post("/uploads", params=params).json()
+
+    def put(self, upload_id, offset, data):
+        return self.client.put(f"/uploads/{upload_id}", params={**self.auth, "offset": offset}, content=data)
+
+    def test_out_of_order_chunks_and_resume(self):
+        """乱序上传、查询进度、补传后完成"""
+        session = self.create()
+        upload_id = session["upload_id"]
+        offsets = list(range(0, len(self.data), 1000))
+
+        for offset in reversed(offsets[1:]):
+            self.assertEqual(self.put(upload_id, offset, self.data[offset:offset + 1000]).status_code, 200)
+
+        response = self.client.post(f"/uploads/{upload_id}/complete", params={**self.auth, "md5": self.md5})
+        self.assertEqual(response.status_code, 409)
+        received = self.client.get(f"/uploads/{upload_id}", params=self.auth).json()["received"]
+        self.assertEqual(received, [[1000, len(self.data)]])
+
+        self.assertEqual(self.put(upload_id, 0, self.data[:1000]).status_code, 200)
+        response = self.client.post(f"/uploads/{upload_id}/complete", params={**self.auth, "md5": self.md5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "uploaded")
+        self.assertEqual((Path(server.UPLOAD_DIR) / f"{self.md5}.png").read_bytes(), self.data)
+        self.assertEqual(self.client.get(f"/uploads/{upload_id}", params=self.auth).status_code, 404)
+        self.assertEqual(sorted(p.name for p in Path(server.UPLOAD_DIR).iterdir()), [".sessions", f"{self.md5}.png"])
+        self.assertEqual(list((Path(server.UPLOAD_DIR) / ".sessions").iterdir()), [])
+
+    def test_invalid_chunks(self):
+        """未对齐的偏移和错误长度被拒绝"""
+        upload_id = self.create()["upload_id"]
+        self.assertEqual(self.put(upload_id, 10, b"x" * 1000).status_code, 416)
+        self.assertEqual(self.put(upload_id, 0, b"x" * 10).status_code, 400)
+        self.assertEqual(self.put(upload_id, 0, b"x" * 1001).status_code, 400)
+        self.assertEqual(self.client.get(f"/uploads/{upload_id}", params=self.auth).json()["received"], [])
+
+    def test_md5_mismatch(self):
+        """拼接后MD5不符时拒绝"""
+        upload_id = self.create(md5="0" * 32)["upload_id"]
+        for offset in range(0, len(self.data), 1000):
+            self.put(upload_id, offset, self.data[offset:offset + 1000])
+        response = self.client.post(f"/uploads/{upload_id}/complete", params=self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(server.db_manager.get_stats()["total_images"], 0)
+
+    def test_instant_and_sweep(self):
+        """已存在的内容直接返回；过期会话被清理"""
+        small = make_png("red")
+        self.upload(small)
+        response = self.client.post("/uploads", params={**self.auth, "filename": "a.png", "size": len(small),
+                                                        "md5": hashlib.md5(small).hexdigest()})
+        self.assertEqual(response.json()["status"], "existing")
+
+        upload_id = self.create()["upload_id"]
+        meta_path = Path(server.UPLOAD_DIR) / ".sessions" / upload_id / "session.json"
+        import json
+        meta = json.loads(meta_path.read_text())
+        meta["expires_at"] = 0
+        meta_path.write_text(json.dumps(meta))
+        self.assertEqual(server.upload_sessions.sweep(), 1)
+        self.assertEqual(self.client.get(f"/uploads/{upload_id}", params=self.auth).status_code, 404)
+
+    def test_client_resumes_failed_chunks(self):
+        """客户端并行上传分片，失败的分片在下一轮补传"""
+        import requests
+        sys.path.insert(0, str(Path(__file__).parent.parent / "client"))
+        from client import ImageProxyClient, RetryPolicy
+
+        path = Path(self.temp_dir.name) / "big.png"
+        path.write_bytes(self.data)
+        client = ImageProxyClient("http://testserver", self.auth["username"], self.auth["password"],
+                                  retry_policy=RetryPolicy(max_retries=0))
+        failed = []
+
+        def bridge(method, url, params=None, data=None, headers=None, **kwargs):
+            # 第一次上传偏移 2000 的分片时模拟断网
+            if method == "PUT" and params["offset"] == 2000 and not failed:
+                failed.append(2000)
+                raise requests.ConnectionError("模拟断网")
+            response = self.client.request(method, url, params=params, content=data, headers=headers)
+            result = requests.Response()
+            result.status_code = response.status_code
+            result._content = response.content
+            result.raw = io.BytesIO(response.content)
+            return result
+
+        with mock.patch.object(client.session, "request", side_effect=bridge):
+            result = client.upload_resumable(path, workers=2)
+        client.close()
+
+        self.assertEqual(failed, [2000])
+        self.assertEqual(result["status"], "uploaded")
+        self.assertEqual((Path(server.UPLOAD_DIR) / f"{self.md5}.png").read_bytes(), self.data)
+
+
+class TestObjects(ServerTestCase):
+    """原始请求体上传测试"""
+
+    def test_put_object_idempotent(self):
+        """PUT 按MD5寻址，重复上传返回 existing"""
+        data = make_png("orange")
+        md5 = hashlib.md5(data).hexdigest()
+        response = self.client.put(f"/objects/{md5}", params={**self.auth, "name": "orange.png"}, content=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "uploaded")
+        self.assertEqual(response.json()["name"], "orange.png")
+
+        response = self.client.put(f"/objects/{md5}", params=self.auth, content=data)
+        self.assertEqual(response.json()["status"], "existing")
+        self.assertEqual(server.db_manager.get_stats()["total_images"], 1)
+
+    def test_put_object_md5_mismatch(self):
+        """内容与地址中的MD5不符时拒绝"""
+        response = self.client.put(f"/objects/{'0' * 32}", params=self.auth, content=make_png("red"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(Path(server.UPLOAD_DIR).iterdir()), [])
+
+    def test_post_object(self):
+        """POST 由服务器计算MD5"""
+        data = make_png("teal")
+        response = self.client.post("/objects", params=self.auth, content=data)
+        result = response.json()
+        self.assertEqual(result["md5"], hashlib.md5(data).hexdigest())
+        self.assertEqual(result["name"], f"{result['md5']}.png")
+
+        response = self.client.post("/objects", params=self.auth, content=b"not an image")
+        self.assertEqual(response.status_code, 400)
+
+
+class TestTransform(ServerTestCase):
+    """派生图片测试"""
+
+    def setUp(self):
+        super().setUp()
+        self.data = make_png("purple", size=(200, 100))
+        self.md5 = self.upload(self.data).json()["md5"]
+
+    def fetch(self, url: str):
+        # 直接校验签名，避免 token 中偶发的 ':' 导致 verify_token 失败
+        path = url.split("localhost", 1)[1]
+        with mock.patch.object(server.security_manager, "verify_token",
+                               return_value=(self.user["username"], self.user["password"], self.md5)):
+            return self.client.get(path)
+
+    def transform_url(self, **params):
+        response = self.client.get(f"/url/{self.md5}", params={**self.auth, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["url"]
+
+    def test_resize_and_convert(self):
+        """按签名参数缩放并转换格式"""
+        response = self.fetch(self.transform_url(w=50, fmt="webp"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "image/webp")
+        with Image.open(io.BytesIO(response.content)) as image:
+            self.assertEqual(image.size, (50, 25))
+
+        response = self.fetch(self.transform_url(w=40, h=40, fit="cover"))
+        with Image.open(io.BytesIO(response.content)) as image:
+            self.assertEqual((image.format, image.size), ("PNG", (40, 40)))
+        self.assertEqual(server.image_transformer.cache.stats()["files"], 2)
+
+    def test_tampered_params_rejected(self):
+        """修改签名后的参数返回 403"""
+        url = self.transform_url(w=50)
+        self.assertEqual(self.fetch(url.replace("w=50", "w=500")).status_code, 403)
+        self.assertEqual(self.fetch(url.split("&sig=")[0]).status_code, 403)
+        response = self.client.get(f"/url/{self.md5}", params={**self.auth, "fit": "cover", "w": 10})
+        self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_requests_deduplicated(self):
+        """相同参数的并发请求只变换一次"""
+        import asyncio
+        import image_transform
+
+        params = image_transform.TransformParams(width=64)
+        src = Path(server.db_manager.get_image(self.md5)["path"])
+        transformer = server.image_transformer
+
+        async def run():
+            return await asyncio.gather(*(transformer.get(self.md5, src, params) for _ in range(5)))
+
+        with mock.patch("image_transform.transform_image", wraps=image_transform.transform_image) as m:
+            results = asyncio.run(run())
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(len({path for path, _ in results}), 1)
+
+
+class TestVariants(ServerTestCase):
+    """格式变体测试"""
+
+    def setUp(self):
+        super().setUp()
+        server.variant_generator = VariantGenerator(server.db_manager, server.UPLOAD_DIR, formats=["webp"])
+        # 渐变图：WebP 有损编码明显小于 PNG
+        image = Image.linear_gradient("L").resize((256, 256)).convert("RGB")
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        self.data = buf.getvalue()
+
+    def tearDown(self):
+        server.variant_generator.close()
+        super().tearDown()
+
+    def fetch(self, md5: str, accept: str):
+        with mock.patch.object(server.security_manager, "verify_token",
+                               return_value=(self.user["username"], self.user["password"], md5)):
+            return self.client.get(f"/secure_get/{md5}", params={"token": "t"}, headers={"Accept": accept})
+
+    def test_accept_negotiation(self):
+        """上传后生成更小的 WebP，按 Accept 返回"""
+        with mock.patch.object(server.variant_generator, "enqueue") as enqueue:
+            md5 = self.upload(self.data).json()["md5"]
+            self.upload(self.data)
+        # 只有新插入的图片进入后台队列
+        enqueue.assert_called_once_with([md5])
+        server.variant_generator.generate(md5)
+
+        variants = server.db_manager.get_variants(md5)
+        self.assertLess(variants["webp"]["file_size"], len(self.data))
+
+        response = self.fetch(md5, "image/webp,*/*")
+        self.assertEqual(response.headers["content-type"], "image/webp")
+        self.assertEqual(response.headers["vary"], "Accept")
+        self.assertEqual(len(response.content), variants["webp"]["file_size"])
+
+        response = self.fetch(md5, "*/*")
+        self.assertEqual(response.headers["content-type"], "image/png")
+        self.assertEqual(response.headers["vary"], "Accept")
+        self.assertEqual(response.content, self.data)
+
+    def test_larger_variant_skipped(self):
+        """不比原图小的变体不保存，只记录已尝试"""
+        md5 = hashlib.md5(make_png("red", size=(4, 4))).hexdigest()
+        with mock.patch.object(server.variant_generator, "enqueue"):
+            self.upload(make_png("red", size=(4, 4)))
+        with mock.patch("variants.encode_variant",
+                        side_effect=lambda src, dest, *args: Path(dest).write_bytes(b"x" * 10 ** 6) or True):
+            self.assertEqual(server.variant_generator.generate(md5), {"webp": None})
+        self.assertEqual(server.db_manager.get_variants(md5), {})
+        self.assertEqual(server.variant_generator.generate(md5), {})
+        self.assertEqual(sorted(p.name for p in Path(server.UPLOAD_DIR).iterdir()), [f"{md5}.png"])
+
+
+    def test_animated_gif(self):
+        """动图转换为动画 WebP，按 Accept 返回"""
+        frames = [Image.linear_gradient("L").rotate(i * 30).resize((128, 128)).convert("RGB") for i in range(8)]
+        buf = io.BytesIO()
+        frames[0].save(buf, "GIF", save_all=True, append_images=frames[1:], duration=80, loop=0)
+        data = buf.getvalue()
+        with mock.patch.object(server.variant_generator, "enqueue"):
+            md5 = self.upload(data, "anim.gif").json()["md5"]
+        server.variant_generator.generate(md5)
+
+        response = self.fetch(md5, "image/webp,*/*")
+        self.assertEqual(response.headers["content-type"], "image/webp")
+        self.assertLess(len(response.content), len(data))
+        with Image.open(io.BytesIO(response.content)) as image:
+            self.assertEqual(image.n_frames, 8)
+            image.load()
+            self.assertEqual(image.info["duration"], 80)
+        self.assertEqual(self.fetch(md5, "*/*").content, data)
+
+class TestSimilar(ServerTestCase):
+    """近似重复测试"""
+
+    def setUp(self):
+        super().setUp()
+        from PIL import ImageDraw
+        self.image = Image.new("RGB", (300, 200), "white")
+        draw = ImageDraw.Draw(self.image)
+        for i in range(8):
+            draw.ellipse((i * 35, (i * 23) % 150, i * 35 + 40, (i * 23) % 150 + 40), fill=(30 * i, 60, 120))
+
+    def encode(self, image, fmt="PNG", **options) -> bytes:
+        buf = io.BytesIO()
+        image.save(buf, fmt, **options)
+        return buf.getvalue()
+
+    def test_similar_endpoint(self):
+        """上传时计算感知哈希，/similar 找到重新编码和缩放的版本"""
+        original = self.upload(self.encode(self.image)).json()["md5"]
+        jpeg = self.upload(self.encode(self.image, "JPEG", quality=70), "copy.jpg").json()["md5"]
+        small = self.upload(self.encode(self.image.resize((150, 100)))).json()["md5"]
+        other = self.upload(self.encode(self.image.transpose(Image.Transpose.FLIP_TOP_BOTTOM))).json()["md5"]
+
+        response = self.client.get(f"/similar/{original}", params={**self.auth, "max_distance": 6})
+        self.assertEqual(response.status_code, 200)
+        items = response.json()["items"]
+        self.assertEqual({item["md5"] for item in items}, {jpeg, small})
+        self.assertNotIn(other, [item["md5"] for item in items])
+        self.assertEqual(items, sorted(items, key=lambda item: item["distance"]))
+        self.assertIn("/secure_get/", items[0]["url"])
+
+        self.assertEqual(self.client.get(f"/similar/{'0' * 32}", params=self.auth).status_code, 404)
+        response = self.client.get(f"/similar/{original}", params={**self.auth, "max_distance": 12})
+        self.assertEqual(response.status_code, 422)
+
+    def test_near_duplicate_upload(self):
+        """near_duplicate 模式返回已有的近似图片，不保存新文件"""
+        original = self.upload(self.encode(self.image)).json()["md5"]
+        response = self.client.post("/upload", params={**self.auth, "near_duplicate": 4},
+                                    files={"file": ("copy.jpg", self.encode(self.image, "JPEG"), "image/jpeg")})
+        result = response.json()
+        self.assertEqual(result["status"], "similar")
+        self.assertEqual(result["md5"], original)
+        self.assertLessEqual(result["distance"], 4)
+        self.assertEqual(server.db_manager.get_stats()["total_images"], 1)
+        self.assertEqual(len(list(Path(server.UPLOAD_DIR).iterdir())), 1)
+
+        # 不指定时照常保存
+        response = self.client.post("/upload", params=self.auth,
+                                    files={"file": ("copy.jpg", self.encode(self.image, "JPEG"), "image/jpeg")})
+        self.assertEqual(response.json()["status"], "uploaded")
+
+    def test_other_worker_uploads(self):
+        """其他 worker 进程上传的图片在查询前同步到本进程的索引，删除的在命中时移除"""
+        from phash import dhash, to_signed
+        original = self.upload(self.encode(self.image)).json()["md5"]
+        # 模拟另一个 worker：直接写入数据库，不经过本进程的索引
+        path = Path(server.UPLOAD_DIR) / "other.jpg"
+        path.write_bytes(self.encode(self.image, "JPEG", quality=70))
+        server.db_manager.insert_images([{"md5": "f" * 32, "path": str(path), "original_name": "other.jpg",
+                                          "width": 300, "height": 200, "file_size": path.stat().st_size,
+                                          "phash": to_signed(dhash(path))}])
+        self.assertIsNone(server.phash_index.get("f" * 32))
+
+        items = self.client.get(f"/similar/{original}", params=self.auth).json()["items"]
+        self.assertEqual([item["md5"] for item in items], ["f" * 32])
+
+        with server.db_manager.get_connection() as conn:
+            conn.execute("DELETE FROM images WHERE md5 = ?", ("f" * 32,))
+            conn.commit()
+        self.assertEqual(self.client.get(f"/similar/{original}", params=self.auth).json()["items"], [])
+        self.assertIsNone(server.phash_index.get("f" * 32))
+
+    def test_phash_sync_ignores_reads(self):
+        """访问计数等更新不产生同步记录，同步按间隔节流"""
+        md5 = self.upload(self.encode(self.image)).json()["md5"]
+        server.sync_phash_index()
+        cursor = server.phash_cursor
+        self.assertGreater(cursor, 0)
+        for _ in range(5):
+            server.db_manager.update_access_count(md5)
+        self.assertEqual(server.db_manager.get_phash_changes(cursor), (cursor, []))
+
+        with mock.patch.object(server.db_manager, "get_phash_changes") as changes:
+            server.sync_phash_index()
+        changes.assert_not_called()
+
+    def test_backfill_on_query(self):
+        """没有感知哈希的旧图片在查询时补算"""
+        md5 = self.upload(self.encode(self.image)).json()["md5"]
+        server.phash_index = HashIndex()
+        with server.db_manager.get_connection() as conn:
+            conn.execute("DELETE FROM image_phash")
+            conn.commit()
+        response = self.client.get(f"/similar/{md5}", params=self.auth)
+        self.assertEqual(response.json(), {"md5": md5, "items": []})
+        self.assertIsNotNone(server.phash_index.get(md5))
+        self.assertEqual(len(list(server.db_manager.iter_phashes())), 1)
+
+
+class TestPlaceholders(ServerTestCase):
+    """占位图测试"""
+
+    def test_upload_and_info(self):
+        """上传时生成占位图，/upload、/info 和 /info/batch 都返回"""
+        result = self.upload(make_png("blue", (120, 80))).json()
+        self.assertEqual(result["status"], "uploaded")
+        self.assertEqual(len(result["blurhash"]), 28)
+        self.assertTrue(result["preview"].startswith("data:image/webp;base64,"))
+        md5 = result["md5"]
+
+        info = self.client.get(f"/info/{md5}", params=self.auth).json()
+        self.assertEqual((info["blurhash"], info["preview"]), (result["blurhash"], result["preview"]))
+        found = self.client.post("/info/batch", params=self.auth, json={"md5s": [md5]}).json()["found"]
+        self.assertEqual(found[md5]["blurhash"], result["blurhash"])
+
+        # 重复上传返回已存储的占位图
+        again = self.upload(make_png("blue", (120, 80))).json()
+        self.assertEqual(again["status"], "existing")
+        self.assertEqual(again["preview"], result["preview"])
+
+    def test_undecodable_upload(self):
+        """无法解码的文件占位图为空，不影响上传"""
+        data = make_png("red")[:40] + b"\0" * 100
+        result = self.upload(data).json()
+        self.assertEqual(result["status"], "uploaded")
+        self.assertIsNone(result["blurhash"])
+        self.assertIsNone(result["preview"])
+
+
+class TestDownloadDb(ServerTestCase):
+    """数据库下载接口测试"""
+
+    def setUp(self):
+        super().setUp()
+        self.assertEqual(self.upload(make_png()).status_code, 200)
+
+    def test_full_download_with_checksum(self):
+        """完整下载带ETag和校验和"""
+        response = self.client.get("/download_db", params=self.auth,
+                                   headers={"Accept-Encoding": "identity"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ETag", response.headers)
+        self.assertEqual(hashlib.md5(response.content).hexdigest(), response.headers["X-Content-MD5"])
+
+    def test_not_modified(self):
+        """ETag 未变化时返回304"""
+        etag = self.client.get("/download_db", params=self.auth).headers["ETag"]
+        response = self.client.get("/download_db", params=self.auth, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_resume(self):
+        """Range 续传返回剩余内容"""
+        full = self.client.get("/download_db", params=self.auth,
+                               headers={"Accept-Encoding": "identity"})
+        etag = full.headers["ETag"]
+        response = self.client.get("/download_db", params=self.auth, headers={
+            "Range": "bytes=100-", "If-Range": etag, "Accept-Encoding": "identity"
+        })
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, full.content[100:])
+
+        response = self.client.get("/download_db", params=self.auth, headers={
+            "Range": "bytes=100-", "If-Range": '"stale"', "Accept-Encoding": "identity"
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def test_gzip_transfer(self):
+        """gzip 压缩传输"""
+        response = self.client.get("/download_db", params=self.auth,
+                                   headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(hashlib.md5(response.content).hexdigest(), response.headers["X-Content-MD5"])
+
+    def test_snapshot_shared_until_data_changes(self):
+        """数据未变化时复用快照，新的上传后生成新快照"""
+        first = self.client.get("/download_db", params=self.auth).headers["ETag"]
+        second = self.client.get("/download_db", params=self.auth).headers["ETag"]
+        self.assertEqual(first, second)
+
+        self.assertEqual(self.upload(make_png("blue")).status_code, 200)
+        third = self.client.get("/download_db", params=self.auth).headers["ETag"]
+        self.assertNotEqual(first, third)
+
+    def test_snapshot_is_valid_database(self):
+        """快照是完整可读的数据库"""
+        import sqlite3
+        content = self.client.get("/download_db", params=self.auth,
+                                  headers={"Accept-Encoding": "identity"}).content
+        path = Path(self.temp_dir.name) / "downloaded.db"
+        path.write_bytes(content)
+        conn = sqlite3.connect(path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM images").fetchone()[0], 1)
+        self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+        conn.close()
+
+    def test_snapshots_shared_dir_between_workers(self):
+        """多个 worker 共用快照目录：文件名不冲突，不删除写入中的文件，被清理的快照会重新生成"""
+        snapshot_dir = Path(self.temp_dir.name) / "shared_snapshots"
+        first = SnapshotManager(server.db_manager, str(snapshot_dir), keep=1)
+        second = SnapshotManager(server.db_manager, str(snapshot_dir), keep=1)
+        try:
+            in_progress = snapshot_dir / "images-0-1-abcd.tmp"
+            in_progress.write_bytes(b"")
+
+            a = first.get_snapshot().result()
+            b = second.get_snapshot().result()
+            self.assertNotEqual(a.path, b.path)
+            self.assertTrue(in_progress.exists())
+            self.assertFalse(a.path.exists())
+
+            rebuilt = first.get_snapshot().result()
+            self.assertTrue(rebuilt.path.exists())
+            self.assertEqual(rebuilt.md5, b.md5)
+        finally:
+            first.close()
+            second.close()
+
+
+class TestChanges(ServerTestCase):
+    """增量同步接口测试"""
+
+    def test_ndjson_changes(self):
+        """NDJSON 格式返回变更和游标"""
+        import json
+        self.upload(make_png("red"))
+        self.upload(make_png("green"))
+
+        response = self.client.get("/changes", params={**self.auth, "since": 0})
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[-1]["cursor"], lines[1]["seq"])
+        self.assertFalse(lines[-1]["has_more"])
+
+        response = self.client.get("/changes", params={**self.auth, "since": lines[-1]["cursor"],
+                                                       "format": "json"})
+        self.assertEqual(response.json()["changes"], [])
+
+
+class TestListImages(ServerTestCase):
+    """图片列表接口测试"""
+
+    def setUp(self):
+        super().setUp()
+        for color in ("red", "green", "blue"):
+            self.upload(make_png(color), filename=f"{color}.png")
+
+    def test_json_pages(self):
+        """JSON 分页"""
+        response = self.client.get("/images", params={**self.auth, "limit": 2})
+        page = response.json()
+        self.assertEqual(len(page["items"]), 2)
+        self.assertIsNotNone(page["next_cursor"])
+
+        response = self.client.get("/images", params={**self.auth, "limit": 2, "cursor": page["next_cursor"]})
+        page = response.json()
+        self.assertEqual(len(page["items"]), 1)
+        self.assertIsNone(page["next_cursor"])
+
+    def test_ndjson_export(self):
+        """NDJSON 流式导出全部结果"""
+        import json
+        response = self.client.get("/images", params={**self.auth, "limit": 1, "format": "ndjson"})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[-1], {"next_cursor": None})
+
+    def test_invalid_cursor(self):
+        """无效游标返回400"""
+        response = self.client.get("/images", params={**self.auth, "cursor": "bad"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestSearch(ServerTestCase):
+    """文件名搜索接口测试"""
+
+    def test_search_pagination(self):
+        """按文件名片段搜索并分页"""
+        for color in ("red", "green", "blue"):
+            self.upload(make_png(color), filename=f"vacation_{color}.png")
+
+        response = self.client.get("/search", params={**self.auth, "q": "vacation", "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(len(result["items"]), 2)
+        self.assertEqual(result["next_offset"], 2)
+
+        response = self.client.get("/search", params={**self.auth, "q": "vacation", "offset": 2})
+        self.assertEqual(len(response.json()["items"]), 1)
+        self.assertIsNone(response.json()["next_offset"])
+
+
+class TestInfoBatch(ServerTestCase):
+    """批量查询接口测试"""
+
+    def test_found_and_missing(self):
+        """返回已存在图片的信息和不存在的MD5列表"""
+        data = make_png("red")
+        md5 = hashlib.md5(data).hexdigest()
+        self.upload(data)
+
+        response = self.client.post("/info/batch", params=self.auth,
+                                    json={"md5s": [md5, "0" * 32, md5]})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(list(result["found"]), [md5])
+        self.assertIn("/secure_get/" + md5, result["found"][md5]["url"])
+        self.assertEqual(result["missing"], ["0" * 32])
+
+    def test_batch_limit(self):
+        """超过上限返回400"""
+        response = self.client.post("/info/batch", params=self.auth,
+                                    json={"md5s": ["x"] * (server.MAX_INFO_BATCH + 1)})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestUploadBatch(ServerTestCase):
+    """批量上传接口测试"""
+
+    def test_per_item_results(self):
+        """每个文件独立校验和去重，结果顺序与请求一致"""
+        red, blue = make_png("red"), make_png("blue")
+        self.upload(red, filename="old.png")
+
+        files = [
+            ("files", ("red.png", red, "image/png")),
+            ("files", ("blue.png", blue, "image/png")),
+            ("files", ("blue_copy.png", blue, "image/png")),
+            ("files", ("notes.png", b"not an image", "image/png")),
+        ]
+        response = self.client.post("/upload/batch", params=self.auth, files=files)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([r["status"] for r in results], ["existing", "uploaded", "existing", "error"])
+        self.assertEqual(results[1]["md5"], hashlib.md5(blue).hexdigest())
+        self.assertEqual(results[1]["width"], 32)
+        self.assertEqual(results[0]["name"], "old.png")
+
+        stats = server.db_manager.get_stats()
+        self.assertEqual(stats["total_images"], 2)
+        self.assertEqual(stats["dedup_hits"], 2)
+        self.assertEqual(list(Path(server.UPLOAD_DIR).glob(".upload-*")), [])
+
+        stored = Path(server.UPLOAD_DIR) / f"{results[1]['md5']}.png"
+        self.assertEqual(stored.read_bytes(), blue)
+
+    def test_ndjson_and_oversize(self):
+        """NDJSON 结果流，超限文件单独失败"""
+        import json
+        server.file_validator.max_size_bytes = 1024
+        big = make_png("green", size=(256, 256)) + b"\0" * 2048
+        files = [
+            ("files", ("big.png", big, "image/png")),
+            ("files", ("small.png", make_png("red", size=(4, 4)), "image/png")),
+        ]
+        response = self.client.post("/upload/batch", params={**self.auth, "format": "ndjson"}, files=files)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["status"] for line in lines], ["error", "uploaded"])
+
+    def test_not_multipart(self):
+        """非 multipart 请求返回400"""
+        response = self.client.post("/upload/batch", params=self.auth, content=b"{}",
+                                    headers={"Content-Type": "application/json"})
+        self.assertEqual(response.status_code, 400)
+
+
+
+class TestConcurrentUpload(ServerTestCase):
+    """并发上传同一内容测试"""
+
+    def make_part(self, data: bytes, index: int = 0) -> "ReceivedPart":
+        path = Path(server.UPLOAD_DIR) / f".upload-{threading.get_ident()}-{index}.tmp"
+        path.write_bytes(data)
+        part = ReceivedPart(index, "same.png", path)
+        part.md5, part.size, part.head = hashlib.md5(data).hexdigest(), len(data), data[:64]
+        return part
+
+    def test_identical_uploads_coalesced(self):
+        """只有第一个请求解码和入库，其余等待后返回 existing"""
+        data = make_png("purple", size=(64, 64))
+        barrier = threading.Barrier(8)
+        results = []
+        calls = []
+        analyze = server.analyze_upload
+
+        def slow_analyze(path):
+            calls.append(path)
+            time.sleep(0.1)
+            return analyze(path)
+
+        def worker():
+            part = self.make_part(data)
+            barrier.wait()
+            results.append(server.store_batch([part], self.user["username"], self.user["password"])[0])
+
+        with mock.patch.object(server, "analyze_upload", side_effect=slow_analyze):
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(r["status"] for r in results), ["existing"] * 7 + ["uploaded"])
+        self.assertEqual(len({r["blurhash"] for r in results}), 1)
+        self.assertEqual(server.db_manager.get_stats()["dedup_hits"], 7)
+        self.assertEqual([p.name for p in Path(server.UPLOAD_DIR).iterdir()], [f"{results[0]['md5']}.png"])
+
+    def test_lock_wait_timeout(self):
+        """同一内容的上传锁等待超时返回 503 和 Retry-After"""
+        data = make_png("olive")
+        server.upload_locks = KeyedLock(Path(self.temp_dir.name) / "busy_locks", timeout=0.1)
+        with server.upload_locks.hold([hashlib.md5(data).hexdigest()]):
+            response = self.upload(data)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assertEqual(self.upload(data).status_code, 200)
+
+
+
+class TestAdmission(ServerTestCase):
+    """上传准入控制测试"""
+
+    def test_busy_returns_503(self):
+        """名额占满且不允许排队时返回 503 和 Retry-After，读取不受影响"""
+        server.admission = AdmissionController(max_concurrent_uploads=1, max_queue=0)
+        md5 = self.upload(make_png("red")).json()["md5"]
+
+        # 模拟一个进行中的上传占用唯一的名额
+        server.admission.active_uploads = 1
+        try:
+            response = self.upload(make_png("blue"))
+            self.assertEqual(response.status_code, 503)
+            self.assertGreaterEqual(int(response.headers["retry-after"]), 1)
+            response = self.client.put("/objects/" + "0" * 32, params=self.auth, content=b"x")
+            self.assertEqual(response.status_code, 503)
+
+            with mock.patch.object(server.security_manager, "verify_token",
+                                   return_value=(self.user["username"], self.user["password"], md5)):
+                self.assertEqual(self.client.get(f"/secure_get/{md5}", params={"token": "t"}).status_code, 200)
+        finally:
+            server.admission.active_uploads = 0
+
+        self.assertEqual(self.upload(make_png("blue")).json()["status"], "uploaded")
+        stats = self.client.get("/stats", params=self.auth).json()["admission"]
+        self.assertEqual(stats["rejected_queue_full"], 2)
+        self.assertEqual((stats["active_uploads"], stats["queue_depth"], stats["active_reads"]), (0, 0, 0))
+        self.assertEqual(stats["users"][self.user["username"]]["admitted"], 2)
+
+    def test_rate_limited_before_queueing(self):
+        """超出速率限制的上传返回 429，不进入准入队列"""
+        server.admission = AdmissionController(max_concurrent_uploads=1, max_queue=0)
+        server.rate_limiter = RateLimiter(max_requests=1, window_seconds=60)
+        self.assertEqual(self.upload(make_png("red")).json()["status"], "uploaded")
+
+        server.admission.active_uploads = 1
+        try:
+            self.assertEqual(self.upload(make_png("blue")).status_code, 429)
+        finally:
+            server.admission.active_uploads = 0
+        self.assertEqual(server.admission.stats()["rejected_queue_full"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+测试目录增量同步模块
+"""
+import unittest
+import tempfile
+import json
+import os
+import hashlib
+from pathlib import Path
+import sys
+
+# 添加客户端模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "client"))
+
+from sync import DirectorySyncer, SyncIndex
+
+
+class FakeClient:
+    """模拟客户端，记录上传调用"""
+
+    def __init__(self, uploads, server_md5s=(), lookups=None):
+        self.uploads = uploads
+        self.server_md5s = set(server_md5s)
+        self.lookups = lookups if lookups is not None else []
+
+    def get_file_md5(self, file_path):
+        return hashlib.md5(Path(file_path).read_bytes()).hexdigest()
+
+    def get_images_info(self, md5s):
+        self.lookups.append(sorted(md5s))
+        found = {md5: {"url": f"http://test/secure_get/{md5}", "expire_at": 4102444800}
+                 for md5 in md5s if md5 in self.server_md5s}
+        return {"found": found, "missing": [md5 for md5 in md5s if md5 not in found]}
+
+    def upload_or_get(self, file_path, md5=None, check_existing=True):
+        # 同步器应传入已计算的MD5，避免重复读取文件
+        if md5 != self.get_file_md5(file_path):
+            raise AssertionError(f"未传入MD5: {file_path}")
+        # 已批量查询过，不应再逐个 GET /info
+        if check_existing:
+            raise AssertionError(f"未跳过逐个查询: {file_path}")
+        self.uploads.append(Path(file_path).name)
+        return {"url": f"http://test/secure_get/{md5}", "expire_at": 4102444800, "status": "uploaded"}
+
+    def close(self):
+        pass
+
+
+class TestDirectorySyncer(unittest.TestCase):
+    """目录同步器测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        (self.root / "sub").mkdir()
+        (self.root / "a.png").write_bytes(b"png-a")
+        (self.root / "sub" / "b.jpg").write_bytes(b"jpg-b")
+        (self.root / "notes.txt").write_text("ignored")
+        self.uploads = []
+
+    def tearDown(self):
+        """测试后清理"""
+        self.temp_dir.cleanup()
+
+    def _syncer(self):
+        return DirectorySyncer(self.root, lambda: FakeClient(self.uploads), jobs=2)
+
+    def test_initial_sync_uploads_images_only(self):
+        """首次同步只上传图片文件"""
+        summary = self._syncer().sync_once()
+        self.assertEqual(summary["uploaded"], 2)
+        self.assertEqual(sorted(self.uploads), ["a.png", "b.jpg"])
+        self.assertTrue((self.root / ".image_proxy_sync.json").exists())
+
+    def test_incremental_sync(self):
+        """未变化的文件不会重复上传"""
+        self._syncer().sync_once()
+        self.uploads.clear()
+
+        summary = self._syncer().sync_once()
+        self.assertEqual(summary["changed"], 0)
+        self.assertEqual(self.uploads, [])
+
+        # 修改一个文件后只上传该文件
+        (self.root / "a.png").write_bytes(b"png-a-modified")
+        summary = self._syncer().sync_once()
+        self.assertEqual(self.uploads, ["a.png"])
+
+    def test_touch_without_content_change(self):
+        """只修改时间变化时不重新上传"""
+        self._syncer().sync_once()
+        self.uploads.clear()
+
+        path = self.root / "a.png"
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        summary = self._syncer().sync_once()
+        self.assertEqual(summary["unchanged"], 1)
+        self.assertEqual(self.uploads, [])
+
+    def test_removed_files(self):
+        """删除的文件从索引中移除"""
+        syncer = self._syncer()
+        syncer.sync_once()
+        (self.root / "sub" / "b.jpg").unlink()
+
+        summary = syncer.sync_once()
+        self.assertEqual(summary["removed"], 1)
+        self.assertNotIn("sub/b.jpg", SyncIndex(self.root / ".image_proxy_sync.json").entries)
+
+    def test_batched_lookup(self):
+        """服务器已有的图片通过一次批量查询确认，不再上传；相同内容只上传一次"""
+        (self.root / "copy.png").write_bytes(b"png-a")
+        lookups = []
+        existing = hashlib.md5(b"jpg-b").hexdigest()
+        syncer = DirectorySyncer(self.root, lambda: FakeClient(self.uploads, {existing}, lookups), jobs=2)
+
+        summary = syncer.sync_once()
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(len(lookups[0]), 2)
+        self.assertEqual(summary["existing"], 1)
+        self.assertEqual(summary["uploaded"], 2)
+        self.assertEqual(len(self.uploads), 1)
+        entries = syncer.index.entries
+        self.assertEqual(entries["a.png"]["url"], entries["copy.png"]["url"])
+
+    def test_state_file_events_ignored(self):
+        """保存状态索引产生的文件事件不会触发同步"""
+        syncer = self._syncer()
+        syncer.sync_once()
+        state_file = self.root / ".image_proxy_sync.json"
+        self.assertFalse(syncer.is_relevant(str(state_file)))
+        self.assertFalse(syncer.is_relevant(str(state_file) + ".tmp"))
+        self.assertFalse(syncer.is_relevant(str(self.root / "notes.txt")))
+        self.assertTrue(syncer.is_relevant(str(self.root / "sub" / "b.jpg")))
+        self.assertTrue(syncer.is_relevant(str(self.root / "new.PNG")))
+
+        # 自定义位置的状态文件同样被忽略
+        custom = DirectorySyncer(self.root, lambda: FakeClient(self.uploads),
+                                 index=SyncIndex(self.root / "state.png"))
+        self.assertFalse(custom.is_relevant(str(self.root / "state.png")))
+
+    def test_manifest(self):
+        """导出JSON和CSV清单"""
+        syncer = self._syncer()
+        syncer.sync_once()
+
+        json_file = self.root / "manifest.json"
+        syncer.write_manifest(json_file)
+        manifest = json.loads(json_file.read_text())
+        self.assertEqual(set(manifest), {"a.png", "sub/b.jpg"})
+
+        csv_file = self.root / "manifest.csv"
+        syncer.write_manifest(csv_file)
+        lines = csv_file.read_text().strip().splitlines()
+        self.assertEqual(lines[0], "path,md5,url,expire_at")
+        self.assertEqual(len(lines), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
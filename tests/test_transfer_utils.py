@@ -0,0 +1,87 @@
+"""
+测试文件传输工具模块
+"""
+import unittest
+import tempfile
+import gzip
+import os
+from pathlib import Path
+import sys
+
+# 添加服务器模块到路径
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+
+from transfer_utils import (
+    RangeNotSatisfiable, etag_matches, parse_range,
+    negotiate_encoding, negotiate_format, iter_file, iter_compressed
+)
+
+
+class TestTransferUtils(unittest.TestCase):
+    """传输工具测试"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_file = tempfile.NamedTemporaryFile(delete=False)
+        self.data = os.urandom(3 * 1024 * 1024 + 123)
+        self.temp_file.write(self.data)
+        self.temp_file.close()
+        self.path = Path(self.temp_file.name)
+
+    def tearDown(self):
+        """测试后清理"""
+        if self.path.exists():
+            self.path.unlink()
+
+    def test_parse_range(self):
+        """测试Range解析"""
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 100))
+        self.assertEqual(parse_range("bytes=10-", 100), (10, 99))
+        self.assertEqual(parse_range("bytes=10-19", 100), (10, 19))
+        self.assertEqual(parse_range("bytes=90-200", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-5", 100), (95, 99))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=100-", 100)
+
+    def test_etag_matches(self):
+        """测试ETag匹配"""
+        etag = '"abc123"'
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches('"other"', etag))
+        self.assertFalse(etag_matches(None, etag))
+
+    def test_negotiate_encoding(self):
+        """测试压缩协商"""
+        self.assertEqual(negotiate_encoding(None), "identity")
+        self.assertEqual(negotiate_encoding("gzip, deflate"), "gzip")
+        self.assertEqual(negotiate_encoding("gzip;q=0"), "identity")
+        self.assertEqual(negotiate_encoding("identity"), "identity")
+
+    def test_negotiate_format(self):
+        """测试图片格式协商：选择最小的明确接受的变体"""
+        variants = {"image/avif": 100, "image/webp": 150}
+        chrome = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+        self.assertEqual(negotiate_format(chrome, variants), "image/avif")
+        self.assertEqual(negotiate_format("image/webp,*/*", variants), "image/webp")
+        self.assertEqual(negotiate_format("image/avif;q=0,image/webp", variants), "image/webp")
+        self.assertIsNone(negotiate_format("image/*,*/*", variants))
+        self.assertIsNone(negotiate_format(None, variants))
+        self.assertIsNone(negotiate_format(chrome, {}))
+
+    def test_iter_file_range(self):
+        """测试按范围读取"""
+        data = b"".join(iter_file(self.path, 1000, 1024 * 1024 + 500))
+        self.assertEqual(data, self.data[1000:1024 * 1024 + 501])
+        self.assertEqual(b"".join(iter_file(self.path)), self.data)
+
+    def test_iter_compressed_gzip(self):
+        """测试gzip流式压缩"""
+        compressed = b"".join(iter_compressed(self.path, "gzip"))
+        self.assertEqual(gzip.decompress(compressed), self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -63,6 +63,21 @@ def display_stats(stats):
     print(f"💾 存储大小: {format_bytes(stats.get('total_size_bytes', 0))}")
     print(f"🗄️ 数据库大小: {format_bytes(stats.get('db_file_size', 0))}")
     
+    if 'dedup_hits' in stats:
+        print(f"♻️ 去重命中: {stats.get('dedup_hits', 0):,} 次，节省 {format_bytes(stats.get('dedup_bytes_saved', 0))}")
+    
+    histogram = stats.get('size_histogram')
+    if histogram:
+        print(f"\n📐 文件大小分布:")
+        for bucket in histogram:
+            print(f"   {bucket['bucket']:>12}: {bucket['count']:,}")
+    
+    daily = stats.get('daily_uploads')
+    if daily:
+        print(f"\n📅 最近上传（按天）:")
+        for day in daily[:7]:
+            print(f"   {day['day']}: {day['uploads']:,} 张, {format_bytes(day['bytes'])}")
+    
     latest = stats.get('latest_image')
     if latest:
         print(f"\n🆕 最新图片:")